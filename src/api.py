@@ -0,0 +1,321 @@
+# api.py
+# API HTTP/JSON (asyncio, sin dependencias) para terminales de escaneo.
+# Lecturas en un pool acotado con conexiones propias por hilo; escrituras por el hilo escritor
+# (writer.py) con group commit. Conexiones keep-alive (HTTP/1.1).
+#
+#   python api.py --host 0.0.0.0 --port 8765 [--db ruta.db] [--token SECRETO]
+
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import database as db
+import writer
+
+MAX_BODY = 8 * 1024 * 1024
+IDLE_TIMEOUT_S = 30.0
+REASONS = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found",
+           405: "Method Not Allowed", 409: "Conflict", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def _int(value, field: str) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise HttpError(400, f"'{field}' debe ser entero")
+
+
+def _lines(payload: dict):
+    """Acepta {"lines": {code: qty}} o {"lines": [{"code":..,"qty":..}] / [[code, qty]]}."""
+    lines = payload.get("lines")
+    if isinstance(lines, dict):
+        return lines
+    if isinstance(lines, list):
+        out = []
+        for it in lines:
+            if isinstance(it, dict):
+                out.append((it.get("code"), it.get("qty")))
+            elif isinstance(it, (list, tuple)) and len(it) == 2:
+                out.append((it[0], it[1]))
+            else:
+                raise HttpError(400, "Línea inválida")
+        return out
+    raise HttpError(400, "Falta 'lines'")
+
+
+class ScannerAPI:
+    def __init__(self, db_path: str | None = None, workers: int = 8, token: str | None = None):
+        self.db_path = db_path
+        self.token = token or None
+        self.workers = max(1, int(workers))
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="api-read")
+        self._slots = None  # asyncio.Semaphore: limita lecturas en vuelo (backpressure)
+        self._local = threading.local()
+        self.routes = {
+            ("GET", "/health"): self.health,
+            ("GET", "/resolve"): self.resolve,
+            ("GET", "/stock"): self.stock,
+            ("POST", "/stock"): self.stock_batch,
+            ("POST", "/docs"): self.post_doc,
+            ("POST", "/docs/batch"): self.post_docs_batch,
+            ("POST", "/transfers"): self.post_transfer,
+            ("POST", "/aliases"): self.post_aliases,
+        }
+
+    # ---------- ejecución ----------
+    def _read_conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = db.open_connection(self.db_path)
+            conn.isolation_level = None  # solo lectura: autocommit, sin transacciones abiertas
+            self._local.conn = conn
+        return conn
+
+    def _run_read(self, fn, *args):
+        c = self._read_conn().cursor()
+        try:
+            return fn(c, *args)
+        finally:
+            c.close()
+
+    async def read(self, fn, *args):
+        async with self._slots:
+            return await asyncio.get_running_loop().run_in_executor(self._pool, self._run_read, fn, *args)
+
+    async def write(self, fut):
+        return await asyncio.wrap_future(fut)
+
+    # ---------- endpoints ----------
+    async def health(self, query, payload):
+        return {"ok": True, "writer": dict(writer.get_writer().stats)}
+
+    async def resolve(self, query, payload):
+        code = (query.get("code") or "").strip()
+        if not code:
+            raise HttpError(400, "Falta 'code'")
+        found = await self.read(db._lookup_stock_c, [code])
+        if code not in found:
+            raise HttpError(404, f"Código/alias '{code}' no existe")
+        p = found[code]
+        return {"code": p["code"], "name": p["name"], "product_id": p["product_id"]}
+
+    async def stock(self, query, payload):
+        code = (query.get("code") or "").strip()
+        wid = _int(query["warehouse_id"], "warehouse_id") if query.get("warehouse_id") else None
+        found = await self.read(db._lookup_stock_c, [code], wid)
+        if code not in found:
+            raise HttpError(404, f"Código/alias '{code}' no existe")
+        return self._stock_item(found[code])
+
+    async def stock_batch(self, query, payload):
+        codes = [str(x).strip() for x in (payload.get("codes") or []) if str(x).strip()]
+        wid = _int(payload["warehouse_id"], "warehouse_id") if payload.get("warehouse_id") else None
+        found = await self.read(db._lookup_stock_c, codes, wid)
+        return {"items": {k: self._stock_item(v) for k, v in found.items()},
+                "missing": [x for x in codes if x not in found]}
+
+    @staticmethod
+    def _stock_item(p: dict) -> dict:
+        return {"code": p["code"], "name": p["name"],
+                "stock": {str(w): q for w, q in p["stock"].items()},
+                "qty": sum(p["stock"].values())}
+
+    def _submit_doc(self, d: dict):
+        return writer.post_doc(
+            str(d.get("type") or d.get("doc_type") or ""), _int(d.get("warehouse_id"), "warehouse_id"),
+            _lines(d), d.get("counterparty") or "", d.get("reference") or "", d.get("note") or "",
+            d.get("series"), d.get("user_id"),
+        )
+
+    async def post_doc(self, query, payload):
+        return {"doc_id": await self.write(self._submit_doc(payload))}
+
+    async def post_docs_batch(self, query, payload):
+        docs = payload.get("docs")
+        if not isinstance(docs, list):
+            raise HttpError(400, "Falta 'docs'")
+        # Todos se encolan juntos: el escritor los confirma en uno o pocos commits
+        pending = []
+        for d in docs:
+            try:
+                pending.append(self._submit_doc(d if isinstance(d, dict) else {}))
+            except HttpError as ex:
+                pending.append(ex)
+        results = []
+        for p in pending:
+            if isinstance(p, Exception):
+                results.append({"ok": False, "error": str(p)})
+                continue
+            try:
+                results.append({"ok": True, "doc_id": await self.write(p)})
+            except ValueError as ex:
+                results.append({"ok": False, "error": str(ex)})
+        return {"results": results}
+
+    async def post_transfer(self, query, payload):
+        fut = writer.post_transfer(
+            _int(payload.get("src_warehouse_id"), "src_warehouse_id"),
+            _int(payload.get("dst_warehouse_id"), "dst_warehouse_id"),
+            _lines(payload), payload.get("note") or "Transferencia",
+            payload.get("reference") or "", payload.get("counterparty") or "", payload.get("user_id"),
+        )
+        return {"doc_id": await self.write(fut)}
+
+    async def post_aliases(self, query, payload):
+        """{"aliases": {alias: código} o [[alias, código]] / [{"alias":..,"code":..}]} -> reporte de carga."""
+        items = payload.get("aliases")
+        if isinstance(items, dict):
+            pairs = list(items.items())
+        elif isinstance(items, list):
+            pairs = []
+            for it in items:
+                if isinstance(it, dict):
+                    pairs.append((it.get("alias") or it.get("alt_code"), it.get("code")))
+                elif isinstance(it, (list, tuple)) and len(it) == 2:
+                    pairs.append((it[0], it[1]))
+                else:
+                    raise HttpError(400, "Alias inválido")
+        else:
+            raise HttpError(400, "Falta 'aliases'")
+        return await self.write(writer.import_aliases(pairs))
+
+    async def count_lines(self, method: str, session_id: int, payload):
+        if method == "GET":
+            rows = await self.read(lambda c: db._list_count_lines_c(c, session_id))
+            return {"lines": [{"code": a, "sys_qty": b, "counted_qty": q} for a, b, q in rows]}
+        counted = _lines(payload)
+        return {"updated": await self.write(writer.set_count_lines(session_id, counted))}
+
+    # ---------- HTTP ----------
+    async def dispatch(self, method: str, target: str, headers: dict, body: bytes) -> tuple[int, dict]:
+        if self.token and headers.get("x-api-token") != self.token:
+            raise HttpError(401, "Token inválido")
+        url = urlsplit(target)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        payload = {}
+        if body:
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                raise HttpError(400, "JSON inválido")
+            if not isinstance(payload, dict):
+                raise HttpError(400, "Se esperaba un objeto JSON")
+        path = url.path.rstrip("/") or "/"
+
+        parts = path.strip("/").split("/")
+        if len(parts) == 3 and parts[0] == "counts" and parts[2] == "lines":
+            if method not in ("GET", "POST"):
+                raise HttpError(405, "Método no permitido")
+            return 200, await self.count_lines(method, _int(parts[1], "session_id"), payload)
+
+        handler = self.routes.get((method, path))
+        if handler is None:
+            if any(p == path for _, p in self.routes):
+                raise HttpError(405, "Método no permitido")
+            raise HttpError(404, "Ruta no encontrada")
+        return 200, await handler(query, payload)
+
+    async def handle(self, reader: asyncio.StreamReader, w: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), IDLE_TIMEOUT_S)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, asyncio.LimitOverrunError):
+                    break
+                lines = head.decode("latin-1").split("\r\n")
+                try:
+                    method, target, version = lines[0].split(" ", 2)
+                except ValueError:
+                    break
+                headers = {}
+                for ln in lines[1:]:
+                    if ":" in ln:
+                        k, v = ln.split(":", 1)
+                        headers[k.strip().lower()] = v.strip()
+                conn_hdr = headers.get("connection", "").lower()
+                keep = (version == "HTTP/1.1" and conn_hdr != "close") or conn_hdr == "keep-alive"
+
+                status, data = 200, {}
+                try:
+                    length = int(headers.get("content-length") or 0)
+                    if length > MAX_BODY:
+                        keep = False
+                        raise HttpError(413, "Cuerpo demasiado grande")
+                    body = await reader.readexactly(length) if length else b""
+                    status, data = await self.dispatch(method.upper(), target, headers, body)
+                except HttpError as ex:
+                    status, data = ex.status, {"error": str(ex)}
+                except ValueError as ex:  # reglas de negocio (database.py)
+                    status, data = 400, {"error": str(ex)}
+                except sqlite3.IntegrityError as ex:  # triggers (existencia negativa, almacén en borrado)
+                    status, data = 409, {"error": str(ex)}
+                except asyncio.IncompleteReadError:
+                    break
+                except Exception as ex:
+                    status, data = 500, {"error": f"{type(ex).__name__}: {ex}"}
+
+                out = json.dumps(data, ensure_ascii=False, default=str).encode("utf-8")
+                w.write(
+                    f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                    f"Content-Type: application/json; charset=utf-8\r\n"
+                    f"Content-Length: {len(out)}\r\n"
+                    f"Connection: {'keep-alive' if keep else 'close'}\r\n\r\n".encode("latin-1") + out
+                )
+                await w.drain()
+                if not keep:
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            try:
+                w.close()
+            except Exception:
+                pass
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8765, ready=None):
+        self._slots = asyncio.Semaphore(self.workers * 4)
+        server = await asyncio.start_server(self.handle, host, port, backlog=512)
+        if ready is not None:
+            ready(server)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="API HTTP/JSON de almacén para escáneres")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--db", default=None, help="Ruta a la base (por defecto almacen.db)")
+    ap.add_argument("--workers", type=int, default=8, help="Hilos de lectura")
+    ap.add_argument("--token", default=os.environ.get("ALMACEN_API_TOKEN"),
+                    help="Si se indica, se exige en el encabezado X-Api-Token")
+    args = ap.parse_args(argv)
+
+    db.init_db(args.db)
+    api = ScannerAPI(db._db_path, workers=args.workers, token=args.token)
+    print(f"API escuchando en http://{args.host}:{args.port}")
+    try:
+        asyncio.run(api.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        api.close()
+        writer.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+# backup.py
+# Respaldo en línea con el API de backup de SQLite: copia en pasos de pocas páginas con pausas
+# entre pasos (las estaciones siguen escaneando), verifica la copia, la comprime si se pide y rota
+# las viejas. Incluye la restauración (con verificación de integridad antes y después).
+
+import datetime
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+
+import database as db
+
+BACKUP_DIR = os.path.join(os.path.dirname(__file__), "backups")
+BACKUP_KEEP = 7          # respaldos que se conservan al rotar
+BACKUP_PAGES = 64        # páginas por paso (4 KB c/u: ~256 KB por paso)
+BACKUP_SLEEP_S = 0.02    # pausa entre pasos: deja pasar a las escrituras
+BACKUP_MAX_RESTARTS = 5  # si la base cambia tanto que la copia reinicia N veces, se termina en un solo paso
+_PREFIX = "almacen-"
+
+
+class _Restarted(Exception):
+    pass
+
+
+def _copy(src: sqlite3.Connection, dst: sqlite3.Connection, pages: int, sleep: float, progress=None):
+    """
+    Copia por pasos. Un COMMIT de otra conexión a mitad de la copia la reinicia; tras
+    BACKUP_MAX_RESTARTS se completa en un paso (en WAL una lectura no bloquea a los escritores).
+    """
+    state = {"restarts": 0, "remaining": None}
+
+    def _progress(status, remaining, total):
+        if state["remaining"] is not None and remaining > state["remaining"]:
+            state["restarts"] += 1
+            if state["restarts"] >= BACKUP_MAX_RESTARTS:
+                raise _Restarted()
+        state["remaining"] = remaining
+        if progress:
+            progress(total - remaining, total)
+
+    try:
+        src.backup(dst, pages=max(1, int(pages)), sleep=sleep, progress=_progress)
+    except _Restarted:
+        src.backup(dst, pages=-1)
+    return state["restarts"]
+
+
+def _integrity(path: str) -> list[str]:
+    conn = sqlite3.connect(path)
+    try:
+        return [r[0] for r in conn.execute("PRAGMA integrity_check").fetchall()]
+    finally:
+        conn.close()
+
+
+def list_backups(dest_dir: str | None = None) -> list[str]:
+    """Respaldos del directorio, del más nuevo al más viejo."""
+    dest_dir = dest_dir or BACKUP_DIR
+    if not os.path.isdir(dest_dir):
+        return []
+    names = [n for n in os.listdir(dest_dir)
+             if n.startswith(_PREFIX) and (n.endswith(".db") or n.endswith(".db.gz"))]
+    return [os.path.join(dest_dir, n) for n in sorted(names, reverse=True)]
+
+
+def rotate(dest_dir: str | None = None, keep: int = BACKUP_KEEP) -> list[str]:
+    """Borra los respaldos que exceden `keep`. Devuelve los borrados."""
+    old = list_backups(dest_dir)[max(0, int(keep)):]
+    for path in old:
+        os.remove(path)
+    return old
+
+
+def backup_now(dest_dir: str | None = None, keep: int = BACKUP_KEEP, compress: bool = False,
+               pages: int = BACKUP_PAGES, sleep: float = BACKUP_SLEEP_S, progress=None,
+               source: str | None = None) -> str:
+    """
+    Respaldo en línea de la base actual (o `source`) a `dest_dir` (almacen-AAAAMMDD-HHMMSS.db[.gz]).
+    Usa su propia conexión de lectura: no toma el candado de escritura ni la conexión de la UI.
+    Devuelve la ruta del respaldo.
+    """
+    dest_dir = dest_dir or BACKUP_DIR
+    os.makedirs(dest_dir, exist_ok=True)
+    stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    final = os.path.join(dest_dir, f"{_PREFIX}{stamp}.db" + (".gz" if compress else ""))
+    part = os.path.join(dest_dir, f"{_PREFIX}{stamp}.part")
+
+    src = db.open_connection(source)
+    dst = sqlite3.connect(part)
+    try:
+        _copy(src, dst, pages, sleep, progress)
+    except BaseException:
+        dst.close()
+        os.remove(part)
+        raise
+    finally:
+        src.close()
+    dst.close()
+
+    check = _integrity(part)
+    if check != ["ok"]:
+        os.remove(part)
+        raise RuntimeError(f"El respaldo no pasó integrity_check: {', '.join(check[:3])}")
+    if compress:
+        with open(part, "rb") as f, gzip.open(final, "wb", compresslevel=6) as g:
+            shutil.copyfileobj(f, g, 1024 * 1024)
+        os.remove(part)
+    else:
+        os.replace(part, final)
+    rotate(dest_dir, keep)
+    return final
+
+
+def restore(backup_path: str, target: str | None = None, safety_dir: str | None = None) -> str | None:
+    """
+    Restaura `backup_path` (.db o .db.gz) sobre la base `target` (la actual por defecto).
+    Antes verifica la integridad del respaldo (ValueError si falla) y, si el destino existe,
+    toma un respaldo de seguridad del estado actual. Devuelve la ruta de ese respaldo (o None).
+    """
+    if not os.path.exists(backup_path):
+        raise ValueError(f"No existe el respaldo: {backup_path}")
+    tmp = None
+    src_path = backup_path
+    if backup_path.endswith(".gz"):
+        fd, tmp = tempfile.mkstemp(suffix=".db")
+        with os.fdopen(fd, "wb") as f, gzip.open(backup_path, "rb") as g:
+            shutil.copyfileobj(g, f, 1024 * 1024)
+        src_path = tmp
+    try:
+        try:
+            check = _integrity(src_path)
+        except sqlite3.DatabaseError as ex:
+            check = [str(ex)]
+        if check != ["ok"]:
+            raise ValueError(f"Respaldo dañado: {', '.join(check[:3])}")
+        conn = sqlite3.connect(src_path)
+        try:
+            tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        finally:
+            conn.close()
+        if not {"products", "warehouses", "product_stock"} <= tables:
+            raise ValueError("El archivo no es un respaldo de almacén")
+
+        target = target or db._db_path or db.DB_FILE
+        safety = None
+        if target == db._db_path or os.path.exists(target):
+            safety = backup_now(safety_dir or os.path.join(BACKUP_DIR, "pre-restore"), source=target)
+        src = sqlite3.connect(src_path)
+        dst = db.open_connection(target)
+        try:
+            src.backup(dst)  # en una sola transacción del destino: o queda completo o no cambia
+            check = [r[0] for r in dst.execute("PRAGMA integrity_check").fetchall()]
+        finally:
+            src.close()
+            dst.close()
+        if check != ["ok"]:
+            raise RuntimeError(f"La base restaurada no pasó integrity_check: {', '.join(check[:3])}")
+        return safety
+    finally:
+        if tmp:
+            os.remove(tmp)
+
+
+# ---------- servicio periódico ----------
+class BackupService:
+    """Hilo que respalda cada `interval_s` segundos (el primero al cumplirse el primer intervalo)."""
+
+    def __init__(self, interval_s: float, dest_dir: str | None = None, keep: int = BACKUP_KEEP,
+                 compress: bool = True):
+        self.interval_s = max(60.0, float(interval_s))
+        self.dest_dir = dest_dir
+        self.keep = keep
+        self.compress = compress
+        self.last_path = None
+        self.last_error = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="almacen-backup", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: float | None = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval_s):
+            try:
+                self.last_path = backup_now(self.dest_dir, self.keep, self.compress)
+                self.last_error = None
+            except Exception as ex:
+                self.last_error = str(ex)
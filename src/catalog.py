@@ -0,0 +1,374 @@
+# catalog.py
+# Catálogo compartido en columnas: códigos, nombres y descripciones (y sus llaves de búsqueda
+# ya normalizadas) van en un solo str por columna con offsets en arrays; existencias por
+# almacén en arrays. Las vistas son índices de fila y solo se arman dicts para lo que se muestra.
+
+import threading
+from array import array
+from bisect import bisect_right
+
+import database as db
+import events
+from helpers import norm_text
+
+_SEP = "\n"
+REFINE_RATIO = 4  # refina sobre el resultado previo si tiene <= 1/4 del catálogo
+
+
+class _Column:
+    """Textos de una columna en un solo str separado por _SEP + offsets de inicio (n+1)."""
+    __slots__ = ("blob", "starts")
+
+    def __init__(self, values: list[str]):
+        values = [v.replace(_SEP, " ") for v in values]
+        self.blob = _SEP.join(values) + _SEP
+        starts = array("i", [0])
+        pos = 0
+        for v in values:
+            pos += len(v) + 1
+            starts.append(pos)
+        self.starts = starts
+
+    def __getitem__(self, i: int) -> str:
+        return self.blob[self.starts[i]:self.starts[i + 1] - 1]
+
+    def find_rows(self, q: str):
+        """(fila, es_prefijo) por cada fila que contiene q (una vez por fila)."""
+        blob, starts = self.blob, self.starts
+        n = len(starts) - 1
+        pos = blob.find(q)
+        while pos != -1:
+            row = bisect_right(starts, pos) - 1
+            yield row, pos == starts[row]
+            if row + 1 >= n:
+                break
+            pos = blob.find(q, starts[row + 1])
+
+
+def _keys(col: _Column, values: list[str]) -> _Column:
+    """Columna normalizada; si normalizar no cambia nada se comparte la misma."""
+    keys = [norm_text(v) for v in values]
+    return col if keys == values else _Column(keys)
+
+
+def _dense_rank(values: list[str]) -> array:
+    order = sorted(range(len(values)), key=values.__getitem__)
+    rank = array("i", [0]) * len(values)
+    r, prev = -1, None
+    for i in order:
+        if values[i] != prev:
+            r += 1
+            prev = values[i]
+        rank[i] = r
+    return rank
+
+
+class Catalog:
+    __slots__ = ("n", "ids", "pos", "code", "name", "descr", "kcode", "kname", "kdescr",
+                 "name_rank", "qty", "member", "total")
+
+    def __init__(self, rows: list[tuple], pairs: list[tuple]):
+        n = self.n = len(rows)
+        self.ids = array("q", [r[0] for r in rows])
+        codes = [str(r[1]) for r in rows]
+        names = [str(r[2]) for r in rows]
+        descrs = [str(r[3]) for r in rows]
+        del rows
+        self.code, self.name, self.descr = _Column(codes), _Column(names), _Column(descrs)
+        self.kcode = _keys(self.code, codes)
+        self.kname = _keys(self.name, names)
+        self.kdescr = _keys(self.descr, descrs)
+        self.name_rank = _dense_rank(names)  # orden por nombre sin comparar strings al buscar
+        del codes, names, descrs
+
+        # product_id -> fila (ids densos de AUTOINCREMENT)
+        self.pos = array("i", [-1]) * ((max(self.ids) + 1) if n else 0)
+        for i, pid in enumerate(self.ids):
+            self.pos[pid] = i
+
+        self.qty: dict[int, array] = {}         # wid -> qty por fila (0 si no vinculado)
+        self.member: dict[int, bytearray] = {}  # wid -> 1 si existe product_warehouse
+        self.total = array("q", bytes(8 * n))
+        for pid, wid, q in pairs:
+            i = self.row_of_id(pid)
+            if i is not None:
+                self._set(i, int(wid), int(q or 0))
+
+    def __len__(self):
+        return self.n
+
+    def _arrays(self, wid: int):
+        if wid not in self.qty:
+            self.qty[wid] = array("q", bytes(8 * self.n))
+            self.member[wid] = bytearray(self.n)
+        return self.qty[wid], self.member[wid]
+
+    def _set(self, i: int, wid: int, q: int):
+        q = max(0, q)  # igual que build_stock_indexes: negativos cuentan como 0
+        qa, ma = self._arrays(wid)
+        self.total[i] += q - qa[i]
+        qa[i] = q
+        ma[i] = 1
+
+    def _unlink(self, i: int, wid: int):
+        if wid in self.qty:
+            self.total[i] -= self.qty[wid][i]
+            self.qty[wid][i] = 0
+            self.member[wid][i] = 0
+
+    # ---------- lectura ----------
+    def row_of_id(self, product_id: int) -> int | None:
+        if 0 <= product_id < len(self.pos) and self.pos[product_id] >= 0:
+            return self.pos[product_id]
+        return None
+
+    def row_of(self, code: str) -> int | None:
+        """Búsqueda binaria (las filas vienen ordenadas por código)."""
+        lo, hi = 0, self.n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.code[mid] < code:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < self.n and self.code[lo] == code else None
+
+    def qty_at(self, i: int, warehouse_id: int | None = None) -> int:
+        if warehouse_id is None:
+            return self.total[i]
+        qa = self.qty.get(warehouse_id)
+        return qa[i] if qa is not None else 0
+
+    def record(self, i: int, warehouse_id: int | None = None) -> dict:
+        """Dict de una fila (code, name, descr, total, wh_qty) como lo esperan las vistas."""
+        return {"code": self.code[i], "name": self.name[i], "descr": self.descr[i],
+                "total": self.total[i],
+                "wh_qty": None if warehouse_id is None else self.qty_at(i, warehouse_id)}
+
+    def stock_by_warehouse(self, code: str) -> dict:
+        """{warehouse_id: qty} de los almacenes donde está vinculado el producto."""
+        i = self.row_of(code)
+        if i is None:
+            return {}
+        return {w: self.qty[w][i] for w, ma in self.member.items() if ma[i]}
+
+    def total_by_warehouse(self) -> dict:
+        return {w: sum(qa) for w, qa in self.qty.items()}
+
+    def view(self, warehouse_id: int | None = None) -> "CatalogView":
+        """Productos del almacén (vinculados) o todo el catálogo, en orden de código."""
+        if warehouse_id is None:
+            rows = range(self.n)
+        else:
+            ma = self.member.get(warehouse_id)
+            rows = array("i", [i for i, m in enumerate(ma) if m]) if ma is not None else array("i")
+        return CatalogView(self, rows, warehouse_id)
+
+    def match(self, q: str, include_descr: bool = False, within=None) -> dict:
+        """
+        {fila: puntaje de texto} para la consulta ya normalizada q
+        (0 código empieza, 1 nombre empieza, 2 código contiene, 3 nombre contiene, 5 descripción).
+        within: solo revisa esas filas (refinar una búsqueda anterior que q extiende).
+        """
+        cand = {}
+        if within is None:
+            for col, pre, sub in ((self.kcode, 0, 2), (self.kname, 1, 3)):
+                for i, is_pre in col.find_rows(q):
+                    s = pre if is_pre else sub
+                    if s < cand.get(i, 1000):
+                        cand[i] = s
+            if include_descr:
+                for i, _ in self.kdescr.find_rows(q):
+                    if i not in cand:
+                        cand[i] = 5
+            return cand
+        kcode, kname, kdescr = self.kcode, self.kname, self.kdescr
+        for i in within:
+            pc, pn = kcode[i].find(q), kname[i].find(q)
+            if pc == 0:
+                cand[i] = 0
+            elif pn == 0:
+                cand[i] = 1
+            elif pc > 0:
+                cand[i] = 2
+            elif pn > 0:
+                cand[i] = 3
+            elif include_descr and q in kdescr[i]:
+                cand[i] = 5
+        return cand
+
+    def search(self, query: str, include_descr: bool = False, in_stock_only: bool = False,
+               low_only: bool = False, threshold: int = 5, warehouse_id: int | None = None,
+               limit: int | None = None, cand: dict | None = None, product_ids=None) -> "CatalogView":
+        """
+        Mismo filtrado y puntaje que helpers.search_filter_and_score, pero buscando con
+        str.find sobre las columnas normalizadas (sin armar dicts ni strings por producto).
+        cand: coincidencias ya calculadas con match() (ver IncrementalSearch).
+        product_ids: restringe a esos productos (p. ej. una clase ABC/XYZ).
+        """
+        thr = int(threshold or 5)
+        if warehouse_id is None:
+            qa, ma = self.total, None
+        else:
+            qa = self.qty.get(warehouse_id) or array("q", bytes(8 * self.n))
+            ma = self.member.get(warehouse_id) or bytearray(self.n)
+
+        if cand is None:
+            q = norm_text(query).replace(_SEP, " ")
+            if q:
+                cand = self.match(q, include_descr)
+            else:
+                cand = {i: None for i in (range(self.n) if ma is None else (i for i, m in enumerate(ma) if m))}
+
+        allowed = None
+        if product_ids is not None:
+            allowed = {self.row_of_id(pid) for pid in product_ids}
+        scored = []
+        append = scored.append
+        for i, s in cand.items():
+            if ma is not None and not ma[i]:
+                continue
+            if allowed is not None and i not in allowed:
+                continue
+            qty = qa[i]
+            if in_stock_only and qty <= 0:
+                continue
+            if low_only and not (0 < qty <= thr):
+                continue
+            append((1000 - min(qty, 999) if s is None else s + max(0, 20 - qty) // 4, i))
+
+        rank = self.name_rank
+        scored.sort(key=lambda t: (t[0], rank[t[1]], t[1]))
+        if limit:
+            scored = scored[:limit]
+        return CatalogView(self, array("i", [i for _, i in scored]), warehouse_id)
+
+
+class IncrementalSearch:
+    """
+    Búsqueda con memoria de la consulta anterior: si la nueva la contiene (el usuario siguió
+    escribiendo), solo se revisan las filas que ya coincidían en lugar de todo el catálogo.
+    Las coincidencias dependen solo del texto; almacén y filtros de existencia se aplican después.
+    """
+    __slots__ = ("cat", "q", "include_descr", "cand", "stats", "_lock")
+
+    def __init__(self):
+        self.cat = None
+        self.q = ""
+        self.include_descr = False
+        self.cand = None
+        self.stats = {"full": 0, "refined": 0}
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self.cat, self.q, self.cand = None, "", None
+
+    def run(self, query: str, include_descr: bool = False, in_stock_only: bool = False,
+            low_only: bool = False, threshold: int = 5, warehouse_id: int | None = None,
+            limit: int | None = None, product_ids=None) -> "CatalogView":
+        cat = get_catalog()
+        q = norm_text(query).replace(_SEP, " ")
+        with self._lock:
+            if not q:
+                self.cat, self.q, self.cand = None, "", None
+                cand = None
+            else:
+                # Refinar conviene mientras el conjunto previo sea chico frente al catálogo
+                if (self.cat is cat and self.q and self.q in q and self.include_descr == include_descr
+                        and self.cand is not None and len(self.cand) * REFINE_RATIO <= cat.n):
+                    cand = cat.match(q, include_descr, within=self.cand) if q != self.q else self.cand
+                    self.stats["refined"] += 1
+                else:
+                    cand = cat.match(q, include_descr)
+                    self.stats["full"] += 1
+                self.cat, self.q, self.include_descr, self.cand = cat, q, include_descr, cand
+        return cat.search(query, include_descr, in_stock_only, low_only, threshold, warehouse_id,
+                          limit, cand=cand, product_ids=product_ids)
+
+
+class CatalogView:
+    """Secuencia perezosa de filas del catálogo: view[a:b] arma solo esos dicts."""
+    __slots__ = ("cat", "rows", "warehouse_id")
+
+    def __init__(self, cat: Catalog, rows, warehouse_id: int | None):
+        self.cat = cat
+        self.rows = rows
+        self.warehouse_id = warehouse_id
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __bool__(self):
+        return len(self.rows) > 0
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            return [self.cat.record(i, self.warehouse_id) for i in self.rows[k]]
+        return self.cat.record(self.rows[k], self.warehouse_id)
+
+    def __iter__(self):
+        for i in self.rows:
+            yield self.cat.record(i, self.warehouse_id)
+
+    def codes(self, start: int = 0, stop: int | None = None) -> list[str]:
+        return [self.cat.code[i] for i in self.rows[start:stop]]
+
+
+# ---------- instancia compartida (se mantiene con los eventos de database.py) ----------
+# Los eventos solo cubren este proceso. Las escrituras de otras conexiones (otra estación sobre la
+# misma base, api.py, cli.py import/sync/restore) se notan por PRAGMA data_version: si cambió el
+# catálogo, los vínculos o los almacenes se reconstruye; si no, se parchan los productos con
+# movimientos nuevos en el kardex.
+_state = {"cat": None, "stale": True, "dirty": set(), "marks": None}
+_lock = threading.Lock()        # protege _state (lo toca el hilo que publica eventos)
+_build_lock = threading.Lock()  # una sola reconstrucción/parche a la vez
+
+
+def _on_event(ev):
+    with _lock:
+        if isinstance(ev, events.StockChanged) and ev.codes is not None:
+            _state["dirty"].update(ev.codes)
+        else:
+            _state["stale"] = True  # producto nuevo o cambio masivo: se reconstruye al leer
+
+
+events.subscribe(_on_event, events.StockChanged, events.ProductUpserted)
+
+
+def invalidate():
+    with _lock:
+        _state["stale"] = True
+
+
+def _patch_rows(cat: Catalog, rows: list[int]):
+    for i in rows:
+        for w in list(cat.member):
+            cat._unlink(i, w)
+    for pid, wid, q in db.fetch_stock_pairs([cat.ids[i] for i in rows]):
+        cat._set(cat.row_of_id(pid), int(wid), int(q or 0))
+
+
+def get_catalog() -> Catalog:
+    """Catálogo compartido; reconstruye si quedó obsoleto o parcha solo las existencias tocadas."""
+    with _build_lock:
+        with _lock:
+            stale, dirty, cat = _state["stale"], _state["dirty"], _state["cat"]
+            _state["stale"], _state["dirty"] = False, set()
+        marks, seen = db.fetch_change_marks(), _state["marks"]  # marcas antes de leer: nada se pierde
+        ids = set()
+        if not stale and cat is not None and marks[0] != seen[0]:
+            if marks[1] != seen[1] or marks[2] < seen[2]:
+                stale = True
+            else:
+                ids = db.fetch_ledger_product_ids(seen[2], marks[2])
+        if stale or cat is None:
+            cat = Catalog(db.fetch_catalog_rows(), db.fetch_stock_pairs())
+            with _lock:
+                _state["cat"] = cat
+        elif dirty or ids:
+            rows = {i for i in (cat.row_of(c) for c in dirty) if i is not None}
+            rows.update(i for i in (cat.row_of_id(p) for p in ids) if i is not None)
+            _patch_rows(cat, sorted(rows))
+        _state["marks"] = marks
+        return cat
@@ -0,0 +1,99 @@
+# classify.py
+# Clasificación ABC/XYZ por producto/almacén sobre los buckets diarios de salidas (demand_daily).
+# ABC: participación acumulada en las salidas del almacén. XYZ: coeficiente de variación semanal.
+# Todo en una pasada vectorizada; el resultado se guarda en product_class.
+
+import datetime
+
+import numpy as np
+import pandas as pd
+
+import database as db
+
+WEEKS = 12                 # semanas de historia (dentro de forecast.HORIZON_DAYS)
+ABC_CUTS = (0.80, 0.95)    # A hasta 80 % acumulado, B hasta 95 %, C el resto
+XYZ_CUTS = (0.5, 1.0)      # X: cv <= 0.5, Y: cv <= 1.0, Z: mayor o sin demanda
+COLUMNS = ["product_id", "warehouse_id", "out_qty", "cum_share", "abc", "cv", "xyz"]
+
+
+def compute_classes(pairs: np.ndarray, buckets: pd.DataFrame, as_of: str, weeks: int = WEEKS) -> pd.DataFrame:
+    """
+    pairs: arreglo (n, 2) de (product_id, warehouse_id) a clasificar (todos los vínculos).
+    buckets: columnas product_id, warehouse_id, day, qty (salidas por día).
+    Los pares sin salidas quedan C/Z con cv NaN.
+    """
+    pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+    n = len(pairs)
+    if n == 0:
+        return pd.DataFrame(columns=COLUMNS)
+    keys = (pairs[:, 0] << 32) | pairs[:, 1]
+    order = np.argsort(keys, kind="stable")
+    skeys = keys[order]
+
+    # Matriz densa (pares x semanas) de salidas con bincount
+    mat = np.zeros(n * weeks)
+    if not buckets.empty:
+        bkeys = (buckets["product_id"].to_numpy(dtype=np.int64) << 32) | buckets["warehouse_id"].to_numpy(dtype=np.int64)
+        pos = np.minimum(np.searchsorted(skeys, bkeys), n - 1)
+        days = pd.to_datetime(buckets["day"]).to_numpy().astype("datetime64[D]")
+        week = (np.datetime64(as_of, "D") - days).astype(np.int64) // 7
+        ok = (skeys[pos] == bkeys) & (week >= 0) & (week < weeks)
+        mat = np.bincount(order[pos[ok]] * weeks + week[ok],
+                          weights=buckets["qty"].to_numpy(dtype=np.float64)[ok], minlength=n * weeks)
+    mat = mat.reshape(n, weeks)
+
+    total = mat.sum(axis=1)
+    mean = total / weeks
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cv = np.where(mean > 0, mat.std(axis=1) / mean, np.nan)
+    xyz = np.select([cv <= XYZ_CUTS[0], cv <= XYZ_CUTS[1]], ["X", "Y"], "Z")
+
+    # ABC por almacén: ordena (almacén, salidas desc) y acumula dentro de cada grupo
+    wid = pairs[:, 1]
+    idx = np.lexsort((-total, wid))
+    t_sorted, w_sorted = total[idx], wid[idx]
+    start = np.r_[0, np.flatnonzero(w_sorted[1:] != w_sorted[:-1]) + 1]
+    group = np.repeat(np.arange(len(start)), np.diff(np.r_[start, n]))
+    cum = np.cumsum(t_sorted)
+    base = np.r_[0.0, cum][start][group]            # acumulado antes del grupo
+    wh_total = np.add.reduceat(t_sorted, start)[group]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        share = np.where(wh_total > 0, (cum - base) / wh_total, 0.0)
+        prev = np.where(wh_total > 0, (cum - base - t_sorted) / wh_total, 1.0)
+    # El producto que cruza el corte entra en la clase (la A nunca queda vacía si hay salidas)
+    abc_sorted = np.where(t_sorted <= 0, "C",
+                          np.select([prev < ABC_CUTS[0], prev < ABC_CUTS[1]], ["A", "B"], "C"))
+    cum_share = np.empty(n)
+    abc = np.empty(n, dtype=object)
+    cum_share[idx] = share
+    abc[idx] = abc_sorted
+
+    return pd.DataFrame({
+        "product_id": pairs[:, 0], "warehouse_id": wid, "out_qty": total.astype(np.int64),
+        "cum_share": cum_share, "abc": abc, "cv": cv, "xyz": xyz,
+    })[COLUMNS]
+
+
+def refresh() -> int:
+    """Integra salidas nuevas (forecast.refresh) y reclasifica todos los pares. Devuelve cuántos."""
+    import forecast as fc
+    fc.refresh()
+    today = db.sql_today()
+    since = (datetime.date.fromisoformat(today) - datetime.timedelta(days=WEEKS * 7 - 1)).isoformat()
+    pairs = np.array([(p, w) for p, w, _ in db.fetch_stock_pairs()], dtype=np.int64).reshape(-1, 2)
+    buckets = pd.DataFrame.from_records(db.fetch_demand_buckets(since),
+                                        columns=["product_id", "warehouse_id", "day", "qty"])
+    res = compute_classes(pairs, buckets, today)
+    # columnas a listas nativas de una vez (sin iterar objetos de pandas); NaN -> NULL
+    cv = [None if c != c else c for c in res["cv"].to_numpy(dtype=np.float64).tolist()]
+    rows = list(zip(*(res[k].to_numpy().tolist() for k in ("product_id", "warehouse_id", "out_qty", "cum_share", "abc")),
+                    cv, res["xyz"].to_numpy().tolist()))
+    db.save_product_classes(rows, today)
+    return len(rows)
+
+
+def refresh_if_stale() -> int:
+    """Reclasifica una vez al día (la clase se mueve lento; no vale la pena por cada salida)."""
+    if db.get_class_as_of() == db.sql_today():
+        return 0
+    return refresh()
@@ -0,0 +1,356 @@
+# cli.py
+# Operaciones por lotes sin interfaz (cron / scripts) sobre database.py y helpers.py.
+# Solo importa sqlite3 + database al arrancar; lo demás se carga dentro de cada comando.
+#
+#   python cli.py [--db ruta.db] import ARCHIVO|- --warehouse ID [--replace] [--dry-run]
+#   python cli.py [--db ruta.db] aliases ARCHIVO|- [--report conflictos.csv]
+#   python cli.py [--db ruta.db] export-ledger [--out ARCHIVO] [--since FECHA] [--until FECHA] [--warehouse ID]
+#   python cli.py [--db ruta.db] post-doc IN|OUT --warehouse ID [ARCHIVO|-] [--reference ..] [--counterparty ..]
+#   python cli.py [--db ruta.db] reconcile SESION
+#   python cli.py [--db ruta.db] verify [--fix]
+#   python cli.py [--db ruta.db] bench [--repeat 5] [--seed N]
+#   python cli.py [--db ruta.db] classify
+#   python cli.py [--db ruta.db] backup [--dir DIR] [--keep 7] [--gzip]
+#   python cli.py [--db ruta.db] restore RESPALDO [--target ruta.db]
+#   python cli.py [--db ruta.db] sync status | export --peer SITIO --out LOTE | apply LOTE | ack SITIO CURSOR
+#   python cli.py [--db ruta.db] sync serve [--host H] [--port 8766] | pull HOST[:PUERTO]
+
+import argparse
+import csv
+import os
+import sqlite3
+import sys
+import time
+
+import database as db
+
+
+def _open_in(path: str):
+    """'-' = stdin; si no, el archivo en texto (UTF-8 con o sin BOM)."""
+    if path in (None, "-"):
+        return sys.stdin
+    return open(path, "r", encoding="utf-8-sig", newline="")
+
+
+_CODE_HEADERS = {"codigo", "code", "sku", "clave", "producto", "codigo de barras", "alias"}
+_QTY_HEADERS = {"cantidad", "cant", "qty", "quantity", "piezas", "unidades"}
+
+
+def _read_lines(f) -> list[tuple[str, int]]:
+    """
+    Líneas 'código,cantidad' (también separadas por tabulador o ';'). Solo la primera fila puede
+    ser encabezado y solo si sus nombres son conocidos; cualquier otra cantidad no numérica es error.
+    """
+    import helpers as hp
+    sample = f.read()
+    try:
+        dialect = csv.Sniffer().sniff(sample[:4096], delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    out = []
+    first = True
+    for r in csv.reader(sample.splitlines(), dialect):
+        if len(r) < 2 or not r[0].strip():
+            continue
+        if first:
+            first = False
+            if hp.norm_text(r[0]).strip() in _CODE_HEADERS and hp.norm_text(r[1]).strip() in _QTY_HEADERS:
+                continue
+        try:
+            out.append((r[0].strip(), int(float(r[1]))))
+        except ValueError:
+            raise ValueError(f"Cantidad inválida para '{r[0]}': {r[1]!r}")
+    return out
+
+
+def cmd_import(args) -> int:
+    import helpers as hp
+    if args.file == "-" or args.file.lower().endswith(".csv"):
+        with _open_in(args.file) as f:
+            rows = hp.parse_products_from_csv(f)
+    else:
+        from types import SimpleNamespace
+        rows = hp.parse_products_from_file(SimpleNamespace(path=args.file))
+    if args.dry_run:
+        import import_preview
+        print("\n".join(import_preview.summary_lines(import_preview.preview(rows, args.warehouse, args.replace))))
+        return 0
+    res = db.import_products(rows, args.warehouse, replace=args.replace)
+    print(f"{res['rows']} filas: {res['created']} productos nuevos, {res['linked']} vinculados, "
+          f"{res['moved']} movimientos")
+    return 0
+
+
+def cmd_aliases(args) -> int:
+    import helpers as hp
+    with _open_in(args.file) as f:
+        pairs = hp.parse_aliases_from_csv(f)
+    t0 = time.perf_counter()
+    res = db.import_aliases(pairs)
+    print(f"{res['rows']} alias: {res['added']} nuevos, {res['existing']} ya existían, "
+          f"{len(res['conflicts'])} en conflicto, {len(res['missing'])} bases inexistentes, "
+          f"{len(res['is_code'])} ya son código principal ({time.perf_counter() - t0:.1f} s)")
+    if args.report:
+        with open(args.report, "w", encoding="utf-8", newline="") as out:
+            w = csv.writer(out)
+            w.writerow(["tipo", "alias", "actual", "pedido"])
+            w.writerows(("conflicto", a, cur, want) for a, cur, want in res["conflicts"])
+            w.writerows(("base_inexistente", "", "", b) for b in res["missing"])
+            w.writerows(("es_codigo", a, a, "") for a in res["is_code"])
+        print(f"Reporte: {args.report}")
+    else:
+        for a, cur, want in res["conflicts"][:20]:
+            print(f"  conflicto: {a} -> {cur} (pedido {want})")
+    return 0
+
+
+def cmd_export_ledger(args) -> int:
+    f = sys.stdout if args.out in (None, "-") else open(args.out, "w", encoding="utf-8", newline="")
+    try:
+        w = csv.writer(f)
+        w.writerow(["id", "ts", "code", "warehouse_id", "qty", "kind", "note", "ref_id", "doc_id"])
+        n = 0
+        for row in db.iter_ledger(args.since, args.until, args.warehouse):
+            w.writerow(row)
+            n += 1
+    finally:
+        if f is not sys.stdout:
+            f.close()
+    print(f"{n} movimientos exportados", file=sys.stderr)
+    return 0
+
+
+def cmd_post_doc(args) -> int:
+    with _open_in(args.file) as f:
+        lines = _read_lines(f)
+    doc_id = db.post_movement_doc(args.doc_type, args.warehouse, lines, counterparty=args.counterparty,
+                                  reference=args.reference, note=args.note, series=args.series)
+    if doc_id is None:
+        print("Sin líneas: no se creó documento", file=sys.stderr)
+        return 1
+    print(f"Documento {doc_id} ({args.doc_type.upper()}, {len(lines)} líneas)")
+    return 0
+
+
+def cmd_reconcile(args) -> int:
+    doc_id = db.reconcile_count_session(args.session_id)
+    print("Sin diferencias: sesión sin ajustes" if doc_id is None else f"Ajuste {doc_id} aplicado")
+    return 0
+
+
+def cmd_verify(args) -> int:
+    res = db.verify_stock(fix=args.fix)
+    ok_check = res["quick_check"] == ["ok"]
+    for k, v in res.items():
+        print(f"{k}: {', '.join(v[:5]) if isinstance(v, list) else v}")
+    bad = (not ok_check) or res["foreign_keys"] or res["negative"] or (res["mismatch"] - res["fixed"])
+    print("Base OK" if not bad else "Se encontraron problemas")
+    return 1 if bad else 0
+
+
+def _bench_seeded(n: int) -> str:
+    import tempfile
+    # La siembra vive con la herramienta de planes (tools/, fuera del build de la app)
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tools"))
+    import query_plans
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    query_plans.seed(path, n, 4, n_moves=n * 5)
+    return path
+
+
+def cmd_bench(args) -> int:
+    tmp = None
+    if args.seed:
+        tmp = _bench_seeded(args.seed)
+    try:
+        import catalog
+        wid = db._conn.execute("SELECT MIN(id) FROM warehouses").fetchone()[0]
+        code = db._conn.execute("SELECT code FROM products ORDER BY id LIMIT 1").fetchone()
+        code = code[0] if code else ""
+        today = db.sql_today()
+        cases = [
+            ("catalogo (construcción)", lambda: (catalog.invalidate(), catalog.get_catalog())),
+            ("búsqueda", lambda: catalog.get_catalog().search(code[:3] or "a", limit=50)),
+            ("stock map", lambda: db.get_stock_map(wid)),
+            ("stock columnas", lambda: db.fetch_stock_columns(wid)),
+            ("productos por almacén", lambda: db.list_products_by_warehouse(wid)),
+            ("productos (tuplas)", lambda: db.fetch_products_by_warehouse_rows(wid)),
+            ("kpis", lambda: db.get_stock_kpis(today)),
+            ("movimientos (500)", lambda: db.list_movements(limit=500)),
+            ("movimientos (tuplas)", lambda: db.fetch_movement_rows(limit=500)),
+            ("stock por código", lambda: db.get_stock_for_codes([code])),
+        ]
+        print(f"{'operación':<26}{'mediana ms':>12}{'mín ms':>10}")
+        for name, fn in cases:
+            if wid is None and "almacén" in name:
+                continue
+            times = []
+            for _ in range(max(1, args.repeat)):
+                t0 = time.perf_counter()
+                fn()
+                times.append((time.perf_counter() - t0) * 1000)
+            times.sort()
+            print(f"{name:<26}{times[len(times) // 2]:>12.2f}{times[0]:>10.2f}")
+    finally:
+        if tmp:
+            db._conn.close()
+            for suffix in ("", "-wal", "-shm"):
+                try:
+                    os.remove(tmp + suffix)
+                except OSError:
+                    pass
+    return 0
+
+
+def cmd_classify(args) -> int:
+    import classify
+    n = classify.refresh()
+    print(f"{n} pares producto/almacén clasificados (ABC/XYZ)")
+    return 0
+
+
+def cmd_backup(args) -> int:
+    import backup
+    t0 = time.perf_counter()
+    path = backup.backup_now(args.dir, keep=args.keep, compress=args.gzip)
+    print(f"Respaldo: {path} ({os.path.getsize(path) / 1e6:.1f} MB, {time.perf_counter() - t0:.1f} s)")
+    return 0
+
+
+def cmd_restore(args) -> int:
+    import backup
+    db._conn.close()  # la restauración abre su propia conexión al destino
+    safety = backup.restore(args.file, args.target or db._db_path)
+    print("Base restaurada e íntegra" + (f"; estado anterior en {safety}" if safety else ""))
+    return 0
+
+
+def cmd_sync(args) -> int:
+    import json
+    import sync
+    if args.action == "status":
+        print(json.dumps({"site": sync.site_id(), "peers": sync.list_peers()}, ensure_ascii=False, indent=1))
+    elif args.action == "export":
+        print(json.dumps(sync.export_batch(args.out, args.peer, args.limit)))
+    elif args.action == "apply":
+        res = sync.apply_batch(args.file)
+        print(json.dumps(res))
+        print(f"Confirmar en el origen: sync ack {sync.site_id()} '{json.dumps(res['ack'])}'", file=sys.stderr)
+    elif args.action == "ack":
+        sync.ack(args.site, json.loads(args.cursor))
+    elif args.action == "serve":
+        srv = sync.serve(args.host, args.port)
+        print(f"Sitio {sync.site_id()} sirviendo en {args.host}:{args.port} (Ctrl+C para salir)")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            srv.shutdown()
+    elif args.action == "pull":
+        host, _, port = args.address.partition(":")
+        print(json.dumps(sync.pull(host, int(port or 8766))))
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    ap = argparse.ArgumentParser(prog="almacen", description="Operaciones de almacén sin interfaz")
+    ap.add_argument("--db", default=None, help="Ruta a la base (por defecto almacen.db)")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("import", help="Importa productos (CSV/Excel o '-' para CSV por stdin)")
+    p.add_argument("file")
+    p.add_argument("--warehouse", type=int, required=True)
+    p.add_argument("--replace", action="store_true", help="Reemplaza existencias en vez de sumarlas")
+    p.add_argument("--dry-run", action="store_true", help="Solo muestra qué cambiaría, sin escribir")
+    p.set_defaults(fn=cmd_import)
+
+    p = sub.add_parser("aliases", help="Carga alias en bloque desde CSV 'alias,código' (o '-' por stdin)")
+    p.add_argument("file")
+    p.add_argument("--report", default=None, help="CSV con conflictos, bases inexistentes y alias que ya son código")
+    p.set_defaults(fn=cmd_aliases)
+
+    p = sub.add_parser("export-ledger", help="Exporta el libro de movimientos a CSV")
+    p.add_argument("--out", default="-")
+    p.add_argument("--since", default=None, help="Desde (YYYY-MM-DD)")
+    p.add_argument("--until", default=None, help="Hasta, sin incluir (YYYY-MM-DD)")
+    p.add_argument("--warehouse", type=int, default=None)
+    p.set_defaults(fn=cmd_export_ledger)
+
+    p = sub.add_parser("post-doc", help="Registra un documento IN/OUT desde líneas 'código,cantidad'")
+    p.add_argument("doc_type", choices=["IN", "OUT", "in", "out"])
+    p.add_argument("file", nargs="?", default="-")
+    p.add_argument("--warehouse", type=int, required=True)
+    p.add_argument("--reference", default="")
+    p.add_argument("--counterparty", default="")
+    p.add_argument("--note", default="")
+    p.add_argument("--series", default=None)
+    p.set_defaults(fn=cmd_post_doc)
+
+    p = sub.add_parser("reconcile", help="Concilia una sesión de conteo")
+    p.add_argument("session_id", type=int)
+    p.set_defaults(fn=cmd_reconcile)
+
+    p = sub.add_parser("verify", help="Revisa integridad y existencias contra el libro")
+    p.add_argument("--fix", action="store_true", help="Reescribe existencias desde el libro")
+    p.set_defaults(fn=cmd_verify)
+
+    p = sub.add_parser("bench", help="Mide las lecturas principales")
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--seed", type=int, default=0, help="Usa una base temporal sembrada con N productos")
+    p.set_defaults(fn=cmd_bench)
+
+    p = sub.add_parser("classify", help="Recalcula la clasificación ABC/XYZ")
+    p.set_defaults(fn=cmd_classify)
+
+    p = sub.add_parser("backup", help="Respaldo en línea (no bloquea a las estaciones)")
+    p.add_argument("--dir", default=None, help="Directorio destino (por defecto src/backups)")
+    p.add_argument("--keep", type=int, default=7, help="Respaldos a conservar")
+    p.add_argument("--gzip", action="store_true", help="Comprime el respaldo")
+    p.set_defaults(fn=cmd_backup)
+
+    p = sub.add_parser("restore", help="Restaura un respaldo (.db o .db.gz) verificando integridad")
+    p.add_argument("file")
+    p.add_argument("--target", default=None, help="Base destino (por defecto la de --db)")
+    p.set_defaults(fn=cmd_restore)
+
+    p = sub.add_parser("sync", help="Sincronización por deltas con otros sitios")
+    ss = p.add_subparsers(dest="action", required=True)
+    ss.add_parser("status", help="Id de este sitio y cursores por sitio")
+    q = ss.add_parser("export", help="Escribe el lote para un sitio desde su último ack")
+    q.add_argument("--peer", required=True)
+    q.add_argument("--out", required=True)
+    q.add_argument("--limit", type=int, default=50000, help="Movimientos máximos por lote")
+    q = ss.add_parser("apply", help="Aplica un lote (idempotente)")
+    q.add_argument("file")
+    q = ss.add_parser("ack", help="Registra lo que un sitio confirmó haber aplicado")
+    q.add_argument("site")
+    q.add_argument("cursor", help='JSON, p. ej. \'{"log": 3, "doc": 7, "ledger": 226}\'')
+    q = ss.add_parser("serve", help="Sirve los deltas de este sitio por socket")
+    q.add_argument("--host", default="127.0.0.1")
+    q.add_argument("--port", type=int, default=8766)
+    q = ss.add_parser("pull", help="Jala y aplica los deltas de un sitio remoto")
+    q.add_argument("address", help="HOST[:PUERTO]")
+    p.set_defaults(fn=cmd_sync)
+    return ap
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    if not (args.cmd == "bench" and args.seed):
+        db.init_db(args.db)
+    try:
+        return args.fn(args)
+    except (ValueError, RuntimeError, ImportError, OSError, sqlite3.Error) as ex:
+        print(f"Error: {ex}", file=sys.stderr)
+        return 1
+    finally:
+        if db._conn is not None:
+            try:
+                db._conn.close()
+            except Exception:
+                pass
+
+
+if __name__ == "__main__":
+    sys.exit(main())
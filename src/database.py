@@ -1,43 +1,197 @@
 # database.py
 import os, sqlite3
 from contextlib import contextmanager
+import atexit
 import datetime
+import threading
+import time
+
+import events
 
 DB_FILE = os.path.join(os.path.dirname(__file__), "almacen.db")
+BUSY_TIMEOUT_MS = 5000   # espera ante el candado de escritura de otra estación
 _conn = None
+_db_path = None
+
+# Backend "memory": la base vive en RAM (VFS memdb, compartida entre las conexiones del proceso)
+# y se vuelca a disco con el API de backup. ALMACEN_BACKEND=memory lo activa sin tocar código.
+BACKEND = os.environ.get("ALMACEN_BACKEND", "file")
+SNAPSHOT_INTERVAL_S = 30   # cada cuánto se revisa si hay cambios que volcar
+SNAPSHOT_PAGES = 256       # páginas por paso de backup (entre pasos pueden entrar otras consultas)
+_MEM_URI = "file:/almacen-mem?vfs=memdb"
+_snapshot = {"path": None, "conn": None, "thread": None, "stop": None, "version": None}
+_snapshot_lock = threading.Lock()
 
 def _now():
     return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-def init_db(db_path: str | None = None):
+def init_db(db_path: str | None = None, backend: str | None = None, seed: str | None = None):
     """
     Inicializa conexión, PRAGMAs, crea/esquema y migra M2M.
+    backend="memory": `db_path` es el archivo de snapshot (se carga si existe; si no, se parte
+    de la imagen `seed`) y la base de trabajo queda en RAM. db_path=":memory:" = sin persistencia.
     """
-    global _conn
+    global _conn, _db_path
     path = db_path or DB_FILE
-    _conn = sqlite3.connect(path, check_same_thread=False)
-    _conn.row_factory = sqlite3.Row
-
-    # PRAGMAs recomendados
-    _conn.execute("PRAGMA foreign_keys = ON;")
-    _conn.execute("PRAGMA journal_mode = WAL;")
-    _conn.execute("PRAGMA synchronous = NORMAL;")
+    if (backend or BACKEND) == "memory":
+        _conn = _open_memory(None if path == ":memory:" else path, seed)
+    else:
+        _db_path = path
+        _conn = open_connection(path)
 
     _create_schema()
     _migrate_to_m2m()
     _ensure_product_extra_columns()  # <- añade category/unit/unit_factor si faltan
+    _ensure_low_stock_flag()
+    _ensure_compact_ledger()
+    _ensure_product_id_keys()
+    _ensure_last_movement_columns()
+    _ensure_sync_tables()
+    _ensure_warehouse_delete_flag()
     _conn.commit()
 
+def open_connection(db_path: str | None = None) -> sqlite3.Connection:
+    """Conexión con los PRAGMAs de la app (la usan init_db y el hilo escritor)."""
+    path = db_path or _db_path or DB_FILE
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=BUSY_TIMEOUT_MS / 1000,
+                           uri=path.startswith("file:"))
+    conn.row_factory = sqlite3.Row
+
+    # PRAGMAs recomendados
+    conn.execute("PRAGMA foreign_keys = ON;")
+    conn.execute("PRAGMA journal_mode = WAL;")
+    conn.execute("PRAGMA synchronous = NORMAL;")
+    conn.execute(f"PRAGMA busy_timeout = {int(BUSY_TIMEOUT_MS)};")
+    return conn
+
+# ===========================
+#   Backend en memoria + snapshots
+# ===========================
+def _open_memory(snapshot_path: str | None, seed: str | None = None) -> sqlite3.Connection:
+    """Base en RAM cargada del snapshot (o de la imagen semilla) con el API de backup."""
+    global _db_path
+    close_db()
+    _db_path = _MEM_URI
+    conn = open_connection(_MEM_URI)
+    src = snapshot_path if snapshot_path and os.path.exists(snapshot_path) else seed
+    if src:
+        if not os.path.exists(src):
+            raise ValueError(f"No existe la imagen semilla: {src}")
+        disk = sqlite3.connect(src)
+        try:
+            disk.backup(conn)
+        finally:
+            disk.close()
+    _snapshot["path"] = snapshot_path
+    if snapshot_path:
+        _start_snapshots()
+    return conn
+
+def is_memory_backend() -> bool:
+    return _db_path == _MEM_URI
+
+def save_snapshot(path: str | None = None, force: bool = False) -> bool:
+    """
+    Vuelca la base en memoria a disco en pasos de SNAPSHOT_PAGES páginas. El destino se escribe
+    en una sola transacción: un corte a medias deja el snapshot anterior intacto.
+    Sin cambios desde el último volcado no hace nada (salvo force). Devuelve si escribió.
+    """
+    path = path or _snapshot["path"]
+    if not path or not is_memory_backend():
+        return False
+    with _snapshot_lock:
+        default = path == _snapshot["path"]
+        src = _snapshot["conn"] if default and _snapshot["conn"] is not None else open_connection(_MEM_URI)
+        try:
+            # data_version (de esta misma conexión) cambia con cada COMMIT de las demás: UI, escritor, API
+            version = src.execute("PRAGMA data_version").fetchone()[0]
+            if default and not force and version == _snapshot["version"]:
+                return False
+            import backup  # aquí: backup.py importa este módulo
+            dst = sqlite3.connect(path)
+            try:
+                # con escrituras continuas cada COMMIT reinicia la copia: tras BACKUP_MAX_RESTARTS, un paso
+                backup._copy(src, dst, SNAPSHOT_PAGES, 0.005)
+            finally:
+                dst.close()
+            if default:
+                _snapshot["version"] = version
+            return True
+        finally:
+            if src is not _snapshot["conn"]:
+                src.close()
+
+def _snapshot_loop(stop: threading.Event):
+    while not stop.wait(SNAPSHOT_INTERVAL_S):
+        try:
+            save_snapshot()
+        except Exception:
+            pass
+
+def _start_snapshots():
+    stop = threading.Event()
+    t = threading.Thread(target=_snapshot_loop, args=(stop,), name="almacen-snapshot", daemon=True)
+    _snapshot.update(conn=open_connection(_MEM_URI), thread=t, stop=stop, version=None)
+    t.start()
+
+def close_db():
+    """Detiene los snapshots (con un último volcado) y cierra la conexión."""
+    global _conn
+    stop, t = _snapshot["stop"], _snapshot["thread"]
+    if stop is not None:
+        stop.set()
+        t.join(5)
+        try:
+            save_snapshot()
+        except Exception:
+            pass
+    if _snapshot["conn"] is not None:
+        _snapshot["conn"].close()
+    _snapshot.update(path=None, conn=None, thread=None, stop=None, version=None)
+    if _conn is not None:
+        try:
+            _conn.close()
+        except Exception:
+            pass
+        _conn = None
+
+atexit.register(close_db)
+
 @contextmanager
 def _cur():
     if _conn is None:
         init_db()
     c = _conn.cursor()
     try:
-        yield c
+        with events.deferred() as evs:
+            yield c
+            _conn.commit()
+    finally:
+        c.close()
+    events.publish_all(evs)
+
+@contextmanager
+def _tx():
+    """
+    Transacción explícita para operaciones masivas: todo o nada.
+    Dentro NO llamar funciones que usen _cur() (harían commit a mitad).
+    """
+    if _conn is None:
+        init_db()
+    if _conn.in_transaction:
         _conn.commit()
+    c = _conn.cursor()
+    try:
+        with events.deferred() as evs:
+            c.execute("BEGIN IMMEDIATE")
+            yield c
+            _conn.commit()
+    except Exception:
+        _conn.rollback()
+        raise
     finally:
         c.close()
+    events.publish_all(evs)  # solo tras el COMMIT
 
 def _table_has_column(table: str, col: str) -> bool:
     with _cur() as c:
@@ -60,6 +214,312 @@ def _ensure_product_extra_columns():
                 except Exception:
                     pass  # otra instancia pudo haberlo agregado
 
+def _low_expr(p: str, w: str) -> str:
+    """Regla de list_low_stock para el par (p, w): qty = 0, o umbral > 0 y qty <= umbral."""
+    return f"""(SELECT CASE WHEN q = 0 OR (t > 0 AND q <= t) THEN 1 ELSE 0 END FROM (SELECT
+        IFNULL((SELECT qty FROM product_stock WHERE product_id = {p} AND warehouse_id = {w}), 0) AS q,
+        IFNULL((SELECT threshold FROM product_threshold WHERE product_id = {p} AND warehouse_id = {w}), 0) AS t))"""
+
+def _ensure_low_stock_flag():
+    """
+    product_warehouse.is_low mantenido por triggers (stock, umbral y vínculo), con índice
+    (warehouse_id, is_low): listas y conteos de bajo stock cuestan O(resultado).
+    """
+    with _cur() as c:
+        if not _table_has_column("product_warehouse", "is_low"):
+            c.execute("ALTER TABLE product_warehouse ADD COLUMN is_low INTEGER NOT NULL DEFAULT 0")
+            c.execute(f"UPDATE product_warehouse SET is_low = {_low_expr('product_warehouse.product_id', 'product_warehouse.warehouse_id')}")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_pw_low ON product_warehouse(warehouse_id, is_low)")
+
+        for name, event, row in [
+            ("trg_low_pw_ins", "AFTER INSERT ON product_warehouse", "NEW"),
+            ("trg_low_ps_ins", "AFTER INSERT ON product_stock", "NEW"),
+            ("trg_low_ps_upd", "AFTER UPDATE OF qty ON product_stock", "NEW"),
+            ("trg_low_ps_del", "AFTER DELETE ON product_stock", "OLD"),
+            ("trg_low_pt_ins", "AFTER INSERT ON product_threshold", "NEW"),
+            ("trg_low_pt_upd", "AFTER UPDATE OF threshold ON product_threshold", "NEW"),
+            ("trg_low_pt_del", "AFTER DELETE ON product_threshold", "OLD"),
+        ]:
+            p, w = f"{row}.product_id", f"{row}.warehouse_id"
+            # Solo escribe si el valor cambia (no ensucia páginas en cada movimiento)
+            c.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN
+                    UPDATE product_warehouse SET is_low = {_low_expr(p, w)}
+                    WHERE product_id = {p} AND warehouse_id = {w} AND is_low IS NOT {_low_expr(p, w)};
+                END""")
+
+# Códigos fijos de stock_ledger.kind (movement_kinds guarda el texto para la vista)
+MOVEMENT_KINDS = {"IN": 1, "OUT": 2, "ADJ": 3, "ADJ+": 4, "ADJ-": 5, "XFER-IN": 6, "XFER-OUT": 7}
+
+def _kind_code(kind: str) -> int:
+    try:
+        return MOVEMENT_KINDS[kind]
+    except KeyError:
+        raise ValueError(f"Tipo de movimiento inválido: {kind!r}")
+
+def _kinds_sql(*kinds: str) -> str:
+    return "(" + ",".join(str(MOVEMENT_KINDS[k]) for k in kinds) + ")"
+
+_IN_KINDS = _kinds_sql("IN", "XFER-IN", "ADJ+")
+_OUT_KINDS = _kinds_sql("OUT", "XFER-OUT", "ADJ-")
+_ADJ = MOVEMENT_KINDS["ADJ"]
+
+def _ensure_compact_ledger():
+    """
+    Migra el kardex de texto (tabla stock_movements) a stock_ledger y deja stock_movements
+    como vista con las mismas columnas (ts texto, kind texto, note texto). Los INSERT a la
+    vista se codifican por trigger; el código de la app escribe directo en stock_ledger.
+    """
+    legacy = _conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'stock_movements'").fetchone()
+    if legacy:
+        _conn.commit()
+        _conn.execute("PRAGMA foreign_keys = OFF")  # copia tal cual, aun con filas huérfanas
+        try:
+            with _cur() as c:
+                c.execute("INSERT OR IGNORE INTO movement_kinds(kind) SELECT DISTINCT kind FROM stock_movements")
+                c.execute("""INSERT OR IGNORE INTO ledger_notes(note)
+                             SELECT DISTINCT note FROM stock_movements WHERE IFNULL(note, '') <> ''""")
+                c.execute("""
+                    INSERT INTO stock_ledger(id, ts, product_id, warehouse_id, qty, kind, note_id, ref_id, doc_id)
+                    SELECT m.id, IFNULL(CAST(strftime('%s', m.ts) AS INTEGER), 0), m.product_id, m.warehouse_id,
+                           m.qty, k.id, n.id, m.ref_id, m.doc_id
+                    FROM stock_movements m
+                    JOIN movement_kinds k ON k.kind = m.kind
+                    LEFT JOIN ledger_notes n ON n.note = m.note
+                    ORDER BY m.id""")
+                c.execute("DROP TABLE stock_movements")  # con sus índices y triggers
+                c.execute("DROP TRIGGER IF EXISTS trg_pw_last_move_link")  # se recrea sobre stock_ledger
+        finally:
+            _conn.execute("PRAGMA foreign_keys = ON")
+    with _cur() as c:
+        c.execute("""
+            CREATE VIEW IF NOT EXISTS stock_movements AS
+            SELECT l.id, datetime(l.ts, 'unixepoch') AS ts, l.product_id, l.warehouse_id, l.qty,
+                   k.kind, IFNULL(n.note, '') AS note, l.ref_id, l.doc_id
+            FROM stock_ledger l
+            JOIN movement_kinds k ON k.id = l.kind
+            LEFT JOIN ledger_notes n ON n.id = l.note_id""")
+        c.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_stock_movements_insert INSTEAD OF INSERT ON stock_movements BEGIN
+                INSERT OR IGNORE INTO ledger_notes(note) SELECT NEW.note WHERE IFNULL(NEW.note, '') <> '';
+                INSERT INTO stock_ledger(id, ts, product_id, warehouse_id, qty, kind, note_id, ref_id, doc_id)
+                VALUES (NEW.id, IFNULL(CAST(strftime('%s', NEW.ts) AS INTEGER), CAST(strftime('%s', 'now') AS INTEGER)),
+                        NEW.product_id, NEW.warehouse_id, NEW.qty,
+                        (SELECT id FROM movement_kinds WHERE kind = NEW.kind),
+                        (SELECT id FROM ledger_notes WHERE note = NEW.note), NEW.ref_id, NEW.doc_id);
+            END""")
+
+def _note_ids_c(c, notes) -> dict:
+    """{nota: ledger_notes.id} dando de alta las nuevas ('' no se guarda: note_id NULL)."""
+    out = {}
+    for note in dict.fromkeys(n for n in notes if n):
+        c.execute("INSERT OR IGNORE INTO ledger_notes(note) VALUES (?)", (note,))
+        out[note] = c.execute("SELECT id FROM ledger_notes WHERE note = ?", (note,)).fetchone()[0]
+    return out
+
+def _insert_movements_c(c, rows):
+    """Escribe en stock_ledger filas (product_id, warehouse_id, qty, kind, note, ref_id, doc_id)."""
+    rows = list(rows)
+    notes = _note_ids_c(c, (r[4] for r in rows))
+    c.executemany("""
+        INSERT INTO stock_ledger(product_id, warehouse_id, qty, kind, note_id, ref_id, doc_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, [(p, w, q, _kind_code(k), notes.get(n or ""), ref, d) for p, w, q, k, n, ref, d in rows])
+
+def _ensure_sync_tables():
+    """
+    Sincronización entre sitios (ver sync.py). sync_log: secuencia monótona de cambios de catálogo
+    (productos, cambios de código, bajas y alias, escrita por triggers); documentos y kardex usan su
+    propio id como secuencia.
+    sync_origin: filas recibidas de otro sitio (idempotencia y para no reenviarlas).
+    sync_peers: por sitio remoto, hasta dónde se le envió (ack) y hasta dónde se recibió.
+    """
+    with _cur() as c:
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS sync_log(
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            entity TEXT NOT NULL,   -- 'product' | 'rename' | 'product_del' | 'alias'
+            key TEXT NOT NULL,      -- código / alias ('rename': el código anterior)
+            new_key TEXT            -- 'rename': el código nuevo
+        )""")
+        if not _table_has_column("sync_log", "new_key"):
+            c.execute("ALTER TABLE sync_log ADD COLUMN new_key TEXT")
+        # Marca inicial: la secuencia arranca en 1 (0 = "nunca sincronizado": catálogo completo)
+        c.execute("INSERT INTO sync_log(entity, key) SELECT 'init', '' WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'sync_log')")
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS sync_origin(
+            site TEXT NOT NULL,
+            entity TEXT NOT NULL,   -- 'doc' | 'ledger'
+            remote_id INTEGER NOT NULL,
+            local_id INTEGER NOT NULL,
+            PRIMARY KEY(site, entity, remote_id)
+        )""")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_sync_origin_local ON sync_origin(entity, local_id)")
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS sync_peers(
+            site TEXT PRIMARY KEY,
+            sent_log INTEGER NOT NULL DEFAULT 0, sent_doc INTEGER NOT NULL DEFAULT 0,
+            sent_ledger INTEGER NOT NULL DEFAULT 0,
+            recv_log INTEGER NOT NULL DEFAULT 0, recv_doc INTEGER NOT NULL DEFAULT 0,
+            recv_ledger INTEGER NOT NULL DEFAULT 0,
+            updated_at TEXT
+        )""")
+        c.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_sync_product_ins AFTER INSERT ON products BEGIN
+                INSERT INTO sync_log(entity, key) VALUES ('product', NEW.code);
+            END""")
+        c.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_sync_product_upd AFTER UPDATE ON products
+            WHEN NEW.code IS NOT OLD.code OR NEW.name IS NOT OLD.name OR NEW.description IS NOT OLD.description
+              OR NEW.category IS NOT OLD.category OR NEW.unit IS NOT OLD.unit OR NEW.unit_factor IS NOT OLD.unit_factor
+            BEGIN
+                INSERT INTO sync_log(entity, key) VALUES ('product', NEW.code);
+            END""")
+        # Cambio de código: el otro sitio renombra su fila (si no, llegaría como producto nuevo)
+        c.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_sync_product_code AFTER UPDATE OF code ON products
+            WHEN NEW.code IS NOT OLD.code BEGIN
+                INSERT INTO sync_log(entity, key, new_key) VALUES ('rename', OLD.code, NEW.code);
+            END""")
+        c.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_sync_product_del AFTER DELETE ON products BEGIN
+                INSERT INTO sync_log(entity, key) VALUES ('product_del', OLD.code);
+            END""")
+        c.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_sync_alias_ins AFTER INSERT ON product_codes BEGIN
+                INSERT INTO sync_log(entity, key) VALUES ('alias', NEW.alt_code);
+            END""")
+        c.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_sync_alias_upd AFTER UPDATE OF product_id ON product_codes
+            WHEN NEW.product_id IS NOT OLD.product_id BEGIN
+                INSERT INTO sync_log(entity, key) VALUES ('alias', NEW.alt_code);
+            END""")
+        c.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_sync_alias_del AFTER DELETE ON product_codes BEGIN
+                INSERT INTO sync_log(entity, key) VALUES ('alias', OLD.alt_code);
+            END""")
+
+def _ensure_last_movement_columns():
+    """
+    product_warehouse.last_in_ts / last_out_ts / last_move_ts mantenidas por trigger al insertar
+    en stock_ledger ('ADJ' cuenta como entrada o salida según el signo). Índice
+    (warehouse_id, last_move_ts) para "sin movimiento en N días" sin leer el kardex.
+    """
+    with _cur() as c:
+        added = False
+        for col in ("last_in_ts", "last_out_ts", "last_move_ts"):
+            if not _table_has_column("product_warehouse", col):
+                c.execute(f"ALTER TABLE product_warehouse ADD COLUMN {col} DATETIME")
+                added = True
+        if added:
+            c.execute(f"""
+                UPDATE product_warehouse SET
+                    last_in_ts = datetime(m.last_in, 'unixepoch'), last_out_ts = datetime(m.last_out, 'unixepoch'),
+                    last_move_ts = datetime(m.last_move, 'unixepoch')
+                FROM (
+                    SELECT product_id, warehouse_id, MAX(ts) AS last_move,
+                           MAX(CASE WHEN kind IN {_IN_KINDS} OR (kind = {_ADJ} AND qty > 0) THEN ts END) AS last_in,
+                           MAX(CASE WHEN kind IN {_OUT_KINDS} OR (kind = {_ADJ} AND qty < 0) THEN ts END) AS last_out
+                    FROM stock_ledger GROUP BY product_id, warehouse_id
+                ) AS m
+                WHERE product_warehouse.product_id = m.product_id
+                  AND product_warehouse.warehouse_id = m.warehouse_id""")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_pw_last_move ON product_warehouse(warehouse_id, last_move_ts)")
+        c.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_pw_last_move AFTER INSERT ON stock_ledger BEGIN
+                UPDATE product_warehouse SET
+                    last_in_ts = CASE WHEN NEW.kind IN {_IN_KINDS} OR (NEW.kind = {_ADJ} AND NEW.qty > 0)
+                                      THEN MAX(IFNULL(last_in_ts, ''), datetime(NEW.ts, 'unixepoch')) ELSE last_in_ts END,
+                    last_out_ts = CASE WHEN NEW.kind IN {_OUT_KINDS} OR (NEW.kind = {_ADJ} AND NEW.qty < 0)
+                                       THEN MAX(IFNULL(last_out_ts, ''), datetime(NEW.ts, 'unixepoch')) ELSE last_out_ts END,
+                    last_move_ts = MAX(IFNULL(last_move_ts, ''), datetime(NEW.ts, 'unixepoch'))
+                WHERE product_id = NEW.product_id AND warehouse_id = NEW.warehouse_id;
+            END""")
+        # Vínculo creado después de sus movimientos: toma el último del kardex
+        c.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_pw_last_move_link AFTER INSERT ON product_warehouse
+            WHEN EXISTS (SELECT 1 FROM stock_ledger
+                         WHERE product_id = NEW.product_id AND warehouse_id = NEW.warehouse_id)
+            BEGIN
+                UPDATE product_warehouse SET
+                    last_in_ts = (SELECT datetime(MAX(ts), 'unixepoch') FROM stock_ledger
+                                  WHERE product_id = NEW.product_id AND warehouse_id = NEW.warehouse_id
+                                    AND (kind IN {_IN_KINDS} OR (kind = {_ADJ} AND qty > 0))),
+                    last_out_ts = (SELECT datetime(MAX(ts), 'unixepoch') FROM stock_ledger
+                                   WHERE product_id = NEW.product_id AND warehouse_id = NEW.warehouse_id
+                                     AND (kind IN {_OUT_KINDS} OR (kind = {_ADJ} AND qty < 0))),
+                    last_move_ts = (SELECT datetime(MAX(ts), 'unixepoch') FROM stock_ledger
+                                    WHERE product_id = NEW.product_id AND warehouse_id = NEW.warehouse_id)
+                WHERE product_id = NEW.product_id AND warehouse_id = NEW.warehouse_id;
+            END""")
+
+# Tablas ligadas a productos por product_id (antes por products.code; ver _ensure_product_id_keys)
+_PRODUCT_ID_DDL = {
+    "product_rules": """
+    CREATE TABLE IF NOT EXISTS product_rules(
+        product_id INTEGER NOT NULL,
+        warehouse_id INTEGER NOT NULL,
+        min_qty INTEGER DEFAULT 0,
+        max_qty INTEGER DEFAULT 0,
+        reorder_point INTEGER DEFAULT 0,
+        multiple INTEGER DEFAULT 1,
+        lead_time_days INTEGER DEFAULT 0,
+        PRIMARY KEY(product_id, warehouse_id),
+        FOREIGN KEY(product_id) REFERENCES products(id) ON DELETE CASCADE,
+        FOREIGN KEY(warehouse_id) REFERENCES warehouses(id) ON DELETE CASCADE
+    )""",
+    "product_locations": """
+    CREATE TABLE IF NOT EXISTS product_locations(
+        warehouse_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        location_id INTEGER,       -- FK a warehouse_locations.id
+        PRIMARY KEY(warehouse_id, product_id),
+        FOREIGN KEY(product_id) REFERENCES products(id) ON DELETE CASCADE,
+        FOREIGN KEY(warehouse_id) REFERENCES warehouses(id) ON DELETE CASCADE,
+        FOREIGN KEY(location_id) REFERENCES warehouse_locations(id) ON DELETE SET NULL
+    )""",
+    "count_lines": """
+    CREATE TABLE IF NOT EXISTS count_lines(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        sys_qty INTEGER NOT NULL,
+        counted_qty INTEGER,
+        UNIQUE(session_id, product_id),
+        FOREIGN KEY(session_id) REFERENCES count_sessions(id) ON DELETE CASCADE,
+        FOREIGN KEY(product_id) REFERENCES products(id) ON DELETE CASCADE
+    )""",
+}
+
+_PRODUCT_ID_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_rules_wh_pid ON product_rules(warehouse_id, product_id)",
+    "CREATE INDEX IF NOT EXISTS idx_ploc_pid ON product_locations(product_id)",    # cascada
+    "CREATE INDEX IF NOT EXISTS idx_count_lines_pid ON count_lines(product_id)",   # cascada
+)
+
+def _ensure_product_id_keys():
+    """
+    Migra product_rules / product_locations / count_lines de `code TEXT` a `product_id`:
+    cada tabla se reconstruye con _PRODUCT_ID_DDL en la misma transacción (las filas cuyo
+    código ya no existe se descartan). Después crea los índices compuestos.
+    """
+    for table, ddl in _PRODUCT_ID_DDL.items():
+        if not _table_has_column(table, "code"):
+            continue
+        cols = [r[1] for r in _conn.execute(f"PRAGMA table_info({table})") if r[1] != "code"]
+        with _cur() as c:
+            c.execute("BEGIN")  # el DDL no abre transacción implícita: todo o nada
+            c.execute(f"ALTER TABLE {table} RENAME TO _old_{table}")
+            c.execute(ddl)
+            c.execute(f"""INSERT INTO {table}(product_id, {', '.join(cols)})
+                          SELECT p.id, {', '.join('o.' + x for x in cols)}
+                          FROM _old_{table} o JOIN products p ON p.code = o.code""")
+            c.execute(f"DROP TABLE _old_{table}")
+    with _cur() as c:
+        for sql in _PRODUCT_ID_INDEXES:
+            c.execute(sql)
+
 def _create_schema():
     with _cur() as c:
         # Warehouses
@@ -128,21 +588,36 @@ def _create_schema():
             FOREIGN KEY(warehouse_id) REFERENCES warehouses(id) ON DELETE SET NULL
         )""")
 
-        # Movimientos de stock
+        # Kardex compacto: ts en segundos epoch (UTC), tipo y nota como enteros.
+        # stock_movements queda como vista de compatibilidad (ver _ensure_compact_ledger)
         c.execute("""
-        CREATE TABLE IF NOT EXISTS stock_movements(
+        CREATE TABLE IF NOT EXISTS movement_kinds(
+            id INTEGER PRIMARY KEY,
+            kind TEXT NOT NULL UNIQUE
+        )""")
+        c.executemany("INSERT OR IGNORE INTO movement_kinds(id, kind) VALUES (?, ?)",
+                      [(v, k) for k, v in MOVEMENT_KINDS.items()])
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS ledger_notes(
+            id INTEGER PRIMARY KEY,
+            note TEXT NOT NULL UNIQUE
+        )""")
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS stock_ledger(
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            ts DATETIME DEFAULT CURRENT_TIMESTAMP,
+            ts INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
             product_id   INTEGER NOT NULL,
             warehouse_id INTEGER NOT NULL,
             qty INTEGER NOT NULL,
-            kind TEXT NOT NULL,   -- 'IN' | 'OUT' | 'ADJ' | 'XFER-IN' | 'XFER-OUT'
-            note TEXT DEFAULT '',
+            kind INTEGER NOT NULL,   -- movement_kinds.id
+            note_id INTEGER,         -- ledger_notes.id (NULL = sin nota)
             ref_id INTEGER,
             doc_id INTEGER,
             FOREIGN KEY(product_id)   REFERENCES products(id)   ON DELETE CASCADE,
             FOREIGN KEY(warehouse_id) REFERENCES warehouses(id) ON DELETE CASCADE,
-            FOREIGN KEY(doc_id)       REFERENCES movement_docs(id) ON DELETE SET NULL
+            FOREIGN KEY(doc_id)       REFERENCES movement_docs(id) ON DELETE SET NULL,
+            FOREIGN KEY(kind)         REFERENCES movement_kinds(id),
+            FOREIGN KEY(note_id)      REFERENCES ledger_notes(id)
         )""")
 
         # Alias por producto
@@ -167,20 +642,7 @@ def _create_schema():
         )""")
 
         # === NUEVO: Reglas de reabastecimiento (por producto/almacén) ===
-        c.execute("""
-        CREATE TABLE IF NOT EXISTS product_rules(
-            code TEXT NOT NULL,
-            warehouse_id INTEGER NOT NULL,
-            min_qty INTEGER DEFAULT 0,
-            max_qty INTEGER DEFAULT 0,
-            reorder_point INTEGER DEFAULT 0,
-            multiple INTEGER DEFAULT 1,
-            lead_time_days INTEGER DEFAULT 0,
-            PRIMARY KEY(code, warehouse_id),
-            FOREIGN KEY(code) REFERENCES products(code) ON DELETE CASCADE,
-            FOREIGN KEY(warehouse_id) REFERENCES warehouses(id) ON DELETE CASCADE
-        )""")
-        c.execute("CREATE INDEX IF NOT EXISTS idx_rules_wh ON product_rules(warehouse_id)")
+        c.execute(_PRODUCT_ID_DDL["product_rules"])
 
         # === NUEVO: Proveedores / Clientes ===
         c.execute("""
@@ -206,16 +668,7 @@ def _create_schema():
             UNIQUE(warehouse_id, code),
             FOREIGN KEY(warehouse_id) REFERENCES warehouses(id) ON DELETE CASCADE
         )""")
-        c.execute("""
-        CREATE TABLE IF NOT EXISTS product_locations(
-            warehouse_id INTEGER NOT NULL,
-            code TEXT NOT NULL,        -- product code
-            location_id INTEGER,       -- FK a warehouse_locations.id
-            PRIMARY KEY(warehouse_id, code),
-            FOREIGN KEY(code) REFERENCES products(code) ON DELETE CASCADE,
-            FOREIGN KEY(warehouse_id) REFERENCES warehouses(id) ON DELETE CASCADE,
-            FOREIGN KEY(location_id) REFERENCES warehouse_locations(id) ON DELETE SET NULL
-        )""")
+        c.execute(_PRODUCT_ID_DDL["product_locations"])
 
         # === NUEVO: Ajustes (cabecera) ===
         c.execute("""
@@ -240,17 +693,51 @@ def _create_schema():
             note TEXT,
             FOREIGN KEY(warehouse_id) REFERENCES warehouses(id) ON DELETE CASCADE
         )""")
+        c.execute(_PRODUCT_ID_DDL["count_lines"])
+
+        # === NUEVO: Pronóstico de demanda (caché incremental) ===
         c.execute("""
-        CREATE TABLE IF NOT EXISTS count_lines(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            session_id INTEGER NOT NULL,
-            code TEXT NOT NULL,        -- product code
-            sys_qty INTEGER NOT NULL,
-            counted_qty INTEGER,
-            UNIQUE(session_id, code),
-            FOREIGN KEY(session_id) REFERENCES count_sessions(id) ON DELETE CASCADE,
-            FOREIGN KEY(code) REFERENCES products(code) ON DELETE CASCADE
+        CREATE TABLE IF NOT EXISTS demand_daily(
+            product_id   INTEGER NOT NULL,
+            warehouse_id INTEGER NOT NULL,
+            day TEXT NOT NULL,             -- YYYY-MM-DD (UTC, igual que stock_ledger.ts)
+            qty INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY(product_id, warehouse_id, day),
+            FOREIGN KEY(product_id)   REFERENCES products(id)   ON DELETE CASCADE,
+            FOREIGN KEY(warehouse_id) REFERENCES warehouses(id) ON DELETE CASCADE
+        )""")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_demand_daily_day ON demand_daily(day)")
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS demand_forecast(
+            product_id   INTEGER NOT NULL,
+            warehouse_id INTEGER NOT NULL,
+            as_of TEXT NOT NULL,
+            ma7  REAL NOT NULL DEFAULT 0,
+            ma30 REAL NOT NULL DEFAULT 0,
+            ewma REAL NOT NULL DEFAULT 0,
+            rate REAL NOT NULL DEFAULT 0,  -- demanda diaria usada para cobertura
+            PRIMARY KEY(product_id, warehouse_id),
+            FOREIGN KEY(product_id)   REFERENCES products(id)   ON DELETE CASCADE,
+            FOREIGN KEY(warehouse_id) REFERENCES warehouses(id) ON DELETE CASCADE
+        )""")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_forecast_wh ON demand_forecast(warehouse_id)")
+
+        # Clasificación ABC (volumen de salidas) / XYZ (variabilidad semanal), ver classify.py
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS product_class(
+            product_id   INTEGER NOT NULL,
+            warehouse_id INTEGER NOT NULL,
+            as_of TEXT NOT NULL,
+            out_qty INTEGER NOT NULL DEFAULT 0,
+            cum_share REAL NOT NULL DEFAULT 0,   -- participación acumulada en las salidas del almacén
+            abc TEXT NOT NULL,
+            cv REAL,                             -- NULL sin demanda
+            xyz TEXT NOT NULL,
+            PRIMARY KEY(product_id, warehouse_id),
+            FOREIGN KEY(product_id)   REFERENCES products(id)   ON DELETE CASCADE,
+            FOREIGN KEY(warehouse_id) REFERENCES warehouses(id) ON DELETE CASCADE
         )""")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_class_wh_abc ON product_class(warehouse_id, abc, xyz)")
 
         # Triggers: evitar qty negativa en product_stock
         c.execute("""
@@ -271,8 +758,17 @@ def _create_schema():
         END;""")
 
         # Índices para movimientos y docs
-        c.execute("CREATE INDEX IF NOT EXISTS idx_movements_doc ON stock_movements(doc_id)")
-        c.execute("CREATE INDEX IF NOT EXISTS idx_movements_prod_wh_ts ON stock_movements(product_id, warehouse_id, ts DESC)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_ledger_doc ON stock_ledger(doc_id)")
+        # Ascendentes: recorridos al revés dan "ts DESC, id DESC" (orden de list_movements) sin TEMP B-TREE
+        c.execute("CREATE INDEX IF NOT EXISTS idx_ledger_pw_ts ON stock_ledger(product_id, warehouse_id, ts)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_ledger_wh_ts ON stock_ledger(warehouse_id, ts)")
+        # Historial de un producto en todos sus almacenes (ficha, list_movements por código): el
+        # rowid (id) va implícito al final, así que LIMIT corta sin ordenar todo el historial
+        c.execute("CREATE INDEX IF NOT EXISTS idx_ledger_p_ts ON stock_ledger(product_id, ts)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_ledger_ts ON stock_ledger(ts)")
+        # Parcial y cubriente para demanda (fetch_out_demand / buckets): solo salidas
+        c.execute(f"""CREATE INDEX IF NOT EXISTS idx_ledger_out
+                     ON stock_ledger(ts, product_id, warehouse_id, qty) WHERE kind = {MOVEMENT_KINDS['OUT']}""")
         c.execute("CREATE INDEX IF NOT EXISTS idx_docs_wh_ts ON movement_docs(warehouse_id, ts DESC)")
         c.execute("CREATE INDEX IF NOT EXISTS idx_docs_ts ON movement_docs(ts DESC)")
 
@@ -304,6 +800,22 @@ def ensure_color_column():
         if "color_key" not in cols:
             c.execute("ALTER TABLE warehouses ADD COLUMN color_key TEXT DEFAULT 'slate'")
 
+def _ensure_warehouse_delete_flag():
+    """warehouses.deleting = 1: borrado por pasos en curso (el almacén ya no se lista)."""
+    with _cur() as c:
+        if "deleting" not in [r[1] for r in c.execute("PRAGMA table_info(warehouses)")]:
+            c.execute("ALTER TABLE warehouses ADD COLUMN deleting INTEGER NOT NULL DEFAULT 0")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_adjustments_doc ON adjustments(doc_id)")   # cascada al borrar documentos
+        # Un almacén en borrado no admite vínculos ni movimientos nuevos (los pasos de borrado ya
+        # pasaron por esas filas y se perderían): cubre UI, API, importaciones y sincronización
+        for table in ("product_warehouse", "stock_ledger"):
+            c.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_wh_deleting BEFORE INSERT ON {table}
+                WHEN (SELECT deleting FROM warehouses WHERE id = NEW.warehouse_id) = 1
+                BEGIN
+                    SELECT RAISE(ABORT, 'El almacén se está eliminando: no admite movimientos');
+                END""")
+
 def ensure_products_table():
     _create_schema()
 
@@ -338,14 +850,101 @@ def add_warehouse(name: str, description: str = "", color_key: str = "slate"):
 
 def list_warehouses():
     with _cur() as c:
-        rows = c.execute("SELECT id, name, description, color_key FROM warehouses ORDER BY name").fetchall()
+        rows = c.execute("SELECT id, name, description, color_key FROM warehouses WHERE deleting = 0 ORDER BY name").fetchall()
         return [dict(r) for r in rows]
 
+# Borrado de almacén por pasos: cada paso borra hasta WAREHOUSE_DELETE_ROWS filas dependientes en
+# una transacción corta (las estaciones escriben entre pasos). Cada paso es (acción, selección de
+# rowids por índice); el primero que aún tenga filas es el que avanza. Al final se borra el almacén
+# y la cascada ya no tiene casi nada que recorrer.
+WAREHOUSE_DELETE_ROWS = 1000
+WAREHOUSE_DELETE_PAUSE_S = 0.05
+_PAIR_TABLES = ("product_stock", "product_threshold", "product_rules", "product_locations",
+                "demand_daily", "demand_forecast", "product_class")
+_WAREHOUSE_DELETE_STEPS = (
+    ("DELETE FROM stock_ledger WHERE id IN ({})", "SELECT id FROM stock_ledger WHERE warehouse_id = ?"),
+    # movement_docs.warehouse_id es NOT NULL (su SET NULL nunca pudo aplicarse): los documentos se borran
+    ("DELETE FROM movement_docs WHERE id IN ({})", "SELECT id FROM movement_docs WHERE warehouse_id = ?"),
+    ("DELETE FROM count_lines WHERE id IN ({})",
+     "SELECT l.id FROM count_sessions s JOIN count_lines l ON l.session_id = s.id WHERE s.warehouse_id = ?"),
+    # Tablas por par producto/almacén: desde product_warehouse (idx_pw_wh; CROSS JOIN fija el orden) + su llave
+    *((f"DELETE FROM {t} WHERE rowid IN ({{}})",
+       f"SELECT x.rowid FROM product_warehouse pw CROSS JOIN {t} x "
+       f"ON x.product_id = pw.product_id AND x.warehouse_id = pw.warehouse_id WHERE pw.warehouse_id = ?")
+      for t in _PAIR_TABLES),
+    ("DELETE FROM product_warehouse WHERE rowid IN ({})", "SELECT rowid FROM product_warehouse WHERE warehouse_id = ?"),
+    ("DELETE FROM warehouse_locations WHERE rowid IN ({})", "SELECT rowid FROM warehouse_locations WHERE warehouse_id = ?"),
+    ("DELETE FROM adjustments WHERE id IN ({})", "SELECT id FROM adjustments WHERE warehouse_id = ?"),
+    ("DELETE FROM count_sessions WHERE id IN ({})", "SELECT id FROM count_sessions WHERE warehouse_id = ?"),
+)
+
+def begin_delete_warehouse(warehouse_id: int):
+    """Marca el almacén para borrado (deja de listarse). El borrado lo hace run_delete_warehouse."""
+    with _cur() as c:
+        if not c.execute("UPDATE warehouses SET deleting = 1 WHERE id = ?", (warehouse_id,)).rowcount:
+            raise ValueError(f"Almacén {warehouse_id} no existe")
+        events.emit(events.stock_changed(warehouse_id))  # sus existencias salen de totales y vistas
+
+def pending_warehouse_deletes() -> list[dict]:
+    """Almacenes con borrado sin terminar (p. ej. la app se cerró a mitad): se reanudan."""
+    with _cur() as c:
+        return [dict(r) for r in c.execute("SELECT id, name FROM warehouses WHERE deleting = 1 ORDER BY id")]
+
+def _delete_warehouse_count_c(c, warehouse_id: int) -> int:
+    return sum(c.execute(f"SELECT COUNT(*) FROM ({select})", (warehouse_id,)).fetchone()[0]
+               for _, select in _WAREHOUSE_DELETE_STEPS)
+
+def _delete_warehouse_step_c(c, warehouse_id: int, rows: int) -> int:
+    """Un paso: hasta `rows` filas de la primera tabla con pendientes. 0 = borró el almacén."""
+    for action, select in _WAREHOUSE_DELETE_STEPS:
+        n = c.execute(action.format(select + " LIMIT ?"), (warehouse_id, rows)).rowcount
+        if n:
+            return n
+    c.execute("DELETE FROM warehouses WHERE id = ?", (warehouse_id,))
+    return 0
+
+def run_delete_warehouse(warehouse_id: int, progress=None, rows: int = WAREHOUSE_DELETE_ROWS,
+                         pause: float = WAREHOUSE_DELETE_PAUSE_S, stop=None) -> bool:
+    """
+    Borra un almacén marcado (begin_delete_warehouse) por pasos, con conexión propia y un COMMIT
+    por paso. progress(hechas, total) tras cada paso. Es reanudable: lo borrado ya no se repite.
+    Devuelve True al terminar, False si `stop` (threading.Event) lo detuvo antes.
+    """
+    conn = open_connection()
+    try:
+        if conn.execute("SELECT deleting FROM warehouses WHERE id = ?", (warehouse_id,)).fetchone() is None:
+            return True
+        total = _delete_warehouse_count_c(conn, warehouse_id)
+        done = 0
+        while True:
+            if stop is not None and stop.is_set():
+                return False
+            c = conn.cursor()
+            c.execute("BEGIN IMMEDIATE")
+            try:
+                n = _delete_warehouse_step_c(c, warehouse_id, max(1, int(rows)))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            if n == 0:
+                break
+            done = min(total, done + n)
+            if progress:
+                progress(done, total)
+            if pause:
+                time.sleep(pause)
+    finally:
+        conn.close()
+    events.emit(events.stock_changed(warehouse_id))
+    if progress:
+        progress(total, total)
+    return True
+
 def delete_warehouse_cascade(warehouse_id: int):
-    with _cur() as c:
-        c.execute("DELETE FROM product_warehouse WHERE warehouse_id = ?", (warehouse_id,))
-        c.execute("DELETE FROM product_stock WHERE warehouse_id = ?", (warehouse_id,))
-        c.execute("DELETE FROM warehouses WHERE id = ?", (warehouse_id,))
+    """Borrado completo en el hilo actual (por pasos; cada paso en su propia transacción)."""
+    begin_delete_warehouse(warehouse_id)
+    run_delete_warehouse(warehouse_id, pause=0)
 
 # ---------------- Products ----------------
 def upsert_product(code: str, name: str | None, description: str | None, warehouse_id: int | None):
@@ -368,6 +967,7 @@ def upsert_product(code: str, name: str | None, description: str | None, warehou
         if warehouse_id is not None:
             c.execute("INSERT OR IGNORE INTO product_warehouse(product_id, warehouse_id) VALUES (?, ?)", (product_id, warehouse_id))
             c.execute("INSERT OR IGNORE INTO product_stock(product_id, warehouse_id, qty) VALUES (?, ?, 0)", (product_id, warehouse_id))
+        events.emit(events.ProductUpserted(code, warehouse_id))
 
 def list_products():
     with _cur() as c:
@@ -375,9 +975,13 @@ def list_products():
         rows = c.execute("SELECT id, code, name, description, category, unit, unit_factor FROM products ORDER BY code").fetchall()
         return [{**dict(r), "warehouse_id": None} for r in rows]
 
-def list_products_by_warehouse(warehouse_id: int):
+PRODUCT_ROW_COLUMNS = ("id", "code", "name", "description", "qty")
+
+def fetch_products_by_warehouse_rows(warehouse_id: int) -> list[tuple]:
+    """Igual que list_products_by_warehouse pero en tuplas planas (PRODUCT_ROW_COLUMNS)."""
     with _cur() as c:
-        rows = c.execute("""
+        c.row_factory = None
+        return c.execute("""
             SELECT p.id, p.code, p.name, p.description,
                    IFNULL(ps.qty, 0) AS qty
             FROM products p
@@ -387,7 +991,76 @@ def list_products_by_warehouse(warehouse_id: int):
             WHERE pw.warehouse_id = ?
             ORDER BY p.code
         """, (warehouse_id,)).fetchall()
-        return [{**dict(r), "warehouse_id": warehouse_id} for r in rows]
+
+def list_products_by_warehouse(warehouse_id: int):
+    return [{"id": i, "code": code, "name": name, "description": descr, "qty": qty, "warehouse_id": warehouse_id}
+            for i, code, name, descr, qty in fetch_products_by_warehouse_rows(warehouse_id)]
+
+def fetch_catalog_rows() -> list[tuple]:
+    """(id, code, name, description) de todo el catálogo ordenado por código, en tuplas planas."""
+    with _cur() as c:
+        c.row_factory = None
+        return c.execute("""
+            SELECT id, code, IFNULL(name, ''), IFNULL(description, '') FROM products ORDER BY code
+        """).fetchall()
+
+def fetch_import_index(warehouse_id: int) -> tuple[list[tuple], list[tuple]]:
+    """
+    Para la vista previa de importación: ([(id, code, name, linked, qty)] de todo el catálogo con el
+    vínculo y las existencias en el almacén, [(alt_code, product_id)] de los alias).
+    """
+    with _cur() as c:
+        c.row_factory = None
+        products = c.execute("""
+            SELECT p.id, p.code, IFNULL(p.name, ''), pw.product_id IS NOT NULL, IFNULL(ps.qty, 0)
+            FROM products p
+            LEFT JOIN product_warehouse pw ON pw.product_id = p.id AND pw.warehouse_id = ?
+            LEFT JOIN product_stock ps ON ps.product_id = p.id AND ps.warehouse_id = ?
+        """, (warehouse_id, warehouse_id)).fetchall()
+        aliases = c.execute("SELECT alt_code, product_id FROM product_codes").fetchall()
+        return products, aliases
+
+def fetch_stock_pairs(product_ids=None) -> list[tuple]:
+    """
+    (product_id, warehouse_id, qty) por vínculo producto/almacén (opcionalmente solo esos ids);
+    sin los almacenes en borrado.
+    """
+    with _cur() as c:
+        c.row_factory = None
+        sql = """
+            SELECT pw.product_id, pw.warehouse_id, IFNULL(ps.qty, 0)
+            FROM product_warehouse pw
+            LEFT JOIN product_stock ps
+                   ON ps.product_id = pw.product_id AND ps.warehouse_id = pw.warehouse_id
+            WHERE pw.warehouse_id IN (SELECT id FROM warehouses WHERE deleting = 0)"""
+        if product_ids is None:
+            return c.execute(sql).fetchall()
+        ids, out = list(product_ids), []
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            out += c.execute(sql + f" AND pw.product_id IN ({','.join('?' * len(chunk))})", chunk).fetchall()
+        return out
+
+def fetch_change_marks() -> tuple:
+    """
+    Marcas baratas para notar escrituras de otras conexiones (otro proceso, el escritor, la API):
+    (data_version de _conn, firma de catálogo/vínculos/almacenes, último id del kardex).
+    """
+    with _cur() as c:
+        version = c.execute("PRAGMA data_version").fetchone()[0]
+        sig = tuple(c.execute("""
+            SELECT (SELECT MAX(seq) FROM sync_log), (SELECT MAX(rowid) FROM product_warehouse),
+                   (SELECT COUNT(*) || ':' || TOTAL(deleting) || ':' || IFNULL(MAX(id), 0) FROM warehouses)
+        """).fetchone())
+        hi = c.execute("SELECT IFNULL(MAX(id), 0) FROM stock_ledger").fetchone()[0]
+    return version, sig, int(hi)
+
+def fetch_ledger_product_ids(after_id: int, upto_id: int) -> set[int]:
+    """product_id con movimientos en el kardex con id en (after_id, upto_id]."""
+    with _cur() as c:
+        c.row_factory = None
+        return {r[0] for r in c.execute("SELECT product_id FROM stock_ledger WHERE id > ? AND id <= ?",
+                                        (after_id, upto_id))}
 
 # ---------------- Alias ----------------
 def add_product_alias(code: str, alt_code: str):
@@ -397,6 +1070,58 @@ def add_product_alias(code: str, alt_code: str):
             raise ValueError(f"No existe producto base '{code}'")
         c.execute("INSERT OR IGNORE INTO product_codes(product_id, alt_code) VALUES (?, ?)", (prod["id"], alt_code))
 
+def _import_aliases_c(c, pairs) -> dict:
+    """
+    Alias en bloque [(alt_code, código base o alias)] sin commit. Resuelve las bases de una vez vía
+    tabla temporal e inserta con INSERT OR IGNORE ... SELECT. No inserta (y reporta):
+    - missing: bases que no existen
+    - is_code: alias que ya son código principal de un producto
+    - conflicts: (alias, producto actual o '*', producto pedido) si el alias ya apunta a otro producto
+      o el mismo archivo lo asigna a productos distintos ('*')
+    Devuelve {"rows","added","existing","missing","is_code","conflicts"}.
+    """
+    c.execute("CREATE TEMP TABLE IF NOT EXISTS _tmp_alias(alt_code TEXT NOT NULL, base TEXT NOT NULL, pid INTEGER)")
+    c.execute("DELETE FROM _tmp_alias")
+    c.executemany("INSERT INTO _tmp_alias(alt_code, base) VALUES (?, ?)",
+                  [(a, b) for a, b in ((str(a or "").strip(), str(b or "").strip()) for a, b in pairs) if a and b])
+    rows = c.execute("SELECT COUNT(*) FROM _tmp_alias").fetchone()[0]
+    c.execute("""
+        UPDATE _tmp_alias SET pid = COALESCE((SELECT id FROM products WHERE code = base),
+                                             (SELECT product_id FROM product_codes WHERE alt_code = base))""")
+    c.execute("CREATE INDEX IF NOT EXISTS temp._tmp_alias_alt ON _tmp_alias(alt_code)")
+    missing = [r[0] for r in c.execute("SELECT DISTINCT base FROM _tmp_alias WHERE pid IS NULL ORDER BY base")]
+    is_code = [r[0] for r in c.execute("""
+        SELECT DISTINCT t.alt_code FROM _tmp_alias t JOIN products p ON p.code = t.alt_code
+        WHERE t.pid IS NOT NULL ORDER BY t.alt_code""")]
+    conflicts = [tuple(r) for r in c.execute("""
+        SELECT t.alt_code, '*', GROUP_CONCAT(DISTINCT p.code) FROM _tmp_alias t JOIN products p ON p.id = t.pid
+        GROUP BY t.alt_code HAVING COUNT(DISTINCT t.pid) > 1
+        UNION ALL
+        SELECT DISTINCT t.alt_code, cur.code, p.code
+        FROM _tmp_alias t
+        JOIN product_codes pc ON pc.alt_code = t.alt_code
+        JOIN products cur ON cur.id = pc.product_id
+        JOIN products p ON p.id = t.pid
+        WHERE pc.product_id <> t.pid
+        ORDER BY 1""")]
+    existing = c.execute("""
+        SELECT COUNT(DISTINCT t.alt_code) FROM _tmp_alias t
+        JOIN product_codes pc ON pc.alt_code = t.alt_code AND pc.product_id = t.pid""").fetchone()[0]
+    c.execute("""
+        INSERT OR IGNORE INTO product_codes(product_id, alt_code)
+        SELECT MIN(pid), alt_code FROM _tmp_alias
+        WHERE pid IS NOT NULL AND alt_code NOT IN (SELECT code FROM products)
+        GROUP BY alt_code HAVING COUNT(DISTINCT pid) = 1""")
+    added = c.execute("SELECT changes()").fetchone()[0]
+    c.execute("DELETE FROM _tmp_alias")
+    return {"rows": rows, "added": added, "existing": existing, "missing": missing,
+            "is_code": is_code, "conflicts": conflicts}
+
+def import_aliases(pairs) -> dict:
+    """Carga masiva de alias (p. ej. referencias EAN/UPC de un proveedor) en una sola transacción."""
+    with _tx() as c:
+        return _import_aliases_c(c, pairs)
+
 def resolve_to_canonical_code(any_code: str) -> str:
     with _cur() as c:
         row = c.execute("SELECT code FROM products WHERE code = ?", (any_code,)).fetchone()
@@ -472,54 +1197,82 @@ def create_movement_doc(
                     int(total_lines or 0), int(total_qty or 0), s, int(f), st))
         return int(c.lastrowid)
 
-def increment_stock(code_or_alias: str, warehouse_id: int, qty: int, note: str = "", doc_id: int | None = None):
-    if qty <= 0: return
-    with _cur() as c:
-        prod = _get_product_by_any_code(code_or_alias)
-        if not prod: raise ValueError(f"Producto '{code_or_alias}' no existe")
-        c.execute("INSERT OR IGNORE INTO product_warehouse(product_id, warehouse_id) VALUES (?, ?)", (prod["id"], warehouse_id))
-        c.execute("""
-            INSERT INTO product_stock(product_id, warehouse_id, qty)
-            VALUES (?, ?, ?)
-            ON CONFLICT(product_id, warehouse_id)
-            DO UPDATE SET qty = qty + excluded.qty
-        """, (prod["id"], warehouse_id, qty))
-        c.execute("""
-            INSERT INTO stock_movements(product_id, warehouse_id, qty, kind, note, doc_id)
-            VALUES (?, ?, ?, 'IN', ?, ?)
-        """, (prod["id"], warehouse_id, qty, note, doc_id))
+def _product_c(c, code_or_alias: str) -> tuple[int, str]:
+    """(product_id, código base) para un código o alias."""
+    row = c.execute("SELECT id, code FROM products WHERE code = ?", (code_or_alias,)).fetchone()
+    if not row:
+        row = c.execute("""
+            SELECT p.id, p.code FROM product_codes pc JOIN products p ON p.id = pc.product_id
+            WHERE pc.alt_code = ?""", (code_or_alias,)).fetchone()
+    if not row:
+        raise ValueError(f"Producto '{code_or_alias}' no existe")
+    return int(row[0]), row[1]
+
+def _product_id_c(c, code_or_alias: str) -> int | None:
+    """product_id de un código o alias; None si no existe (para lecturas)."""
+    try:
+        return _product_c(c, code_or_alias)[0]
+    except ValueError:
+        return None
 
-def decrement_stock(code_or_alias: str, warehouse_id: int, qty: int, note: str = "", doc_id: int | None = None):
+def _codes_for_ids_c(c, pids) -> list[str] | None:
+    """Códigos base de los ids (para eventos); None si son demasiados para detallar."""
+    pids = list(pids)
+    if len(pids) > events.MAX_CODES:
+        return None
+    if not pids:
+        return []
+    return [r[0] for r in c.execute(f"SELECT code FROM products WHERE id IN ({','.join('?' * len(pids))})", pids)]
+
+def _increment_stock_c(c, code_or_alias: str, warehouse_id: int, qty: int, note: str = "", doc_id: int | None = None):
+    """Entrada con el cursor recibido (sin commit); la usan increment_stock y el hilo escritor."""
+    if qty <= 0: return
+    pid, code = _product_c(c, code_or_alias)
+    c.execute("INSERT OR IGNORE INTO product_warehouse(product_id, warehouse_id) VALUES (?, ?)", (pid, warehouse_id))
+    c.execute("""
+        INSERT INTO product_stock(product_id, warehouse_id, qty)
+        VALUES (?, ?, ?)
+        ON CONFLICT(product_id, warehouse_id)
+        DO UPDATE SET qty = qty + excluded.qty
+    """, (pid, warehouse_id, qty))
+    _insert_movements_c(c, [(pid, warehouse_id, qty, "IN", note, None, doc_id)])
+    events.emit(events.stock_changed(warehouse_id, [code]))
+
+def _decrement_stock_c(c, code_or_alias: str, warehouse_id: int, qty: int, note: str = "", doc_id: int | None = None):
+    """Salida con el cursor recibido (sin commit); valida existencia antes de descontar."""
     if qty <= 0:
         return
-    with _cur() as c:
-        prod = _get_product_by_any_code(code_or_alias)
-        if not prod:
-            raise ValueError(f"Producto '{code_or_alias}' no existe")
-
-        # Asegura vínculo y fila en stock
-        c.execute("INSERT OR IGNORE INTO product_warehouse(product_id, warehouse_id) VALUES (?, ?)", (prod["id"], warehouse_id))
-        c.execute("INSERT OR IGNORE INTO product_stock(product_id, warehouse_id, qty) VALUES (?, ?, 0)", (prod["id"], warehouse_id))
-
-        # Lee disponibilidad actual
-        row = c.execute(
-            "SELECT qty FROM product_stock WHERE product_id=? AND warehouse_id=?",
-            (prod["id"], warehouse_id)
-        ).fetchone()
-        curr = int(row["qty"]) if row else 0
+    pid, code = _product_c(c, code_or_alias)
+
+    # Asegura vínculo y fila en stock
+    c.execute("INSERT OR IGNORE INTO product_warehouse(product_id, warehouse_id) VALUES (?, ?)", (pid, warehouse_id))
+    c.execute("INSERT OR IGNORE INTO product_stock(product_id, warehouse_id, qty) VALUES (?, ?, 0)", (pid, warehouse_id))
+
+    # Lee disponibilidad actual
+    row = c.execute(
+        "SELECT qty FROM product_stock WHERE product_id=? AND warehouse_id=?",
+        (pid, warehouse_id)
+    ).fetchone()
+    curr = int(row[0]) if row else 0
+
+    if qty > curr:
+        raise ValueError(f"Solicitud ({qty}) supera existencia ({curr}) en almacén {warehouse_id}")
+
+    # Aplica decremento
+    c.execute(
+        "UPDATE product_stock SET qty = qty - ? WHERE product_id=? AND warehouse_id=?",
+        (qty, pid, warehouse_id)
+    )
+    _insert_movements_c(c, [(pid, warehouse_id, qty, "OUT", note, None, doc_id)])
+    events.emit(events.stock_changed(warehouse_id, [code]))
 
-        if qty > curr:
-            raise ValueError(f"Solicitud ({qty}) supera existencia ({curr}) en almacén {warehouse_id}")
+def increment_stock(code_or_alias: str, warehouse_id: int, qty: int, note: str = "", doc_id: int | None = None):
+    with _cur() as c:
+        _increment_stock_c(c, code_or_alias, warehouse_id, qty, note, doc_id)
 
-        # Aplica decremento
-        c.execute(
-            "UPDATE product_stock SET qty = qty - ? WHERE product_id=? AND warehouse_id=?",
-            (qty, prod["id"], warehouse_id)
-        )
-        c.execute("""
-            INSERT INTO stock_movements(product_id, warehouse_id, qty, kind, note, doc_id)
-            VALUES (?, ?, ?, 'OUT', ?, ?)
-        """, (prod["id"], warehouse_id, qty, note, doc_id))
+def decrement_stock(code_or_alias: str, warehouse_id: int, qty: int, note: str = "", doc_id: int | None = None):
+    with _cur() as c:
+        _decrement_stock_c(c, code_or_alias, warehouse_id, qty, note, doc_id)
 
 def set_stock(code_or_alias: str, warehouse_id: int, new_qty: int, note: str = "", doc_id: int | None = None):
     if new_qty < 0:
@@ -545,37 +1298,318 @@ def set_stock(code_or_alias: str, warehouse_id: int, new_qty: int, note: str = "
         """, (prod["id"], warehouse_id, int(new_qty)))
 
         if delta != 0:
-            c.execute("""
-                INSERT INTO stock_movements(product_id, warehouse_id, qty, kind, note, doc_id)
-                VALUES (?, ?, ?, 'ADJ', ?, ?)
-            """, (prod["id"], warehouse_id, delta, note or f"Ajuste a {new_qty} (Δ {delta})", doc_id))
+            _insert_movements_c(c, [(prod["id"], warehouse_id, delta, "ADJ",
+                                     note or f"Ajuste a {new_qty} (Δ {delta})", None, doc_id)])
+            events.emit(events.stock_changed(warehouse_id, [prod["code"]]))
+
+def _normalize_lines(lines) -> list[tuple[str, int]]:
+    """{code: qty} o [(code, qty)] -> [(code, qty)] sin vacíos ni cantidades <= 0."""
+    items = list(lines.items()) if isinstance(lines, dict) else list(lines)
+    return [(str(code).strip(), int(q or 0)) for code, q in items if int(q or 0) > 0 and str(code).strip()]
+
+def _resolve_codes_c(c, codes) -> dict:
+    """
+    Resuelve en bloque códigos/alias -> product_id (una consulta vía tabla temporal).
+    Los códigos inexistentes no aparecen en el resultado.
+    """
+    c.execute("CREATE TEMP TABLE IF NOT EXISTS _tmp_codes(code TEXT PRIMARY KEY)")
+    c.execute("DELETE FROM _tmp_codes")
+    c.executemany("INSERT OR IGNORE INTO _tmp_codes(code) VALUES (?)", [(str(x),) for x in codes])
+    rows = c.execute("""
+        SELECT t.code, COALESCE(p.id, pc.product_id)
+        FROM _tmp_codes t
+        LEFT JOIN products p       ON p.code = t.code
+        LEFT JOIN product_codes pc ON pc.alt_code = t.code
+    """).fetchall()
+    c.execute("DELETE FROM _tmp_codes")
+    return {code: int(pid) for code, pid in rows if pid is not None}
+
+def post_transfer_order(src_warehouse_id: int, dst_warehouse_id: int, lines, note: str = "Transferencia",
+                        reference: str = "", counterparty: str = "", ref_id: int | None = None,
+                        user_id: int | None = None) -> int | None:
+    """
+    Registra una orden de transferencia de varias líneas como un documento XFER en una
+    sola transacción. `lines` es {code_or_alias: qty} o [(code_or_alias, qty)].
+    Los códigos se resuelven una sola vez, ambos lados se escriben con executemany y cada
+    XFER-IN queda ligado (ref_id) a su XFER-OUT. Devuelve el doc_id (None si no hay líneas).
+    """
+    if src_warehouse_id == dst_warehouse_id:
+        raise ValueError("Origen y destino no pueden ser iguales")
+    if not _normalize_lines(lines):
+        return None
+
+    with _tx() as c:
+        return _post_transfer_order_c(c, src_warehouse_id, dst_warehouse_id, lines, note,
+                                      reference, counterparty, ref_id, user_id)
+
+def _post_transfer_order_c(c, src_warehouse_id: int, dst_warehouse_id: int, lines, note: str = "Transferencia",
+                           reference: str = "", counterparty: str = "", ref_id: int | None = None,
+                           user_id: int | None = None) -> int | None:
+    """Cuerpo de post_transfer_order con el cursor de una transacción en curso."""
+    if src_warehouse_id == dst_warehouse_id:
+        raise ValueError("Origen y destino no pueden ser iguales")
+    items = _normalize_lines(lines)
+    if not items:
+        return None
+    ids = _resolve_codes_c(c, {code for code, _ in items})
+    missing = sorted({code for code, _ in items if code not in ids})
+    if missing:
+        raise ValueError(f"Producto(s) no existen: {', '.join(missing[:10])}" + (" ..." if len(missing) > 10 else ""))
+
+    # Un mismo producto puede llegar por código y por alias: se agregan las cantidades
+    qty_by_pid: dict[int, int] = {}
+    label: dict[int, str] = {}
+    for code, q in items:
+        qty_by_pid[ids[code]] = qty_by_pid.get(ids[code], 0) + q
+        label.setdefault(ids[code], code)
+    pairs = list(qty_by_pid.items())
+
+    for wid in (src_warehouse_id, dst_warehouse_id):
+        c.executemany("INSERT OR IGNORE INTO product_warehouse(product_id, warehouse_id) VALUES (?, ?)",
+                      [(pid, wid) for pid, _ in pairs])
+        c.executemany("INSERT OR IGNORE INTO product_stock(product_id, warehouse_id, qty) VALUES (?, ?, 0)",
+                      [(pid, wid) for pid, _ in pairs])
+
+    avail: dict[int, int] = {}
+    pids = list(qty_by_pid)
+    for i in range(0, len(pids), 500):  # límite de parámetros de SQLite
+        chunk = pids[i:i + 500]
+        avail.update(c.execute(f"""
+            SELECT product_id, qty FROM product_stock
+            WHERE warehouse_id = ? AND product_id IN ({",".join("?" * len(chunk))})
+        """, [src_warehouse_id, *chunk]).fetchall())
+    short = [(pid, q, int(avail.get(pid, 0))) for pid, q in pairs if q > int(avail.get(pid, 0))]
+    if short:
+        pid, q, a = short[0]
+        raise ValueError(f"Transferencia supera disponibilidad en {len(short)} línea(s) "
+                         f"(p.ej. '{label[pid]}': req {q} > disp {a})")
+
+    total_qty = sum(q for _, q in pairs)
+    doc_id = _insert_movement_doc_c(
+        c, "XFER", src_warehouse_id,
+        counterparty=counterparty, reference=reference,
+        note=note or f"XFER {src_warehouse_id} -> {dst_warehouse_id}",
+        total_lines=len(pairs), total_qty=total_qty, created_by=user_id,
+        dst_warehouse_id=dst_warehouse_id,
+    )
+
+    # OUT origen
+    c.executemany("UPDATE product_stock SET qty = qty - ? WHERE product_id=? AND warehouse_id=?",
+                  [(q, pid, src_warehouse_id) for pid, q in pairs])
+    _insert_movements_c(c, [(pid, src_warehouse_id, q, "XFER-OUT", note or f"XFER a {dst_warehouse_id}", ref_id, doc_id)
+                            for pid, q in pairs])
+    out_ids = dict(c.execute("""
+        SELECT product_id, id FROM stock_ledger WHERE doc_id = ? AND kind = ?
+    """, (doc_id, MOVEMENT_KINDS["XFER-OUT"])).fetchall())
+
+    # IN destino
+    c.executemany("UPDATE product_stock SET qty = qty + ? WHERE product_id=? AND warehouse_id=?",
+                  [(q, pid, dst_warehouse_id) for pid, q in pairs])
+    _insert_movements_c(c, [(pid, dst_warehouse_id, q, "XFER-IN", note or f"XFER de {src_warehouse_id}",
+                             out_ids.get(pid), doc_id) for pid, q in pairs])
+
+    _audit_c(c, user_id, "TRANSFER_STOCK", "movement_docs", doc_id,
+             f"{src_warehouse_id}->{dst_warehouse_id}|lines:{len(pairs)}|qty:{total_qty}|{note}")
+    codes = _codes_for_ids_c(c, qty_by_pid)
+    events.emit(events.stock_changed(src_warehouse_id, codes))
+    events.emit(events.stock_changed(dst_warehouse_id, codes))
+    events.emit(events.DocPosted(doc_id, "XFER", src_warehouse_id, dst_warehouse_id))
+    return doc_id
 
-def transfer_stock(code_or_alias: str, src_warehouse_id: int, dst_warehouse_id: int, qty: int, note: str = ""):
+def transfer_stock(code_or_alias: str, src_warehouse_id: int, dst_warehouse_id: int, qty: int,
+                   note: str = "Transferencia", ref_id: int | None = None, user_id: int | None = None):
+    """Transferencia de un solo producto (orden XFER de una línea). Devuelve el doc_id."""
     if qty <= 0 or src_warehouse_id == dst_warehouse_id:
-        return
+        return None
+    return post_transfer_order(src_warehouse_id, dst_warehouse_id, [(code_or_alias, qty)],
+                               note=note, ref_id=ref_id, user_id=user_id)
+
+def _post_movement_doc_c(c, doc_type: str, warehouse_id: int, lines, counterparty: str = "",
+                         reference: str = "", note: str = "", series: str | None = None,
+                         user_id: int | None = None) -> int | None:
+    """
+    Documento IN/OUT de varias líneas con el cursor de una transacción en curso:
+    encabezado + stock + movimientos; en OUT valida disponibilidad de todas las líneas antes.
+    """
+    doc_type = (doc_type or "").strip().upper()
+    if doc_type not in ("IN", "OUT"):
+        raise ValueError(f"Tipo de documento inválido: '{doc_type}'")
+    items = _normalize_lines(lines)
+    if not items:
+        return None
+    ids = _resolve_codes_c(c, {code for code, _ in items})
+    missing = sorted({code for code, _ in items if code not in ids})
+    if missing:
+        raise ValueError(f"Producto(s) no existen: {', '.join(missing[:10])}" + (" ..." if len(missing) > 10 else ""))
+
+    qty_by_pid: dict[int, int] = {}
+    label: dict[int, str] = {}
+    for code, q in items:
+        qty_by_pid[ids[code]] = qty_by_pid.get(ids[code], 0) + q
+        label.setdefault(ids[code], code)
+    pairs = list(qty_by_pid.items())
+
+    c.executemany("INSERT OR IGNORE INTO product_warehouse(product_id, warehouse_id) VALUES (?, ?)",
+                  [(pid, warehouse_id) for pid, _ in pairs])
+    c.executemany("INSERT OR IGNORE INTO product_stock(product_id, warehouse_id, qty) VALUES (?, ?, 0)",
+                  [(pid, warehouse_id) for pid, _ in pairs])
+    if doc_type == "OUT":
+        avail: dict[int, int] = {}
+        pids = list(qty_by_pid)
+        for i in range(0, len(pids), 500):  # límite de parámetros de SQLite
+            chunk = pids[i:i + 500]
+            avail.update(c.execute(f"""
+                SELECT product_id, qty FROM product_stock
+                WHERE warehouse_id = ? AND product_id IN ({",".join("?" * len(chunk))})
+            """, [warehouse_id, *chunk]).fetchall())
+        short = [(pid, q, int(avail.get(pid, 0))) for pid, q in pairs if q > int(avail.get(pid, 0))]
+        if short:
+            pid, q, a = short[0]
+            raise ValueError(f"Salida supera existencia en {len(short)} línea(s) "
+                             f"(p.ej. '{label[pid]}': req {q} > disp {a})")
+
+    total_qty = sum(q for _, q in pairs)
+    doc_id = _insert_movement_doc_c(c, doc_type, warehouse_id, counterparty=counterparty,
+                                    reference=reference, note=note, total_lines=len(pairs),
+                                    total_qty=total_qty, series=series, created_by=user_id)
+    sign = 1 if doc_type == "IN" else -1
+    c.executemany("UPDATE product_stock SET qty = qty + ? WHERE product_id=? AND warehouse_id=?",
+                  [(sign * q, pid, warehouse_id) for pid, q in pairs])
+    _insert_movements_c(c, [(pid, warehouse_id, q, doc_type, note, None, doc_id) for pid, q in pairs])
+    _audit_c(c, user_id, "CREATE_DOC", "movement_docs", doc_id,
+             f"{doc_type}|WH:{warehouse_id}|lines:{len(pairs)}|qty:{total_qty}")
+    events.emit(events.stock_changed(warehouse_id, _codes_for_ids_c(c, qty_by_pid)))
+    events.emit(events.DocPosted(doc_id, doc_type, warehouse_id))
+    return doc_id
+
+def post_movement_doc(doc_type: str, warehouse_id: int, lines, counterparty: str = "",
+                      reference: str = "", note: str = "", series: str | None = None,
+                      user_id: int | None = None) -> int | None:
+    """Documento IN/OUT completo (encabezado + líneas) en una sola transacción. Devuelve el doc_id."""
+    if not _normalize_lines(lines):
+        return None
+    with _tx() as c:
+        return _post_movement_doc_c(c, doc_type, warehouse_id, lines, counterparty, reference,
+                                    note, series, user_id)
+
+def _import_products_c(c, rows, warehouse_id: int, replace: bool = False) -> dict:
+    """
+    Importación en bloque ({"code","name","description","qty"}): crea los códigos nuevos, los vincula
+    al almacén y suma (IN) o reemplaza (ADJ) existencias. Mismo resultado que la importación de la UI.
+    """
+    items = [(str(r.get("code") or "").strip(), r) for r in rows]
+    items = [(code, r) for code, r in items if code]
+    last_id = c.execute("SELECT IFNULL(MAX(id), 0) FROM products").fetchone()[0]
+    c.executemany("INSERT OR IGNORE INTO products(code, name, description) VALUES (?, ?, ?)",
+                  [(code, str(r.get("name") or ""), str(r.get("description") or "")) for code, r in items])
+    # Creados = ids nuevos (rango de la llave; no cuenta el catálogo completo)
+    created = c.execute("SELECT COUNT(*) FROM products WHERE id > ?", (last_id,)).fetchone()[0]
+    ids = _resolve_codes_c(c, {code for code, _ in items})
+    pids = sorted(set(ids.values()))
+    c.executemany("INSERT OR IGNORE INTO product_warehouse(product_id, warehouse_id) VALUES (?, ?)",
+                  [(pid, warehouse_id) for pid in pids])
+    c.executemany("INSERT OR IGNORE INTO product_stock(product_id, warehouse_id, qty) VALUES (?, ?, 0)",
+                  [(pid, warehouse_id) for pid in pids])
+
+    qty: dict[int, int] = {}
+    for code, r in items:
+        q = int(r.get("qty") or 0)
+        if q > 0:
+            qty[ids[code]] = q if replace else qty.get(ids[code], 0) + q
+    moves = []
+    if replace:
+        curr: dict[int, int] = {}
+        keys = list(qty)
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            curr.update(c.execute(f"""
+                SELECT product_id, qty FROM product_stock
+                WHERE warehouse_id = ? AND product_id IN ({",".join("?" * len(chunk))})
+            """, [warehouse_id, *chunk]).fetchall())
+        changed = [(pid, q) for pid, q in qty.items() if q != int(curr.get(pid, 0))]
+        c.executemany("UPDATE product_stock SET qty = ? WHERE product_id=? AND warehouse_id=?",
+                      [(q, pid, warehouse_id) for pid, q in changed])
+        moves = [(pid, warehouse_id, q - int(curr.get(pid, 0)), "ADJ", "Importación (reemplazo)", None, None)
+                 for pid, q in changed]
+    else:
+        c.executemany("UPDATE product_stock SET qty = qty + ? WHERE product_id=? AND warehouse_id=?",
+                      [(q, pid, warehouse_id) for pid, q in qty.items()])
+        moves = [(pid, warehouse_id, q, "IN", "Importación (suma)", None, None) for pid, q in qty.items()]
+    _insert_movements_c(c, moves)
+
+    if created:
+        events.emit(events.ProductUpserted(items[0][0], warehouse_id))
+    events.emit(events.stock_changed(warehouse_id, _codes_for_ids_c(c, pids)))
+    return {"rows": len(items), "created": created, "linked": len(pids), "moved": len(moves)}
+
+def import_products(rows, warehouse_id: int, replace: bool = False) -> dict:
+    """Importación masiva en una sola transacción. Devuelve {"rows","created","linked","moved"}."""
+    with _tx() as c:
+        if not c.execute("SELECT 1 FROM warehouses WHERE id = ? AND deleting = 0", (warehouse_id,)).fetchone():
+            raise ValueError(f"Almacén {warehouse_id} no existe")
+        return _import_products_c(c, rows, warehouse_id, replace)
+
+def _lookup_stock_c(c, codes, warehouse_id: int | None = None) -> dict:
+    """
+    {code_or_alias: {"code","name","product_id","stock": {warehouse_id: qty}}} para los códigos que existen
+    (stock solo del almacén indicado, o de todos).
+    """
+    ids = _resolve_codes_c(c, codes)
+    if not ids:
+        return {}
+    pids = sorted(set(ids.values()))
+    info: dict[int, dict] = {}
+    for i in range(0, len(pids), 500):
+        chunk = pids[i:i + 500]
+        ph = ",".join("?" * len(chunk))
+        for pid, code, name in c.execute(f"SELECT id, code, name FROM products WHERE id IN ({ph})", chunk):
+            info[pid] = {"product_id": pid, "code": code, "name": name, "stock": {}}
+        flt, params = (("AND warehouse_id = ?", [warehouse_id]) if warehouse_id else
+                       ("AND warehouse_id IN (SELECT id FROM warehouses WHERE deleting = 0)", []))
+        for pid, wid, qty in c.execute(f"""
+            SELECT product_id, warehouse_id, qty FROM product_stock
+            WHERE product_id IN ({ph}) {flt}
+        """, [*chunk, *params]):
+            info[pid]["stock"][wid] = int(qty or 0)
+    return {code: info[pid] for code, pid in ids.items() if pid in info}
+
+def get_stock_for_codes(codes) -> dict:
+    """{code_or_alias: {warehouse_id: qty}} solo para los códigos dados (parches de vistas)."""
+    with _cur() as c:
+        return {k: v["stock"] for k, v in _lookup_stock_c(c, codes).items()}
+
+def get_stock_kpis(today: str) -> dict:
+    """
+    KPIs del dashboard con consultas agregadas: total_stock, per_wh {wid: total},
+    low_total (índice is_low), in_today / out_today (fecha `today`).
+    """
     with _cur() as c:
-        prod = _get_product_by_any_code(code_or_alias)
-        if not prod: raise ValueError(f"Producto '{code_or_alias}' no existe")
-        for wid in (src_warehouse_id, dst_warehouse_id):
-            c.execute("INSERT OR IGNORE INTO product_warehouse(product_id, warehouse_id) VALUES (?, ?)", (prod["id"], wid))
-            c.execute("INSERT OR IGNORE INTO product_stock(product_id, warehouse_id, qty) VALUES (?, ?, 0)", (prod["id"], wid))
-        row = c.execute("SELECT qty FROM product_stock WHERE product_id=? AND warehouse_id=?", (prod["id"], src_warehouse_id)).fetchone()
-        avail = int(row["qty"]) if row else 0
-        if qty > avail:
-            raise ValueError(f"Transferencia supera disponibilidad (req {qty} > disp {avail})")
-        # OUT origen
-        c.execute("UPDATE product_stock SET qty = qty - ? WHERE product_id=? AND warehouse_id=?", (qty, prod["id"], src_warehouse_id))
-        c.execute("""
-            INSERT INTO stock_movements(product_id, warehouse_id, qty, kind, note)
-            VALUES (?, ?, ?, 'XFER-OUT', ?)
-        """, (prod["id"], src_warehouse_id, qty, note or f"XFER a {dst_warehouse_id}"))
-        out_id = c.lastrowid
-        # IN destino
-        c.execute("UPDATE product_stock SET qty = qty + ? WHERE product_id=? AND warehouse_id=?", (qty, prod["id"], dst_warehouse_id))
-        c.execute("""
-            INSERT INTO stock_movements(product_id, warehouse_id, qty, kind, note, ref_id)
-            VALUES (?, ?, ?, 'XFER-IN', ?, ?)
-        """, (prod["id"], dst_warehouse_id, qty, note or f"XFER de {src_warehouse_id}", out_id))
+        per_wh = {int(w): int(q or 0) for w, q in c.execute("""
+            SELECT pw.warehouse_id, SUM(MAX(IFNULL(ps.qty, 0), 0))
+            FROM product_warehouse pw
+            LEFT JOIN product_stock ps ON ps.product_id = pw.product_id AND ps.warehouse_id = pw.warehouse_id
+            WHERE pw.warehouse_id IN (SELECT id FROM warehouses WHERE deleting = 0)
+            GROUP BY pw.warehouse_id""")}
+        low_total = _count_low_c(c, None)
+        in_today, out_today = c.execute(f"""
+            SELECT IFNULL(SUM(CASE WHEN kind IN {_kinds_sql("IN", "ADJ+")} THEN qty END), 0),
+                   IFNULL(SUM(CASE WHEN kind IN {_kinds_sql("OUT", "ADJ-")} THEN qty END), 0)
+            FROM stock_ledger
+            WHERE ts >= CAST(strftime('%s', ?) AS INTEGER)
+              AND ts < CAST(strftime('%s', ?, '+1 day') AS INTEGER)""", (today, today)).fetchone()
+    return {"total_stock": sum(per_wh.values()), "per_wh": per_wh, "low_total": int(low_total),
+            "in_today": int(in_today), "out_today": int(out_today)}
+
+def _set_count_lines_c(c, session_id: int, counted) -> int:
+    """Conteos por código o alias (se resuelven al producto). Devuelve líneas actualizadas."""
+    items = list(counted.items()) if isinstance(counted, dict) else list(counted)
+    ids = _resolve_codes_c(c, {str(code).strip() for code, _ in items})
+    missing = sorted({str(code).strip() for code, _ in items} - set(ids))
+    if missing:
+        raise ValueError(f"Producto(s) no existen: {', '.join(missing[:10])}" + (" ..." if len(missing) > 10 else ""))
+    c.executemany("UPDATE count_lines SET counted_qty=? WHERE session_id=? AND product_id=?",
+                  [(int(q), session_id, ids[str(code).strip()]) for code, q in items])
+    return c.rowcount
 
 # ---------------- Umbrales y reportes ----------------
 def set_threshold(code_or_alias: str, warehouse_id: int, threshold: int):
@@ -595,23 +1629,102 @@ def get_threshold(code_or_alias: str, warehouse_id: int) -> int:
         row = c.execute("SELECT threshold FROM product_threshold WHERE product_id=? AND warehouse_id=?", (pid, warehouse_id)).fetchone()
         return int(row["threshold"]) if row else 0
 
-def list_low_stock(warehouse_id: int, limit: int = 500):
-    with _cur() as c:
-        rows = c.execute("""
-            SELECT p.code, p.name, IFNULL(ps.qty,0) AS qty, IFNULL(pt.threshold,0) AS threshold
+def list_low_stock(warehouse_id: int, limit: int = 500, abc: str | None = None, xyz: str | None = None):
+    """Bajo stock del almacén con su clase ABC/XYZ (None si aún no se clasifica); abc/xyz filtran."""
+    flt, params = "", [warehouse_id]
+    if abc:
+        flt += " AND pc.abc = ?"; params.append(abc.upper())
+    if xyz:
+        flt += " AND pc.xyz = ?"; params.append(xyz.upper())
+    with _cur() as c:
+        rows = c.execute(f"""
+            SELECT p.code, p.name, IFNULL(ps.qty,0) AS qty, IFNULL(pt.threshold,0) AS threshold,
+                   pc.abc, pc.xyz
             FROM product_warehouse pw
             JOIN products p ON p.id = pw.product_id
             LEFT JOIN product_stock ps ON ps.product_id = pw.product_id AND ps.warehouse_id = pw.warehouse_id
             LEFT JOIN product_threshold pt ON pt.product_id = pw.product_id AND pt.warehouse_id = pw.warehouse_id
-            WHERE pw.warehouse_id = ?
-              AND ( (IFNULL(ps.qty,0) <= IFNULL(pt.threshold,0) AND IFNULL(pt.threshold,0) > 0) OR IFNULL(ps.qty,0) = 0 )
+            LEFT JOIN product_class pc ON pc.product_id = pw.product_id AND pc.warehouse_id = pw.warehouse_id
+            WHERE pw.warehouse_id = ? AND pw.is_low = 1{flt}
             ORDER BY (CASE WHEN ps.qty=0 THEN 0 ELSE 1 END), p.code
             LIMIT ?
-        """, (warehouse_id, limit)).fetchall()
+        """, params + [limit]).fetchall()
         return [dict(r) for r in rows]
 
-def list_movements(warehouse_id: int | None = None, code_or_alias: str | None = None,
-                   days: int | None = None, limit: int = 500):
+def count_low_stock(warehouse_id: int | None = None) -> int:
+    """Conteo de bajo stock desde el índice (warehouse_id, is_low); None = todos los almacenes."""
+    with _cur() as c:
+        return _count_low_c(c, warehouse_id)
+
+def _count_low_c(c, warehouse_id: int | None) -> int:
+    if warehouse_id is None:   # almacenes en borrado no cuentan
+        return int(c.execute("""
+            SELECT COUNT(*) FROM product_warehouse
+            WHERE is_low = 1 AND warehouse_id IN (SELECT id FROM warehouses WHERE deleting = 0)""").fetchone()[0])
+    return int(c.execute("SELECT COUNT(*) FROM product_warehouse WHERE warehouse_id = ? AND is_low = 1",
+                         (warehouse_id,)).fetchone()[0])
+
+def _no_movement_where(days: int, warehouse_id: int | None) -> tuple[str, list]:
+    # Rango sobre idx_pw_last_move (NULL = nunca se ha movido)
+    cutoff = f"-{max(0, int(days))} days"
+    if warehouse_id is None:
+        return ("pw.warehouse_id IN (SELECT id FROM warehouses WHERE deleting = 0) "
+                "AND (pw.last_move_ts IS NULL OR pw.last_move_ts < datetime('now', ?))", [cutoff])
+    return ("pw.warehouse_id = ? AND (pw.last_move_ts IS NULL OR pw.last_move_ts < datetime('now', ?))",
+            [warehouse_id, cutoff])
+
+def list_no_movement(days: int = 30, warehouse_id: int | None = None, limit: int = 1000) -> list[dict]:
+    """Pares producto/almacén sin movimientos en `days` días (los más antiguos primero)."""
+    where, params = _no_movement_where(days, warehouse_id)
+    with _cur() as c:
+        rows = c.execute(f"""
+            SELECT p.code, p.name, pw.warehouse_id, IFNULL(ps.qty, 0) AS qty,
+                   pw.last_in_ts, pw.last_out_ts, pw.last_move_ts
+            FROM product_warehouse pw
+            JOIN products p ON p.id = pw.product_id
+            LEFT JOIN product_stock ps ON ps.product_id = pw.product_id AND ps.warehouse_id = pw.warehouse_id
+            WHERE {where}
+            ORDER BY pw.last_move_ts IS NOT NULL, pw.last_move_ts, p.code
+            LIMIT ?
+        """, [*params, limit]).fetchall()
+        return [dict(r) for r in rows]
+
+def count_cold_products(days: int = 30, warehouse_id: int | None = None) -> int:
+    """
+    Productos sin movimiento en `days` días. Sin almacén: productos del catálogo que no se
+    movieron en ninguno (total - activos, leyendo solo el rango reciente del índice).
+    """
+    with _cur() as c:
+        cutoff = f"-{max(0, int(days))} days"
+        if warehouse_id is not None:
+            where, params = _no_movement_where(days, warehouse_id)
+            return int(c.execute(f"SELECT COUNT(*) FROM product_warehouse pw WHERE {where}", params).fetchone()[0])
+        total = c.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+        active = c.execute("""
+            SELECT COUNT(DISTINCT product_id) FROM product_warehouse
+            WHERE warehouse_id IN (SELECT id FROM warehouses WHERE deleting = 0) AND last_move_ts >= datetime('now', ?)
+        """, (cutoff,)).fetchone()[0]
+        return int(total) - int(active)
+
+MOVEMENT_COLUMNS = ("id", "ts", "qty", "kind", "note", "doc_id", "warehouse", "code", "product",
+                    "doc_reference", "doc_counterparty")
+
+_MOVEMENT_SELECT = """
+        SELECT m.id, datetime(m.ts, 'unixepoch') AS ts, m.qty, k.kind, IFNULL(n.note, '') AS note,
+               m.doc_id,
+               w.name AS warehouse, p.code AS code, p.name AS product,
+               d.reference AS doc_reference,
+               d.counterparty AS doc_counterparty
+        FROM stock_ledger m
+        JOIN movement_kinds k ON k.id = m.kind
+        LEFT JOIN ledger_notes n ON n.id = m.note_id
+        JOIN products p  ON p.id  = m.product_id
+        JOIN warehouses w ON w.id = m.warehouse_id
+        LEFT JOIN movement_docs d ON d.id = m.doc_id"""
+
+def fetch_movement_rows(warehouse_id: int | None = None, code_or_alias: str | None = None,
+                        days: int | None = None, limit: int = 500) -> list[tuple]:
+    """Igual que list_movements pero en tuplas planas (MOVEMENT_COLUMNS), sin un dict por fila."""
     params, where = [], []
     if warehouse_id is not None:
         where.append("m.warehouse_id = ?"); params.append(warehouse_id)
@@ -619,26 +1732,107 @@ def list_movements(warehouse_id: int | None = None, code_or_alias: str | None =
         pid = _get_ids_for_code(code_or_alias)
         where.append("m.product_id = ?"); params.append(pid)
     if days is not None and days > 0:
-        where.append("m.ts >= datetime('now', ?)"); params.append(f'-{int(days)} days')
+        where.append("m.ts >= CAST(strftime('%s', 'now', ?) AS INTEGER)"); params.append(f'-{int(days)} days')
     where_sql = ("WHERE " + " AND ".join(where)) if where else ""
     sql = f"""
-        SELECT m.id, m.ts, m.qty, m.kind, m.note,
-               m.doc_id,
-               w.name AS warehouse, p.code AS code, p.name AS product,
-               d.reference AS doc_reference,
-               d.counterparty AS doc_counterparty
-        FROM stock_movements m
-        JOIN products p  ON p.id  = m.product_id
-        JOIN warehouses w ON w.id = m.warehouse_id
-        LEFT JOIN movement_docs d ON d.id = m.doc_id
+        {_MOVEMENT_SELECT}
         {where_sql}
         ORDER BY m.ts DESC, m.id DESC
         LIMIT ?
     """
     params.append(limit)
     with _cur() as c:
-        rows = c.execute(sql, params).fetchall()
-        return [dict(r) for r in rows]
+        c.row_factory = None
+        return c.execute(sql, params).fetchall()
+
+def list_movements(warehouse_id: int | None = None, code_or_alias: str | None = None,
+                   days: int | None = None, limit: int = 500):
+    return [dict(zip(MOVEMENT_COLUMNS, r)) for r in fetch_movement_rows(warehouse_id, code_or_alias, days, limit)]
+
+def get_product_detail(code_or_alias: str, movements: int = 20) -> dict | None:
+    """
+    Ficha de un producto (código o alias) con búsquedas por llave: campos, alias, por almacén
+    (existencia, umbral, bajo stock, ubicación, último movimiento, clase ABC/XYZ) y sus últimos
+    `movements` movimientos. None si no existe.
+    """
+    with _cur() as c:
+        pid = _product_id_c(c, code_or_alias)
+        if pid is None:
+            return None
+        p = c.execute("""
+            SELECT id, code, name, description, category, unit, unit_factor FROM products WHERE id = ?
+        """, (pid,)).fetchone()
+        c.row_factory = None
+        aliases = [r[0] for r in c.execute(
+            "SELECT alt_code FROM product_codes WHERE product_id = ? ORDER BY alt_code", (pid,))]
+        # Pocos almacenes por producto: se ordenan aquí y la consulta no necesita TEMP B-TREE
+        whs = [{"warehouse_id": wid, "warehouse": wname, "qty": qty, "threshold": thr, "is_low": bool(low),
+                "location": loc, "last_move_ts": last, "abc": abc, "xyz": xyz}
+               for wid, wname, qty, thr, low, loc, last, abc, xyz in c.execute("""
+            SELECT pw.warehouse_id, w.name, IFNULL(ps.qty, 0), IFNULL(pt.threshold, 0), pw.is_low,
+                   wl.code, pw.last_move_ts, pc.abc, pc.xyz
+            FROM product_warehouse pw
+            JOIN warehouses w ON w.id = pw.warehouse_id
+            LEFT JOIN product_stock ps ON ps.product_id = pw.product_id AND ps.warehouse_id = pw.warehouse_id
+            LEFT JOIN product_threshold pt ON pt.product_id = pw.product_id AND pt.warehouse_id = pw.warehouse_id
+            LEFT JOIN product_locations pl ON pl.product_id = pw.product_id AND pl.warehouse_id = pw.warehouse_id
+            LEFT JOIN warehouse_locations wl ON wl.id = pl.location_id
+            LEFT JOIN product_class pc ON pc.product_id = pw.product_id AND pc.warehouse_id = pw.warehouse_id
+            WHERE pw.product_id = ? AND w.deleting = 0
+        """, (pid,))]
+        whs.sort(key=lambda w: w["warehouse"])
+        moves = c.execute(f"""
+            {_MOVEMENT_SELECT}
+            WHERE m.product_id = ?
+            ORDER BY m.ts DESC, m.id DESC
+            LIMIT ?
+        """, (pid, int(movements))).fetchall() if movements else []
+    return {**dict(p), "aliases": aliases, "total": sum(w["qty"] for w in whs), "warehouses": whs,
+            "movements": [dict(zip(MOVEMENT_COLUMNS, r)) for r in moves]}
+
+def iter_ledger(since: str | None = None, until: str | None = None, warehouse_id: int | None = None,
+                batch: int = 5000):
+    """
+    Recorre el libro de movimientos en orden (id) sin cargarlo completo: tuplas
+    (id, ts, code, warehouse_id, qty, kind, note, ref_id, doc_id). since/until: fechas 'YYYY-MM-DD[ HH:MM:SS]'.
+    """
+    if _conn is None:
+        init_db()
+    params, where = [], []
+    if since:
+        # Cota de id (por idx_ledger_ts): el recorrido en orden de id empieza ahí y no en el
+        # primer movimiento del libro
+        lo = _conn.execute("SELECT MIN(id) FROM stock_ledger WHERE ts >= CAST(strftime('%s', ?) AS INTEGER)",
+                           (since,)).fetchone()[0]
+        if lo is None:
+            return
+        where.append("m.id >= ?"); params.append(lo)
+        where.append("m.ts >= CAST(strftime('%s', ?) AS INTEGER)"); params.append(since)
+    if until:
+        where.append("m.ts < CAST(strftime('%s', ?) AS INTEGER)"); params.append(until)
+    if warehouse_id is not None:
+        where.append("m.warehouse_id = ?"); params.append(warehouse_id)
+    where_sql = ("WHERE " + " AND ".join(where)) if where else ""
+    c = _conn.cursor()
+    c.row_factory = None
+    try:
+        c.execute(f"""
+            SELECT m.id, datetime(m.ts, 'unixepoch'), p.code, m.warehouse_id, m.qty, k.kind,
+                   IFNULL(n.note, ''), m.ref_id, m.doc_id
+            FROM stock_ledger m
+            JOIN movement_kinds k ON k.id = m.kind
+            LEFT JOIN ledger_notes n ON n.id = m.note_id
+            JOIN products p ON p.id = m.product_id
+            {where_sql}
+            ORDER BY m.id
+        """, params)
+        while True:
+            rows = c.fetchmany(batch)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        c.close()
 
 # ---------------- App state ----------------
 def save_last_warehouse_id(warehouse_id: int | None):
@@ -658,6 +1852,17 @@ def load_last_warehouse_id() -> int | None:
         try: return int(row["value"])
         except: return None
 
+def _get_state(key: str, default: str | None = None) -> str | None:
+    with _cur() as c:
+        row = c.execute("SELECT value FROM app_state WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row and row["value"] is not None else default
+
+def _set_state_c(c, key: str, value: str):
+    c.execute("""
+        INSERT INTO app_state(key, value) VALUES(?, ?)
+        ON CONFLICT(key) DO UPDATE SET value=excluded.value
+    """, (key, str(value)))
+
 # --- Reportes (encabezado + líneas) ---
 def get_movement_doc(doc_id: int) -> dict | None:
     with _cur() as c:
@@ -674,18 +1879,26 @@ def get_movement_doc(doc_id: int) -> dict | None:
         """, (doc_id,)).fetchone()
         return dict(row) if row else None
 
-def list_doc_lines(doc_id: int) -> list[dict]:
+DOC_LINE_COLUMNS = ("id", "ts", "qty", "kind", "note", "code", "name", "warehouse")
+
+def fetch_doc_line_rows(doc_id: int) -> list[tuple]:
+    """Líneas del documento en tuplas planas (DOC_LINE_COLUMNS)."""
     with _cur() as c:
-        rows = c.execute("""
-            SELECT m.id, m.ts, m.qty, m.kind, m.note,
+        c.row_factory = None
+        return c.execute("""
+            SELECT m.id, datetime(m.ts, 'unixepoch') AS ts, m.qty, k.kind, IFNULL(n.note, '') AS note,
                    p.code, p.name, w.name AS warehouse
-            FROM stock_movements m
+            FROM stock_ledger m
+            JOIN movement_kinds k ON k.id = m.kind
+            LEFT JOIN ledger_notes n ON n.id = m.note_id
             JOIN products p  ON p.id = m.product_id
             JOIN warehouses w ON w.id = m.warehouse_id
             WHERE m.doc_id = ?
             ORDER BY m.id
         """, (doc_id,)).fetchall()
-        return [dict(r) for r in rows]
+
+def list_doc_lines(doc_id: int) -> list[dict]:
+    return [dict(zip(DOC_LINE_COLUMNS, r)) for r in fetch_doc_line_rows(doc_id)]
 
 def list_purchase_suggestions(warehouse_id: int, limit: int = 1000) -> list[dict]:
     with _cur() as c:
@@ -709,7 +1922,7 @@ def list_purchase_suggestions(warehouse_id: int, limit: int = 1000) -> list[dict
             LEFT JOIN product_threshold pt
               ON pt.product_id = pw.product_id
              AND pt.warehouse_id = pw.warehouse_id
-            WHERE pw.warehouse_id = ?
+            WHERE pw.warehouse_id = ? AND pw.is_low = 1
               AND IFNULL(pt.threshold,0) > 0
               AND (IFNULL(pt.threshold,0) - IFNULL(ps.qty,0)) > 0
             ORDER BY deficit DESC, p.code
@@ -732,31 +1945,247 @@ def list_categories():
 def set_replenishment_rule(code: str, warehouse_id: int, min_qty: int, max_qty: int,
                            reorder_point: int, multiple: int, lead_time_days: int):
     with _cur() as c:
-        c.execute("""INSERT INTO product_rules(code, warehouse_id, min_qty, max_qty, reorder_point, multiple, lead_time_days)
+        pid, _ = _product_c(c, code)
+        c.execute("""INSERT INTO product_rules(product_id, warehouse_id, min_qty, max_qty, reorder_point, multiple, lead_time_days)
                      VALUES(?,?,?,?,?,?,?)
-                     ON CONFLICT(code,warehouse_id)
+                     ON CONFLICT(product_id,warehouse_id)
                      DO UPDATE SET min_qty=excluded.min_qty, max_qty=excluded.max_qty, 
                          reorder_point=excluded.reorder_point, multiple=excluded.multiple, 
                          lead_time_days=excluded.lead_time_days""",
-                  (code, warehouse_id, min_qty, max_qty, reorder_point, multiple, lead_time_days))
+                  (pid, warehouse_id, min_qty, max_qty, reorder_point, multiple, lead_time_days))
 
 def get_replenishment_rule(code: str, warehouse_id: int):
     with _cur() as c:
         r = c.execute("""SELECT min_qty,max_qty,reorder_point,multiple,lead_time_days
-                         FROM product_rules WHERE code=? AND warehouse_id=?""", (code, warehouse_id)).fetchone()
+                         FROM product_rules WHERE product_id=? AND warehouse_id=?""",
+                      (_product_id_c(c, code), warehouse_id)).fetchone()
         if not r: return None
         return {"min_qty":r[0],"max_qty":r[1],"reorder_point":r[2],"multiple":r[3],"lead_time_days":r[4]}
 
 def list_replenishment_rules(warehouse_id: int, limit: int=1000):
     with _cur() as c:
-        rows = c.execute("""SELECT pr.code, p.name, pr.min_qty, pr.max_qty, pr.reorder_point, pr.multiple, pr.lead_time_days
+        rows = c.execute("""SELECT p.code, p.name, pr.min_qty, pr.max_qty, pr.reorder_point, pr.multiple, pr.lead_time_days
                             FROM product_rules pr
-                            LEFT JOIN products p ON p.code=pr.code
+                            JOIN products p ON p.id=pr.product_id
                             WHERE pr.warehouse_id=?
-                            ORDER BY pr.code LIMIT ?""", (warehouse_id, limit)).fetchall()
+                            ORDER BY p.code LIMIT ?""", (warehouse_id, limit)).fetchall()
         return [{"code":c, "name":n or "", "min_qty":mn, "max_qty":mx, "reorder_point":rp,
                  "multiple":mul, "lead_time_days":lt} for c,n,mn,mx,rp,mul,lt in rows]
 
+# ====== APOYO: lecturas masivas para analítica ======
+REPLENISHMENT_COLUMNS = ("product_id", "warehouse_id", "code", "name", "qty", "threshold",
+                         "min_qty", "max_qty", "reorder_point", "multiple", "lead_time_days")
+
+def fetch_replenishment_inputs(warehouse_id: int | None = None) -> list[tuple]:
+    """
+    Una fila por par producto/almacén con stock, umbral y regla (columnas en REPLENISHMENT_COLUMNS).
+    Sin regla, los campos de regla vienen en NULL.
+    """
+    params, where = [], ""
+    if warehouse_id is not None:
+        where = "WHERE pw.warehouse_id = ?"; params.append(warehouse_id)
+    with _cur() as c:
+        c.row_factory = None  # tuplas planas: sin sqlite3.Row por fila
+        return c.execute(f"""
+            SELECT pw.product_id, pw.warehouse_id, p.code, p.name,
+                   IFNULL(ps.qty, 0), IFNULL(pt.threshold, 0),
+                   pr.min_qty, pr.max_qty, pr.reorder_point, pr.multiple, pr.lead_time_days
+            FROM product_warehouse pw
+            JOIN products p ON p.id = pw.product_id
+            LEFT JOIN product_stock ps
+                   ON ps.product_id = pw.product_id AND ps.warehouse_id = pw.warehouse_id
+            LEFT JOIN product_threshold pt
+                   ON pt.product_id = pw.product_id AND pt.warehouse_id = pw.warehouse_id
+            LEFT JOIN product_rules pr
+                   ON pr.product_id = pw.product_id AND pr.warehouse_id = pw.warehouse_id
+            {where}
+        """, params).fetchall()
+
+def fetch_out_demand(days: int = 30, warehouse_id: int | None = None) -> list[tuple]:
+    """
+    Devuelve [(product_id, warehouse_id, qty_out)] con la suma de salidas (OUT) de los últimos N días.
+    El "+" del GROUP BY evita que el planificador recorra idx_ledger_pw_ts completo por su orden
+    en lugar del rango de idx_ledger_out.
+    """
+    params = [f"-{int(days)} days"]
+    where = ""
+    if warehouse_id is not None:
+        where = "AND warehouse_id = ?"; params.append(warehouse_id)
+    with _cur() as c:
+        c.row_factory = None
+        return c.execute(f"""
+            SELECT product_id, warehouse_id, SUM(qty)
+            FROM stock_ledger
+            WHERE kind = {MOVEMENT_KINDS['OUT']} AND ts >= CAST(strftime('%s', 'now', ?) AS INTEGER) {where}
+            GROUP BY +product_id, +warehouse_id
+        """, params).fetchall()
+
+# ====== Pronóstico de demanda: buckets diarios + caché ======
+def sql_today() -> str:
+    """Fecha actual (YYYY-MM-DD) según SQLite (UTC, como stock_ledger.ts)."""
+    with _cur() as c:
+        return c.execute("SELECT date('now')").fetchone()[0]
+
+def get_demand_sync_state() -> tuple[int, str | None]:
+    """(último id de movimiento procesado, fecha as_of del último cálculo)."""
+    try:
+        last_id = int(_get_state("demand_last_movement_id", "0") or 0)
+    except Exception:
+        last_id = 0
+    return last_id, _get_state("demand_as_of")
+
+def _fetch_out_buckets_c(c, after_id: int, since_day: str) -> tuple[int, list[tuple]]:
+    max_id = c.execute("SELECT IFNULL(MAX(id), 0) FROM stock_ledger").fetchone()[0]
+    rows = c.execute("""
+        SELECT product_id, warehouse_id, date(ts, 'unixepoch') AS day, SUM(qty)
+        FROM stock_ledger
+        WHERE id > ? AND id <= ? AND kind = ? AND ts >= CAST(strftime('%s', ?) AS INTEGER)
+        GROUP BY product_id, warehouse_id, day
+    """, (after_id, max_id, MOVEMENT_KINDS["OUT"], since_day)).fetchall()
+    return int(max_id), rows
+
+def fetch_out_buckets_after(after_id: int, since_day: str) -> tuple[int, list[tuple]]:
+    """
+    Agrupa por día las salidas (OUT) con id > after_id y día >= since_day.
+    Devuelve (max_id visto, [(product_id, warehouse_id, day, qty)]).
+    """
+    with _cur() as c:
+        c.row_factory = None
+        return _fetch_out_buckets_c(c, after_id, since_day)
+
+def integrate_out_buckets(since_day: str) -> list[tuple]:
+    """
+    Suma a demand_daily las salidas posteriores al último id procesado, poda días viejos y
+    avanza el cursor. Lectura del cursor, lectura y suma en una sola transacción de escritura:
+    dos refrescos simultáneos no pueden sumar las mismas salidas. Devuelve los buckets sumados.
+    """
+    with _tx() as c:
+        c.row_factory = None
+        row = c.execute("SELECT value FROM app_state WHERE key = 'demand_last_movement_id'").fetchone()
+        try:
+            last_id = int(row[0] or 0) if row else 0
+        except ValueError:
+            last_id = 0
+        max_id, rows = _fetch_out_buckets_c(c, last_id, since_day)
+        c.executemany("""
+            INSERT INTO demand_daily(product_id, warehouse_id, day, qty)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(product_id, warehouse_id, day)
+            DO UPDATE SET qty = qty + excluded.qty
+        """, rows)
+        c.execute("DELETE FROM demand_daily WHERE day < ?", (since_day,))
+        if max_id != last_id:
+            _set_state_c(c, "demand_last_movement_id", max_id)
+    return rows
+
+def fetch_demand_buckets(since_day: str, pairs: list[tuple] | None = None) -> list[tuple]:
+    """[(product_id, warehouse_id, day, qty)] desde since_day; opcionalmente solo para `pairs`."""
+    with _cur() as c:
+        c.row_factory = None
+        if pairs is None:
+            return c.execute("""
+                SELECT product_id, warehouse_id, day, qty FROM demand_daily WHERE day >= ?
+            """, (since_day,)).fetchall()
+        c.execute("CREATE TEMP TABLE IF NOT EXISTS _tmp_pairs(product_id INTEGER, warehouse_id INTEGER, PRIMARY KEY(product_id, warehouse_id))")
+        c.execute("DELETE FROM _tmp_pairs")
+        c.executemany("INSERT OR IGNORE INTO _tmp_pairs VALUES (?, ?)", pairs)
+        return c.execute("""
+            SELECT d.product_id, d.warehouse_id, d.day, d.qty
+            FROM _tmp_pairs t
+            JOIN demand_daily d ON d.product_id = t.product_id AND d.warehouse_id = t.warehouse_id
+            WHERE d.day >= ?
+        """, (since_day,)).fetchall()
+
+def save_demand_forecast(rows: list[tuple], as_of: str, replace_all: bool = False):
+    """
+    Guarda [(product_id, warehouse_id, ma7, ma30, ewma, rate)] en demand_forecast.
+    Con replace_all se descarta la caché previa (recalculo completo del día).
+    """
+    with _cur() as c:
+        if replace_all:
+            c.execute("DELETE FROM demand_forecast")
+        c.executemany("""
+            INSERT INTO demand_forecast(product_id, warehouse_id, as_of, ma7, ma30, ewma, rate)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(product_id, warehouse_id)
+            DO UPDATE SET as_of=excluded.as_of, ma7=excluded.ma7, ma30=excluded.ma30,
+                          ewma=excluded.ewma, rate=excluded.rate
+        """, [(p, w, as_of, a, b, e, r) for p, w, a, b, e, r in rows])
+        _set_state_c(c, "demand_as_of", as_of)
+
+def list_demand_cover(warehouse_id: int | None = None) -> dict:
+    """
+    Lee la caché: {(code, warehouse_id): {"rate", "qty", "days_of_cover"}}.
+    days_of_cover es None cuando no hay demanda (cobertura indefinida).
+    """
+    params, where = [], ""
+    if warehouse_id is not None:
+        where = "WHERE f.warehouse_id = ?"; params.append(warehouse_id)
+    with _cur() as c:
+        c.row_factory = None
+        rows = c.execute(f"""
+            SELECT p.code, f.warehouse_id, f.rate, IFNULL(ps.qty, 0)
+            FROM demand_forecast f
+            JOIN products p ON p.id = f.product_id
+            LEFT JOIN product_stock ps ON ps.product_id = f.product_id AND ps.warehouse_id = f.warehouse_id
+            {where}
+        """, params).fetchall()
+    return {(code, wid): {"rate": rate, "qty": qty, "days_of_cover": (qty / rate if rate > 0 else None)}
+            for code, wid, rate, qty in rows}
+
+def count_stockout_risk(days: float = 7) -> int:
+    """Pares producto/almacén con demanda cuya cobertura (qty / rate) es menor a `days`."""
+    with _cur() as c:
+        row = c.execute("""
+            SELECT COUNT(*)
+            FROM demand_forecast f
+            LEFT JOIN product_stock ps ON ps.product_id = f.product_id AND ps.warehouse_id = f.warehouse_id
+            WHERE f.rate > 0 AND IFNULL(ps.qty, 0) < f.rate * ?
+        """, (float(days),)).fetchone()
+        return int(row[0] or 0)
+
+# ====== Clasificación ABC/XYZ ======
+def save_product_classes(rows: list[tuple], as_of: str):
+    """
+    Reemplaza la clasificación con [(product_id, warehouse_id, out_qty, cum_share, abc, cv, xyz)]
+    (cv None = sin demanda) en una sola transacción.
+    """
+    with _tx() as c:
+        c.execute("DELETE FROM product_class")
+        c.executemany("""
+            INSERT INTO product_class(product_id, warehouse_id, as_of, out_qty, cum_share, abc, cv, xyz)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, [(p, w, as_of, q, s, a, cv, x) for p, w, q, s, a, cv, x in rows])
+        _set_state_c(c, "class_as_of", as_of)
+
+def get_class_as_of() -> str | None:
+    return _get_state("class_as_of")
+
+def fetch_class_product_ids(abc: str | None = None, xyz: str | None = None,
+                            warehouse_id: int | None = None) -> set[int]:
+    """product_id con esa clase (en el almacén indicado, o en alguno)."""
+    where, params = [], []
+    if warehouse_id is not None:
+        where.append("warehouse_id = ?"); params.append(warehouse_id)
+    if abc:
+        where.append("abc = ?"); params.append(abc.upper())
+    if xyz:
+        where.append("xyz = ?"); params.append(xyz.upper())
+    with _cur() as c:
+        c.row_factory = None
+        return {r[0] for r in c.execute(
+            "SELECT product_id FROM product_class" + (" WHERE " + " AND ".join(where) if where else ""), params)}
+
+def get_class_map(warehouse_id: int) -> dict:
+    """{code: "AX"} del almacén."""
+    with _cur() as c:
+        c.row_factory = None
+        return {code: a + x for code, a, x in c.execute("""
+            SELECT p.code, pc.abc, pc.xyz
+            FROM product_class pc JOIN products p ON p.id = pc.product_id
+            WHERE pc.warehouse_id = ?
+        """, (warehouse_id,))}
+
 # ====== Proveedores / Clientes ======
 def add_supplier(name: str, contact: str|None=None):
     with _cur() as c:
@@ -789,15 +2218,17 @@ def list_locations(warehouse_id: int):
 
 def set_product_location(warehouse_id: int, code: str, location_id: int|None):
     with _cur() as c:
-        c.execute("""INSERT INTO product_locations(warehouse_id, code, location_id)
+        pid, _ = _product_c(c, code)
+        c.execute("""INSERT INTO product_locations(warehouse_id, product_id, location_id)
                      VALUES(?,?,?)
-                     ON CONFLICT(warehouse_id, code)
+                     ON CONFLICT(warehouse_id, product_id)
                      DO UPDATE SET location_id=excluded.location_id""",
-                  (warehouse_id, code, location_id))
+                  (warehouse_id, pid, location_id))
 
 def get_product_location(warehouse_id: int, code: str):
     with _cur() as c:
-        r = c.execute("SELECT location_id FROM product_locations WHERE warehouse_id=? AND code=?", (warehouse_id, code)).fetchone()
+        r = c.execute("SELECT location_id FROM product_locations WHERE warehouse_id=? AND product_id=?",
+                      (warehouse_id, _product_id_c(c, code))).fetchone()
         return r[0] if r else None
 
 # ====== Ajustes ======
@@ -808,26 +2239,69 @@ def create_adjustment(warehouse_id: int, reason: str, note: str|None, doc_id: in
         return c.lastrowid
 
 # ====== Conteos ======
-def create_count_session(warehouse_id: int, note: str|None=None):
-    with _cur() as c:
+def _count_scope_sql(scope) -> tuple[str, list]:
+    """
+    Traduce el alcance del conteo a filtros SQL sobre (pw, p, pl):
+    "all"/"warehouse" = todo el almacén; {"category": "X"}; {"location_id": 5}.
+    """
+    if scope in ("all", "warehouse"):
+        return "", []
+    if isinstance(scope, dict):
+        if scope.get("category") is not None:
+            return "AND p.category = ?", [scope["category"]]
+        if scope.get("location_id") is not None:
+            return "AND pl.location_id = ?", [int(scope["location_id"])]
+    raise ValueError(f"Alcance de conteo inválido: {scope!r}")
+
+def create_count_session(warehouse_id: int, note: str|None=None, *, scope=None):
+    """
+    Crea una sesión de conteo. Con `scope` ("all", {"category": ...} o {"location_id": ...})
+    toma la foto de existencias del sistema en un solo INSERT ... SELECT; sin scope la
+    sesión queda vacía para capturar líneas con add_count_line.
+    """
+    with _tx() as c:
         c.execute("INSERT INTO count_sessions(warehouse_id, created_at, note, status) VALUES(?,?,?,?)",
                   (warehouse_id, _now(), note or None, "OPEN"))
-        return c.lastrowid
+        session_id = c.lastrowid
+        if scope is not None:
+            flt, params = _count_scope_sql(scope)
+            c.execute(f"""
+                INSERT OR IGNORE INTO count_lines(session_id, product_id, sys_qty)
+                SELECT ?, pw.product_id, IFNULL(ps.qty, 0)
+                FROM product_warehouse pw
+                JOIN products p ON p.id = pw.product_id
+                LEFT JOIN product_stock ps
+                       ON ps.product_id = pw.product_id AND ps.warehouse_id = pw.warehouse_id
+                LEFT JOIN product_locations pl
+                       ON pl.warehouse_id = pw.warehouse_id AND pl.product_id = pw.product_id
+                WHERE pw.warehouse_id = ? {flt}
+            """, [session_id, warehouse_id, *params])
+        return session_id
 
 def add_count_line(session_id: int, code: str, sys_qty: int):
     with _cur() as c:
-        c.execute("""INSERT OR IGNORE INTO count_lines(session_id, code, sys_qty) VALUES(?,?,?)""",
-                  (session_id, code, sys_qty))
+        pid, _ = _product_c(c, code)
+        c.execute("""INSERT OR IGNORE INTO count_lines(session_id, product_id, sys_qty) VALUES(?,?,?)""",
+                  (session_id, pid, sys_qty))
 
 def update_count_line(session_id: int, code: str, counted_qty: int):
     with _cur() as c:
-        c.execute("""UPDATE count_lines SET counted_qty=? WHERE session_id=? AND code=?""",
-                  (counted_qty, session_id, code))
+        c.execute("""UPDATE count_lines SET counted_qty=? WHERE session_id=? AND product_id=?""",
+                  (counted_qty, session_id, _product_id_c(c, code)))
+
+def update_count_lines(session_id: int, counted: dict[str, int]) -> int:
+    """Captura masiva de conteos {code: counted_qty} en una sola transacción (como el escritor)."""
+    with _tx() as c:
+        return _set_count_lines_c(c, session_id, counted)
+
+def _list_count_lines_c(c, session_id: int) -> list[tuple]:
+    return c.execute("""SELECT p.code, cl.sys_qty, cl.counted_qty
+                        FROM count_lines cl JOIN products p ON p.id = cl.product_id
+                        WHERE cl.session_id=? ORDER BY p.code""", (session_id,)).fetchall()
 
 def list_count_lines(session_id: int):
     with _cur() as c:
-        rows = c.execute("""SELECT code, sys_qty, counted_qty FROM count_lines WHERE session_id=? ORDER BY code""",
-                         (session_id,)).fetchall()
+        rows = _list_count_lines_c(c, session_id)
         return [{"code":c,"sys_qty":s,"counted_qty":(q if q is not None else None)} for c,s,q in rows]
 
 def close_count_session(session_id: int):
@@ -835,56 +2309,187 @@ def close_count_session(session_id: int):
         c.execute("UPDATE count_sessions SET status='CLOSED' WHERE id=?", (session_id,))
 
 # ====== APOYO: stock por almacén ======
-def get_stock_map(warehouse_id: int) -> dict:
-    """
-    Devuelve {code: qty} para un almacén usando product_stock.
-    """
-    with _cur() as c:
-        rows = c.execute("""
-            SELECT p.code, IFNULL(ps.qty,0) AS qty
+def fetch_stock_columns(warehouse_id: int) -> tuple[list[str], list[int]]:
+    """(codes, qtys) de un almacén en dos listas paralelas, sin objetos por fila."""
+    rows = _stock_rows(warehouse_id)
+    if not rows:
+        return [], []
+    codes, qtys = zip(*rows)
+    return list(codes), list(qtys)
+
+def _stock_rows(warehouse_id: int) -> list[tuple]:
+    with _cur() as c:
+        c.row_factory = None
+        return c.execute("""
+            SELECT p.code, MAX(IFNULL(ps.qty, 0), 0) AS qty
             FROM product_warehouse pw
             JOIN products p ON p.id = pw.product_id
             LEFT JOIN product_stock ps ON ps.product_id = pw.product_id AND ps.warehouse_id = pw.warehouse_id
             WHERE pw.warehouse_id=?
         """, (warehouse_id,)).fetchall()
-        return {r["code"]: int(r["qty"] or 0) for r in rows}
 
-# ====== Reconciliación conteo → ajustes ======
-def reconcile_count_to_adjustments(session_id: int, warehouse_id: int,
-                                   create_movement_doc,  # inyección: tu función existente
-                                   inc_fn, dec_fn):
-    rows = list_count_lines(session_id)
-    diffs = []
-    for r in rows:
-        if r["counted_qty"] is None: continue
-        delta = int(r["counted_qty"]) - int(r["sys_qty"])
-        if delta != 0:
-            diffs.append({"code": r["code"], "delta": delta})
+def get_stock_map(warehouse_id: int) -> dict:
+    """
+    Devuelve {code: qty} para un almacén usando product_stock (negativos como 0).
+    """
+    return dict(_stock_rows(warehouse_id))
 
-    if not diffs:
-        return None
+# ====== Reconciliación conteo → ajustes ======
+def _next_doc_folio_c(c, series: str) -> int:
+    row = c.execute("SELECT MAX(folio) FROM movement_docs WHERE series = ?", (series,)).fetchone()
+    return int(row[0]) + 1 if row and row[0] is not None else 1
+
+def _insert_movement_doc_c(c, doc_type: str, warehouse_id: int, counterparty: str = "", reference: str = "",
+                           note: str = "", total_lines: int = 0, total_qty: int = 0,
+                           series: str | None = None, created_by: int | None = None,
+                           dst_warehouse_id: int | None = None) -> int:
+    """Inserta el encabezado con el cursor de una transacción en curso (folio incluido)."""
+    s = (series or "GEN").strip().upper()
+    c.execute("""
+        INSERT INTO movement_docs(doc_type, warehouse_id, counterparty, reference, note,
+                                  total_lines, total_qty, series, folio, status, created_by,
+                                  dst_warehouse_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 'posted', ?, ?)
+    """, (doc_type, warehouse_id, counterparty or "", reference or "", note or "",
+          int(total_lines or 0), int(total_qty or 0), s, _next_doc_folio_c(c, s), created_by,
+          dst_warehouse_id))
+    return int(c.lastrowid)
+
+def _audit_c(c, user_id: int | None, action: str, entity: str, entity_id: int | None, details: str = ""):
+    c.execute("""
+        INSERT INTO audit_log(user_id, action, entity, entity_id, details)
+        VALUES (?,?,?,?,?)""", (user_id, action, entity, entity_id, details or ""))
+
+def reconcile_count_session(session_id: int, user_id: int | None = None) -> int | None:
+    """
+    Concilia un conteo en una sola transacción: encabezado ADJ, ajuste, actualización de
+    product_stock y movimientos (IN/OUT) de todas las diferencias, y cierre de la sesión.
+    Devuelve el doc_id o None si no hay diferencias.
+    """
+    with _tx() as c:
+        sess = c.execute("SELECT warehouse_id, status FROM count_sessions WHERE id = ?", (session_id,)).fetchone()
+        if not sess:
+            raise ValueError(f"Sesión de conteo {session_id} no existe")
+        if (sess["status"] or "").upper() == "CLOSED":
+            raise ValueError(f"Sesión de conteo {session_id} ya está cerrada")
+        wid = int(sess["warehouse_id"])
+
+        c.execute("DROP TABLE IF EXISTS temp._count_deltas")
+        c.execute("CREATE TEMP TABLE _count_deltas(product_id INTEGER PRIMARY KEY, delta INTEGER NOT NULL)")
+        c.execute("""
+            INSERT INTO _count_deltas(product_id, delta)
+            SELECT cl.product_id, cl.counted_qty - cl.sys_qty
+            FROM count_lines cl
+            WHERE cl.session_id = ? AND cl.counted_qty IS NOT NULL AND cl.counted_qty <> cl.sys_qty
+        """, (session_id,))
+        n, total_qty = c.execute("SELECT COUNT(*), IFNULL(SUM(ABS(delta)), 0) FROM _count_deltas").fetchone()
+        if not n:
+            c.execute("DROP TABLE temp._count_deltas")
+            return None
 
-    total_lines = len(diffs)
-    total_qty = sum(abs(d["delta"]) for d in diffs)
-    doc_id = create_movement_doc(
-        doc_type="ADJ",
-        warehouse_id=warehouse_id,
-        counterparty="Conteo cíclico",
-        reference=f"COUNT {session_id}",
-        note="Ajuste por conciliación de conteo",
-        total_lines=total_lines,
-        total_qty=total_qty,
-    )
-    create_adjustment(warehouse_id, "conteo", "Ajuste por conteo cíclico", doc_id)
+        c.execute("""
+            INSERT OR IGNORE INTO product_warehouse(product_id, warehouse_id)
+            SELECT product_id, ? FROM _count_deltas""", (wid,))
+        c.execute("""
+            INSERT OR IGNORE INTO product_stock(product_id, warehouse_id, qty)
+            SELECT product_id, ?, 0 FROM _count_deltas""", (wid,))
+        short = c.execute("""
+            SELECT COUNT(*) FROM _count_deltas d
+            CROSS JOIN product_stock ps ON ps.product_id = d.product_id AND ps.warehouse_id = ?
+            WHERE ps.qty + d.delta < 0""", (wid,)).fetchone()[0]
+        if short:
+            raise ValueError(f"{short} línea(s) del conteo dejarían existencia negativa en almacén {wid}")
+
+        doc_id = _insert_movement_doc_c(
+            c, "ADJ", wid,
+            counterparty="Conteo cíclico",
+            reference=f"COUNT {session_id}",
+            note="Ajuste por conciliación de conteo",
+            total_lines=n, total_qty=total_qty,
+            created_by=user_id,
+        )
+        c.execute("INSERT INTO adjustments(warehouse_id, created_at, reason, note, doc_id) VALUES(?,?,?,?,?)",
+                  (wid, _now(), "conteo", "Ajuste por conteo cíclico", doc_id))
+        c.execute("""
+            UPDATE product_stock
+               SET qty = qty + (SELECT d.delta FROM _count_deltas d WHERE d.product_id = product_stock.product_id)
+             WHERE warehouse_id = ? AND product_id IN (SELECT product_id FROM _count_deltas)""", (wid,))
+        notes = _note_ids_c(c, ["Ajuste + conteo", "Ajuste - conteo"])
+        c.execute("""
+            INSERT INTO stock_ledger(product_id, warehouse_id, qty, kind, note_id, doc_id)
+            SELECT product_id, ?, ABS(delta),
+                   CASE WHEN delta > 0 THEN ? ELSE ? END,
+                   CASE WHEN delta > 0 THEN ? ELSE ? END,
+                   ?
+            FROM _count_deltas ORDER BY product_id""",
+                  (wid, MOVEMENT_KINDS["IN"], MOVEMENT_KINDS["OUT"],
+                   notes["Ajuste + conteo"], notes["Ajuste - conteo"], doc_id))
+        c.execute("UPDATE count_sessions SET status='CLOSED' WHERE id=?", (session_id,))
+        _audit_c(c, user_id, "RECONCILE_COUNT", "movement_docs", doc_id,
+                 f"COUNT {session_id}|WH:{wid}|lines:{n}|qty:{total_qty}")
+        codes = None
+        if n <= events.MAX_CODES:
+            codes = [r[0] for r in c.execute(
+                "SELECT p.code FROM _count_deltas d CROSS JOIN products p ON p.id = d.product_id")]
+        events.emit(events.stock_changed(wid, codes))
+        events.emit(events.DocPosted(doc_id, "ADJ", wid))
+        c.execute("DROP TABLE temp._count_deltas")
+        return doc_id
 
-    for d in diffs:
-        if d["delta"] > 0:
-            inc_fn(d["code"], warehouse_id, d["delta"], note="Ajuste + conteo", doc_id=doc_id)
-        else:
-            dec_fn(d["code"], warehouse_id, -d["delta"], note="Ajuste - conteo", doc_id=doc_id)
+def verify_stock(fix: bool = False) -> dict:
+    """
+    Revisa la base: quick_check, llaves foráneas, existencias negativas y que product_stock
+    coincida con la suma del libro. fix=True reescribe product_stock desde el libro.
+    """
+    with _cur() as c:
+        c.row_factory = None
+        out = {
+            "quick_check": [r[0] for r in c.execute("PRAGMA quick_check")],
+            "foreign_keys": len(c.execute("PRAGMA foreign_key_check").fetchall()),
+            "negative": c.execute("SELECT COUNT(*) FROM product_stock WHERE qty < 0").fetchone()[0],
+        }
+        c.execute("DROP TABLE IF EXISTS temp._ledger_qty")
+        c.execute(f"""
+            CREATE TEMP TABLE _ledger_qty AS
+            SELECT product_id, warehouse_id,
+                   SUM(CASE WHEN kind IN {_IN_KINDS} THEN qty WHEN kind IN {_OUT_KINDS} THEN -qty ELSE qty END) AS qty
+            FROM stock_ledger GROUP BY product_id, warehouse_id""")
+        diff = """
+            SELECT ps.product_id, ps.warehouse_id, IFNULL(l.qty, 0)
+            FROM product_stock ps
+            LEFT JOIN _ledger_qty l ON l.product_id = ps.product_id AND l.warehouse_id = ps.warehouse_id
+            WHERE ps.qty <> IFNULL(l.qty, 0)
+            UNION ALL
+            SELECT l.product_id, l.warehouse_id, l.qty
+            FROM _ledger_qty l
+            WHERE l.qty <> 0 AND NOT EXISTS (SELECT 1 FROM product_stock ps
+                                             WHERE ps.product_id = l.product_id AND ps.warehouse_id = l.warehouse_id)"""
+        rows = c.execute(diff).fetchall()
+        out["mismatch"] = len(rows)
+        out["fixed"] = 0
+        if fix and rows:
+            c.executemany("INSERT OR IGNORE INTO product_warehouse(product_id, warehouse_id) VALUES (?, ?)",
+                          [(p, w) for p, w, _ in rows])
+            c.executemany("""
+                INSERT INTO product_stock(product_id, warehouse_id, qty) VALUES (?, ?, ?)
+                ON CONFLICT(product_id, warehouse_id) DO UPDATE SET qty = excluded.qty""", rows)
+            out["fixed"] = len(rows)
+            for wid in {w for _, w, _ in rows}:
+                events.emit(events.stock_changed(wid, _codes_for_ids_c(c, [p for p, w, _ in rows if w == wid])))
+        c.execute("DROP TABLE temp._ledger_qty")
+        return out
 
-    close_count_session(session_id)
-    return doc_id
+def reconcile_count_to_adjustments(session_id: int, warehouse_id: int,
+                                   create_movement_doc=None, inc_fn=None, dec_fn=None):
+    """
+    Compatibilidad: delega en reconcile_count_session (conjunto, una transacción).
+    Los parámetros inyectados ya no se usan; warehouse_id debe coincidir con la sesión.
+    """
+    with _cur() as c:
+        row = c.execute("SELECT warehouse_id FROM count_sessions WHERE id = ?", (session_id,)).fetchone()
+    if row and int(row["warehouse_id"]) != int(warehouse_id):
+        raise ValueError(f"La sesión {session_id} pertenece a otro almacén")
+    return reconcile_count_session(session_id)
 
 def link_product_to_warehouse(code: str, warehouse_id: int):
     with _cur() as c:
@@ -945,6 +2550,8 @@ def ensure_security_audit_schema():
             details TEXT,
             FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE SET NULL
         )""")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_audit_entity ON audit_log(entity, entity_id)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_audit_ts ON audit_log(ts)")
 
         # Columnas de usuario en movement_docs
         if not _table_has_column("movement_docs", "created_by"):
@@ -1050,6 +2657,7 @@ try:
             log_audit(created_by, "CREATE_DOC", "movement_docs", doc_id, f"{doc_type}|WH:{warehouse_id}|lines:{total_lines}|qty:{total_qty}")
         except Exception:
             pass
+        events.emit(events.DocPosted(doc_id, doc_type, warehouse_id))
         return doc_id
 except NameError:
     pass
@@ -1090,47 +2698,11 @@ try:
 except NameError:
     pass
 
-try:
-    _orig_transfer_stock = transfer_stock
-    def transfer_stock(
-        code_or_alias: str,
-        src_warehouse_id: int,
-        dst_warehouse_id: int,
-        qty: int,
-        note: str = "Transferencia",
-        ref_id: int | None = None,
-        user_id: int | None = None
-    ):
-        # Ejecutar la función original (no acepta ref_id)
-        res = _orig_transfer_stock(
-            code_or_alias,
-            src_warehouse_id,
-            dst_warehouse_id,
-            qty,
-            note=note
-        )
-
-        # Guardar log de auditoría (puedes aprovechar ref_id aquí si lo necesitas)
-        try:
-            log_audit(
-                user_id,
-                "TRANSFER_STOCK",
-                "stock_movements",
-                ref_id,  # aquí se guarda como referencia de auditoría
-                f"{code_or_alias}|{src_warehouse_id}->{dst_warehouse_id}|{qty}|{note}"
-            )
-        except Exception:
-            pass
-
-        return res
-except NameError:
-    pass
-
 # --- Reencolar init_db para asegurar el esquema de seguridad/auditoría ---
 try:
     _orig_init_db = init_db
-    def init_db(db_path: str | None = None):
-        _orig_init_db(db_path)
+    def init_db(db_path: str | None = None, backend: str | None = None, seed: str | None = None):
+        _orig_init_db(db_path, backend, seed)
         ensure_security_audit_schema()
         ensure_movement_doc_series_status()  # por si llegaste a esta fase sin correr Fase 1
         ensure_default_admin()
@@ -1140,7 +2712,7 @@ except NameError:
 
 # --- Phase 2: security/audit additions (idempotentes) ---
 def ensure_movement_doc_series_status():
-    """Asegura series/folio/status y el índice único (serie, folio)."""
+    """Asegura series/folio/status (y destino de XFER) y el índice único (serie, folio)."""
     with _cur() as c:
         if not _table_has_column("movement_docs", "series"):
             c.execute("ALTER TABLE movement_docs ADD COLUMN series TEXT")
@@ -1148,6 +2720,8 @@ def ensure_movement_doc_series_status():
             c.execute("ALTER TABLE movement_docs ADD COLUMN folio INTEGER")
         if not _table_has_column("movement_docs", "status"):
             c.execute("ALTER TABLE movement_docs ADD COLUMN status TEXT DEFAULT 'posted'")
+        if not _table_has_column("movement_docs", "dst_warehouse_id"):
+            c.execute("ALTER TABLE movement_docs ADD COLUMN dst_warehouse_id INTEGER")  # destino en docs XFER
         c.execute("""
             CREATE UNIQUE INDEX IF NOT EXISTS ux_movement_docs_series_folio
             ON movement_docs(series, folio)
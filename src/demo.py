@@ -0,0 +1,94 @@
+# demo.py
+# Builds de demostración / kiosco: la base de trabajo vive en RAM (backend "memory" de database.py)
+# y se persiste como snapshot. La primera vez se siembra en bloque con 100 productos embebidos.
+#
+#   ALMACEN_DEMO=1 python main.py
+#   python demo.py --build-seed assets/demo_seed.db   # imagen semilla prearmada (arranque sin sembrar)
+
+import argparse
+import os
+import sys
+
+import database as db
+
+DEMO_SNAPSHOT = os.path.join(os.path.dirname(__file__), "almacen_demo.db")
+DEMO_SEED = os.path.join(os.path.dirname(__file__), "assets", "demo_seed.db")
+DEMO_WAREHOUSES = (
+    ("DEMO-ALM-01", "Almacén de demostración 1", "indigo"),
+    ("DEMO-ALM-02", "Almacén de demostración 2", "emerald"),
+)
+
+
+def demo_products() -> list[dict]:
+    """100 productos: códigos '1'..'100', categoría A/B/C/D cíclica y existencias deterministas (1..500)."""
+    cats = ["A", "B", "C", "D"]
+    return [{"code": str(i), "name": f"Producto {i}",
+             "description": f"Descripción del producto {i} (categoría {cats[(i - 1) % 4]})",
+             "qty": (i * 37) % 500 + 1}
+            for i in range(1, 101)]
+
+
+def _seed_c(c) -> str:
+    """
+    Crea los 2 almacenes demo. Sin productos: carga los embebidos repartiendo qty 50/50;
+    con productos ya cargados: solo los vincula a ambos almacenes (stock 0).
+    """
+    wids = []
+    for name, descr, color in DEMO_WAREHOUSES:
+        c.execute("INSERT OR IGNORE INTO warehouses(name, description, color_key) VALUES (?, ?, ?)",
+                  (name, descr, color))
+        wids.append(c.execute("SELECT id FROM warehouses WHERE name = ?", (name,)).fetchone()[0])
+    n = c.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+    if n == 0:
+        prods = demo_products()
+        db._import_products_c(c, [{**p, "qty": p["qty"] - p["qty"] // 2} for p in prods], wids[0], replace=True)
+        db._import_products_c(c, [{**p, "qty": p["qty"] // 2} for p in prods], wids[1], replace=True)
+        return f"EMBEDDED:{len(prods)}"
+    for wid in wids:
+        c.execute("INSERT OR IGNORE INTO product_warehouse(product_id, warehouse_id) SELECT id, ? FROM products", (wid,))
+        c.execute("INSERT OR IGNORE INTO product_stock(product_id, warehouse_id, qty) SELECT id, ?, 0 FROM products",
+                  (wid,))
+    return f"LINK_ONLY:{n}"
+
+
+def ensure_seeded() -> bool:
+    """Siembra una sola vez (app_state.demo_seeded). Devuelve si sembró ahora."""
+    with db._tx() as c:
+        row = c.execute("SELECT value FROM app_state WHERE key = 'demo_seeded'").fetchone()
+        if row and (row[0] or "").strip() == "1":
+            return False
+        src = _seed_c(c)
+        c.execute("INSERT OR REPLACE INTO app_state(key, value) VALUES ('demo_seeded', '1')")
+        c.execute("INSERT OR REPLACE INTO app_state(key, value) VALUES ('demo_seed_log', ?)", (src,))
+    return True
+
+
+def init_demo(snapshot_path: str | None = None, seed: str | None = None):
+    """Base en RAM: snapshot previo, si no la imagen semilla (si existe), si no siembra en bloque."""
+    seed = seed or (DEMO_SEED if os.path.exists(DEMO_SEED) else None)
+    db.init_db(snapshot_path or DEMO_SNAPSHOT, backend="memory", seed=seed)
+    ensure_seeded()
+
+
+def build_seed_image(path: str):
+    """Escribe una imagen semilla ya sembrada (esquema completo + datos demo)."""
+    if os.path.exists(path):
+        os.remove(path)
+    db.init_db(":memory:", backend="memory")
+    ensure_seeded()
+    db.save_snapshot(path, force=True)
+    db.close_db()
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Utilidades del build de demostración")
+    ap.add_argument("--build-seed", metavar="RUTA", help="Genera la imagen semilla en RUTA")
+    args = ap.parse_args(argv)
+    if args.build_seed:
+        build_seed_image(args.build_seed)
+        print(f"Imagen semilla: {args.build_seed}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+# events.py
+# Bus de cambios en proceso: database.py publica eventos tipados después del COMMIT y las vistas
+# (todas las sesiones del proceso) se suscriben para parchar solo lo afectado.
+
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class StockChanged:
+    """Cambió la existencia de `codes` en `warehouse_id` (codes=None: demasiados / desconocidos)."""
+    warehouse_id: int
+    codes: tuple | None = None
+
+
+@dataclass(frozen=True)
+class DocPosted:
+    doc_id: int
+    doc_type: str
+    warehouse_id: int
+    dst_warehouse_id: int | None = None
+
+
+@dataclass(frozen=True)
+class ProductUpserted:
+    code: str
+    warehouse_id: int | None = None
+
+
+MAX_CODES = 500  # por encima, StockChanged viaja con codes=None (refresco completo)
+
+_subs: list = []  # [(callback, tipos)]
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def subscribe(callback, *types):
+    """Registra callback(evento) para los tipos dados (todos si no se indican). Devuelve el desuscriptor."""
+    entry = (callback, tuple(types))
+    with _lock:
+        _subs.append(entry)
+
+    def unsubscribe():
+        with _lock:
+            try:
+                _subs.remove(entry)
+            except ValueError:
+                pass
+    return unsubscribe
+
+
+def publish(event):
+    with _lock:
+        subs = list(_subs)
+    for cb, types in subs:
+        if types and not isinstance(event, types):
+            continue
+        try:
+            cb(event)
+        except Exception:
+            pass  # un suscriptor roto no debe afectar la escritura
+
+
+def publish_all(events):
+    for ev in events:
+        publish(ev)
+
+
+def emit(event):
+    """Publica ya, o lo difiere si hay una transacción en curso en este hilo (ver deferred())."""
+    buf = getattr(_local, "buf", None)
+    if buf is None:
+        publish(event)
+    else:
+        buf.append(event)
+
+
+@contextmanager
+def deferred():
+    """Acumula lo emitido en este hilo; quien abre el bloque publica la lista tras su COMMIT."""
+    prev = getattr(_local, "buf", None)
+    buf = []
+    _local.buf = buf
+    try:
+        yield buf
+    finally:
+        _local.buf = prev
+
+
+def stock_changed(warehouse_id: int, codes=None) -> StockChanged:
+    if codes is not None:
+        codes = tuple(sorted(set(codes)))
+        if len(codes) > MAX_CODES:
+            codes = None
+    return StockChanged(int(warehouse_id), codes)
@@ -0,0 +1,78 @@
+# forecast.py
+# Velocidad de consumo por producto/almacén a partir de salidas (OUT) en buckets diarios.
+# Los resultados se guardan en demand_forecast y se refrescan de forma incremental.
+
+import datetime
+import threading
+
+import numpy as np
+import pandas as pd
+
+import database as db
+
+HORIZON_DAYS = 90   # historia que se conserva en demand_daily
+ALPHA = 0.2         # suavizamiento exponencial (peso del día más reciente)
+
+_lock = threading.Lock()   # un refresco a la vez (UI, importación y classify lo disparan)
+
+
+def compute_rates(buckets: pd.DataFrame, as_of: str, alpha: float = ALPHA) -> pd.DataFrame:
+    """
+    Calcula por par (product_id, warehouse_id) en una pasada vectorizada:
+    ma7 / ma30 (promedio móvil diario), ewma (suavizamiento exponencial con días en cero
+    implícitos) y rate (ewma, o ma30 si el ewma es 0).
+    `buckets` trae columnas product_id, warehouse_id, day, qty.
+    """
+    cols = ["product_id", "warehouse_id", "ma7", "ma30", "ewma", "rate"]
+    if buckets.empty:
+        return pd.DataFrame(columns=cols)
+
+    ref = np.datetime64(as_of, "D")
+    days = pd.to_datetime(buckets["day"]).to_numpy().astype("datetime64[D]")
+    age = (ref - days).astype(np.int64)
+    qty = buckets["qty"].to_numpy(dtype=np.float64)
+
+    # EWMA sobre una serie diaria densa = suma ponderada de los días con demanda
+    frame = pd.DataFrame({
+        "product_id": buckets["product_id"].to_numpy(),
+        "warehouse_id": buckets["warehouse_id"].to_numpy(),
+        "q7": np.where(age < 7, qty, 0.0),
+        "q30": np.where(age < 30, qty, 0.0),
+        "qw": qty * alpha * np.power(1.0 - alpha, np.maximum(age, 0)),
+    })
+    agg = frame.groupby(["product_id", "warehouse_id"], sort=False).sum().reset_index()
+    agg["ma7"] = agg.pop("q7") / 7.0
+    agg["ma30"] = agg.pop("q30") / 30.0
+    agg["ewma"] = agg.pop("qw")
+    agg["rate"] = np.where(agg["ewma"] > 0, agg["ewma"], agg["ma30"])
+    return agg[cols]
+
+
+def refresh(full: bool = False) -> int:
+    """
+    Integra las salidas nuevas (id > último procesado) en demand_daily y recalcula la caché.
+    Si cambió el día (o full=True) se recalculan todos los pares; si no, solo los afectados.
+    Devuelve el número de pares recalculados.
+    """
+    with _lock:
+        today = db.sql_today()
+        since = (datetime.date.fromisoformat(today) - datetime.timedelta(days=HORIZON_DAYS - 1)).isoformat()
+        as_of = db.get_demand_sync_state()[1]
+        new_rows = db.integrate_out_buckets(since)
+        full = full or as_of != today
+        if not new_rows and not full:
+            return 0
+
+        pairs = None if full else list({(p, w) for p, w, _, _ in new_rows})
+        buckets = pd.DataFrame.from_records(
+            db.fetch_demand_buckets(since, pairs),
+            columns=["product_id", "warehouse_id", "day", "qty"],
+        )
+        rates = compute_rates(buckets, today)
+        db.save_demand_forecast(list(rates.itertuples(index=False, name=None)), today, replace_all=full)
+        return len(rates)
+
+
+def days_of_cover(warehouse_id: int | None = None) -> dict:
+    """Atajo de lectura (sin recalcular): {(code, warehouse_id): {...}} desde la caché."""
+    return db.list_demand_cover(warehouse_id)
@@ -51,6 +51,62 @@ def _map_headers(headers: list[str]):
     return i_code, i_name, i_desc, i_qty
 
 
+def _csv_rows(f) -> list[dict]:
+    dr = csv.reader(f)
+    headers = next(dr, None)
+    if not headers:
+        raise ValueError("El CSV no contiene encabezados.")
+    i_code, i_name, i_desc, i_qty = _map_headers(headers)
+    rows = []
+    for r in dr:
+        if not r or len(r) <= max(i_code, i_name):
+            continue
+        code = normalize_string(r[i_code] if i_code >= 0 and i_code < len(r) else "")
+        name = normalize_string(r[i_name] if i_name >= 0 and i_name < len(r) else "")
+        desc = normalize_string(r[i_desc] if i_desc >= 0 and i_desc < len(r) else "")
+        qty = to_int_safe(r[i_qty]) if (i_qty >= 0 and i_qty < len(r)) else 0
+        if not (code and name):
+            continue
+        rows.append({"code": code, "name": name, "description": desc, "qty": qty})
+    return rows
+
+
+def parse_products_from_csv(f) -> list[dict]:
+    """Igual que parse_products_from_file pero desde un flujo CSV ya abierto (p. ej. stdin)."""
+    rows = _csv_rows(f)
+    if not rows:
+        raise ValueError("No se encontraron filas válidas (requiere al menos Código y Nombre).")
+    return rows
+
+
+def parse_aliases_from_csv(f) -> list[tuple[str, str]]:
+    """
+    [(alias, código base)] de un CSV de referencias cruzadas (EAN/UPC de proveedor).
+    Encabezados reconocidos: Alias/EAN/UPC/Código de barras y Código/SKU; sin encabezado: alias,código.
+    """
+    sample = f.read()
+    try:
+        dialect = csv.Sniffer().sniff(sample[:4096], delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    rows = [r for r in csv.reader(sample.splitlines(), dialect) if r]
+    if not rows:
+        raise ValueError("El archivo de alias está vacío.")
+    head = [norm_text(h).strip() for h in rows[0]]
+
+    def find(*names):
+        return next((head.index(n) for n in names if n in head), -1)
+
+    i_alias = find("alias", "ean", "upc", "codigo de barras", "codigo alterno", "alt_code", "barcode")
+    i_code = find("codigo", "code", "sku", "clave", "codigo base")
+    if i_alias >= 0 and i_code >= 0:
+        rows = rows[1:]
+    else:
+        i_alias, i_code = 0, 1
+    n = max(i_alias, i_code)
+    return [(normalize_string(r[i_alias]), normalize_string(r[i_code])) for r in rows if len(r) > n]
+
+
 def parse_products_from_file(file_meta) -> list[dict]:
     """
     Retorna una lista de dicts: {"code","name","description","qty"}
@@ -64,21 +120,7 @@ def parse_products_from_file(file_meta) -> list[dict]:
 
     if ext == ".csv":
         with open(path, "r", encoding="utf-8-sig", newline="") as f:
-            dr = csv.reader(f)
-            headers = next(dr, None)
-            if not headers:
-                raise ValueError("El CSV no contiene encabezados.")
-            i_code, i_name, i_desc, i_qty = _map_headers(headers)
-            for r in dr:
-                if not r or len(r) <= max(i_code, i_name):
-                    continue
-                code = normalize_string(r[i_code] if i_code >= 0 and i_code < len(r) else "")
-                name = normalize_string(r[i_name] if i_name >= 0 and i_name < len(r) else "")
-                desc = normalize_string(r[i_desc] if i_desc >= 0 and i_desc < len(r) else "")
-                qty = to_int_safe(r[i_qty]) if (i_qty >= 0 and i_qty < len(r)) else 0
-                if not (code and name):
-                    continue
-                rows.append({"code": code, "name": name, "description": desc, "qty": qty})
+            rows = _csv_rows(f)
 
     elif ext in (".xlsx", ".xls"):
         try:
@@ -165,24 +207,21 @@ def build_stock_indexes(db):
         for w in db.list_warehouses():
             wid = int(w["id"])
             wh_names[wid] = w["name"]
-            cmap: dict[str, int] = {}
-            for p in db.list_products_by_warehouse(wid):
-                code = str(p["code"])
-                try:
-                    q = int(p.get("qty") or 0)
-                except Exception:
-                    q = 0
-                if q < 0:
-                    q = 0
-                cmap[code] = q
+            codes, qtys = db.fetch_stock_columns(wid)   # columnas planas, sin dict por fila
+            per_wh[wid] = dict(zip(codes, qtys))
+            for code, q in zip(codes, qtys):
                 totals[code] = totals.get(code, 0) + q
-            per_wh[wid] = cmap
     except Exception:
         pass
     return totals, per_wh, wh_names
 
 
 def get_stock_map(db, warehouse_id: int) -> dict:
+    if hasattr(db, "get_stock_map"):
+        try:
+            return db.get_stock_map(warehouse_id)   # ya viene {code: qty >= 0} desde SQL
+        except Exception:
+            return {}
     mp = {}
     try:
         for p in db.list_products_by_warehouse(warehouse_id):
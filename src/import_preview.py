@@ -0,0 +1,125 @@
+# import_preview.py
+# Vista previa (dry run) de una importación de productos: cruza en pandas las filas ya leídas del
+# archivo con el catálogo (códigos y alias) y las existencias del almacén, y resume qué cambiaría
+# con las mismas reglas que database.import_products, sin escribir nada.
+
+import numpy as np
+import pandas as pd
+
+import database as db
+
+SAMPLE = 20   # ejemplos por categoría en el resumen
+
+
+def diff_frames(rows: pd.DataFrame, products: pd.DataFrame, aliases: pd.DataFrame,
+                replace: bool = False, sample: int = SAMPLE) -> dict:
+    """
+    rows: code, name, qty (una fila por renglón del archivo).
+    products: id, code, name, linked, qty (catálogo con existencias en el almacén destino).
+    aliases: alt_code (solo para reportar los códigos del archivo que son alias).
+    Todo en una pasada: un map código -> producto y agregados por producto.
+    """
+    f = rows[["code", "name", "qty"]].copy()
+    f["code"] = f["code"].astype(str).str.strip()
+    skipped = int((f["code"] == "").sum())
+    f = f[f["code"] != ""].reset_index(drop=True)
+    f["qty"] = pd.to_numeric(f["qty"], errors="coerce").fillna(0).astype(np.int64)
+
+    # Código -> producto. La importación inserta por código principal: un alias en el archivo
+    # crea un producto nuevo con ese código (se reporta aparte para revisarlo antes)
+    pid = f["code"].map(pd.Series(products["id"].to_numpy(), index=products["code"].astype(str)))
+    is_new = pid.isna().to_numpy()
+    is_alias = is_new & f["code"].isin(aliases["alt_code"].astype(str)).to_numpy()
+    # Los códigos nuevos reciben ids negativos para agruparlos igual que los existentes
+    new_ids, new_codes = pd.factorize(f.loc[is_new, "code"])
+    pid = pid.to_numpy(dtype=np.float64, copy=True)
+    pid[is_new] = -(new_ids + 1)
+    f["pid"] = pid.astype(np.int64)
+
+    info = products.set_index("id")[["code", "name", "linked", "qty"]]
+    f = f.join(info, on="pid", rsuffix="_db")
+    f["qty_db"] = f["qty_db"].fillna(0).astype(np.int64)
+    f["linked"] = f["linked"].fillna(False).astype(bool)
+
+    g = f.groupby("pid", sort=False)
+    per = pd.DataFrame({
+        "code": g["code"].first(),
+        "rows": g.size(),
+        "names": g["name"].nunique(),
+        "qtys": g["qty"].nunique(),
+        "current": g["qty_db"].first(),
+        "linked": g["linked"].first(),
+    })
+    moving = f[f["qty"] > 0]
+    if replace:
+        target = moving.groupby("pid", sort=False)["qty"].last()      # el último renglón gana
+        per["delta"] = (target - per["current"].reindex(target.index)).reindex(per.index).fillna(0)
+    else:
+        per["delta"] = moving.groupby("pid", sort=False)["qty"].sum().reindex(per.index).fillna(0)
+    per["delta"] = per["delta"].astype(np.int64)
+    per["after"] = per["current"] + per["delta"]
+
+    existing = f[f["pid"] > 0]
+    renamed = existing[(existing["name"] != "") & (existing["name"] != existing["name_db"])] \
+        .drop_duplicates("pid")
+    dups = per[per["rows"] > 1]
+    conflicts = dups[(dups["names"] > 1) | (dups["qtys"] > 1)]
+    up, down = per[per["delta"] > 0], per[per["delta"] < 0]
+    old = per.index > 0
+
+    def _sample(df, cols):
+        return df[cols].head(sample).to_numpy().tolist()
+
+    return {
+        "rows": int(len(f)), "skipped": skipped, "replace": bool(replace),
+        "products": int(len(per)),
+        "new": int(len(new_codes)),
+        "alias_codes": int(f.loc[is_alias, "code"].nunique()),
+        "link": int((old & ~per["linked"].to_numpy()).sum()),
+        "renamed": int(len(renamed)),
+        "duplicated": int(len(dups)),
+        "conflicts": int(len(conflicts)),
+        "increase": int(len(up)), "increase_qty": int(up["delta"].sum()),
+        "decrease": int(len(down)), "decrease_qty": int(-down["delta"].sum()),
+        "unchanged": int(((per["delta"] == 0) & old).sum()),
+        "samples": {
+            "new": [str(c) for c in new_codes[:sample]],
+            "alias_codes": f.loc[is_alias, "code"].drop_duplicates().head(sample).tolist(),
+            "renamed": _sample(renamed, ["code_db", "name_db", "name"]),
+            "conflicts": _sample(conflicts, ["code", "rows"]),
+            "decrease": _sample(down, ["code", "current", "after"]),
+        },
+    }
+
+
+def preview(rows: list[dict], warehouse_id: int, replace: bool = False, sample: int = SAMPLE) -> dict:
+    """Dry run de db.import_products(rows, warehouse_id, replace): solo lee."""
+    products, aliases = db.fetch_import_index(warehouse_id)
+    return diff_frames(
+        pd.DataFrame.from_records(rows, columns=["code", "name", "description", "qty"]),
+        pd.DataFrame.from_records(products, columns=["id", "code", "name", "linked", "qty"]),
+        pd.DataFrame.from_records(aliases, columns=["alt_code", "product_id"]),
+        replace, sample)
+
+
+def summary_lines(res: dict) -> list[str]:
+    """Resumen legible (UI y cli.py import --dry-run)."""
+    mode = "reemplazo" if res["replace"] else "suma"
+    out = [
+        f"{res['rows']} renglones, {res['products']} productos (modo {mode})",
+        f"Nuevos en catálogo: {res['new']}",
+        f"Se vinculan al almacén: {res['link']}",
+        f"Suben existencias: {res['increase']} (+{res['increase_qty']})",
+    ]
+    if res["replace"]:
+        out.append(f"Bajan existencias: {res['decrease']} (-{res['decrease_qty']})")
+    out.append(f"Sin cambio de existencias: {res['unchanged']}")
+    if res["alias_codes"]:
+        out.append(f"Códigos que son alias de otro producto (se crearían como nuevos): {res['alias_codes']}")
+    if res["renamed"]:
+        out.append(f"Nombre distinto al del catálogo (no se sobrescribe): {res['renamed']}")
+    if res["duplicated"]:
+        out.append(f"Códigos repetidos: {res['duplicated']}, con datos en conflicto: {res['conflicts']}")
+    if res["skipped"]:
+        out.append(f"Renglones sin código (se omiten): {res['skipped']}")
+    return out
@@ -1,20 +1,47 @@
 # main.py
+import time
+_T_START = time.perf_counter()
 import flet as ft
 import database as db
+import events
+import writer
 import threading
-import os, csv
+import os, csv, sys
 import helpers as hp
+import catalog
 import components as cmp 
 import datetime
 
+# ALMACEN_PROFILE_STARTUP=1 (o --profile-startup): imprime cuánto tarda cada fase del arranque
+PROFILE_STARTUP = os.environ.get("ALMACEN_PROFILE_STARTUP") == "1"
+# ALMACEN_DEMO=1: build de demostración/kiosco (base en RAM con snapshot, ver demo.py)
+DEMO_BUILD = os.environ.get("ALMACEN_DEMO") == "1"
+# ALMACEN_BACKUP_MIN=N: respaldo en línea comprimido cada N minutos (ver backup.py)
+BACKUP_MIN = os.environ.get("ALMACEN_BACKUP_MIN", "")
+_T_IMPORTS = time.perf_counter()
+
+def _profile(label: str, t0: float, t1: float | None = None):
+    if PROFILE_STARTUP:
+        print(f"[arranque] {label}: {((t1 or time.perf_counter()) - t0) * 1000:.1f} ms", flush=True)
+
 
 def main(page: ft.Page):
     # =========================
     #   INIT / PROPIEDADES
     # =========================
-    db.init_db()
+    _profile("imports", _T_START, _T_IMPORTS)
+    t_main = time.perf_counter()
+    if DEMO_BUILD:
+        import demo
+        demo.init_demo()
+    else:
+        db.init_db()
     db.ensure_color_column()
-    db.ensure_products_table()
+    if BACKUP_MIN.isdigit() and int(BACKUP_MIN) > 0:
+        import backup
+        backup.BackupService(int(BACKUP_MIN) * 60).start()
+    _profile("init_db", t_main)
+    t_ui = time.perf_counter()
 
     page.title = "CA Software"
     page.padding = 0
@@ -180,7 +207,6 @@ def main(page: ft.Page):
     # =========================
     #   ESTADO GLOBAL
     # =========================
-    last_import_rows: list[dict] = []
     appbar_text_ref = ft.Ref[ft.Text]()
     content_column = ft.Column(expand=True, scroll=None, horizontal_alignment=ft.CrossAxisAlignment.STRETCH)
 
@@ -197,7 +223,8 @@ def main(page: ft.Page):
     entry_state = {"warehouse_id": None, "lines": {}}
     exit_state = {"warehouse_id": None, "lines": {}}
     exit_over_state = {"warehouse_id": None, "items": []}
-    pagination_state = {"page": 0, "per_page": 100, "items": []}
+    pagination_state = {"page": 0, "per_page": 100, "items": [], "warehouse_id": None, "render": None}
+    dashboard_refs = {"kpi": {}, "bars": {}}  # Text/ProgressBar vivos del dashboard (para parchar)
     search_state = {
         "query": "",
         "warehouse_id": None,
@@ -205,6 +232,7 @@ def main(page: ft.Page):
         "include_descr": False,
         "low_stock_only": False,
         "low_stock_threshold": 5,
+        "abc": None,
         "results": [],
     }
 
@@ -219,6 +247,119 @@ def main(page: ft.Page):
 
     current_dialog = {"dlg": None}
 
+    forecast_job = {"running": False, "again": False}
+    forecast_lock = threading.Lock()
+
+    def refresh_forecast_bg():
+        """Integra movimientos nuevos en la caché de demanda sin bloquear la UI (un hilo a la vez)."""
+        with forecast_lock:
+            if forecast_job["running"]:
+                forecast_job["again"] = True  # el hilo en curso repite al terminar
+                return
+            forecast_job["running"] = True
+
+        def _run():
+            while True:
+                try:
+                    import forecast as fc
+                    fc.refresh()
+                    import classify
+                    classify.refresh_if_stale()  # ABC/XYZ: una vez al día
+                except Exception as ex:
+                    print(f"[pronóstico] no se pudo refrescar: {ex!r}", file=sys.stderr, flush=True)
+                with forecast_lock:
+                    if not forecast_job["again"]:
+                        forecast_job["running"] = False
+                        return
+                    forecast_job["again"] = False
+        threading.Thread(target=_run, daemon=True).start()
+
+    def fmt_cover(days) -> str:
+        return "—" if days is None else f"{days:.0f} días"
+
+    # --- Cambios publicados por database.py (events.py): se agrupan y se parcha lo visible ---
+    change_state = {"codes": {}, "full": set(), "kpi": False, "timer": None}
+    change_lock = threading.Lock()
+
+    def on_db_event(ev):
+        with change_lock:
+            if isinstance(ev, events.StockChanged):
+                if ev.codes is None:
+                    change_state["full"].add(ev.warehouse_id)
+                else:
+                    change_state["codes"].setdefault(ev.warehouse_id, set()).update(ev.codes)
+            elif isinstance(ev, events.ProductUpserted):
+                change_state["full"].add(ev.warehouse_id)
+            change_state["kpi"] = True
+            if change_state["timer"] is None:
+                t = threading.Timer(0.3, flush_db_events)  # ráfagas (importación, escáner) -> un solo parche
+                t.daemon = True
+                change_state["timer"] = t
+                t.start()
+
+    def flush_db_events():
+        with change_lock:
+            codes_by_wh, full, kpi = change_state["codes"], change_state["full"], change_state["kpi"]
+            change_state.update(codes={}, full=set(), kpi=False, timer=None)
+        try:
+            view = ui_state.get("current_view")
+            if view == "products":
+                patch_products_view(codes_by_wh, full)
+            elif view == "dashboard" and kpi:
+                patch_dashboard_kpis()
+        except Exception:
+            pass
+
+    def patch_products_view(codes_by_wh: dict, full: set):
+        wid = pagination_state.get("warehouse_id")
+        if (wid is None and full) or (wid is not None and wid in full):
+            render_products_list(wid)
+            return
+        touched = set()
+        for w, codes in codes_by_wh.items():
+            if wid is None or w == wid:
+                touched |= codes
+        items = pagination_state["items"]
+        catalog.get_catalog()  # aplica las existencias tocadas sobre el catálogo compartido
+        start = pagination_state["page"] * pagination_state["per_page"]
+        if touched.isdisjoint(items.codes(start, start + pagination_state["per_page"])):
+            return
+        if pagination_state.get("render"):
+            pagination_state["render"]()
+
+    def patch_dashboard_kpis():
+        k = db.get_stock_kpis(datetime.datetime.now().strftime("%Y-%m-%d"))
+        k["stockout_risk"] = db.count_stockout_risk(7)
+        k["cold"] = db.count_cold_products(30)
+        refs = dashboard_refs["kpi"]
+        for key in ("total_stock", "low_total", "in_today", "out_today", "stockout_risk", "cold"):
+            if key in refs:
+                refs[key].value = str(k[key])
+        if not set(k["per_wh"]) <= set(dashboard_refs["bars"]):
+            render_dashboard_page()  # apareció un almacén nuevo
+            return
+        total = sum(k["per_wh"].values()) or 1
+        for w, (lbl, bar) in dashboard_refs["bars"].items():
+            val = k["per_wh"].get(w, 0)
+            lbl.value = str(val)
+            bar.value = max(0.0, min(1.0, val / total))
+        page.update()
+
+    _unsubscribe_events = events.subscribe(on_db_event)
+    page.on_close = lambda e: _unsubscribe_events()
+
+    # --- Diálogos perezosos: cada fábrica construye sus controles al primer uso y queda en caché ---
+    lazy_factories: dict = {}
+    lazy_built: dict = {}
+
+    def lazy(name: str):
+        """Diálogo registrado bajo `name` (lo construye la primera vez)."""
+        if name not in lazy_built:
+            t0 = time.perf_counter()
+            lazy_built[name] = lazy_factories[name]()
+            _profile(f"diálogo {name} (primer uso)", t0)
+        return lazy_built[name]
+
     def open_dialog(dlg: ft.AlertDialog):
         if current_dialog["dlg"] is not None and getattr(current_dialog["dlg"], "open", False):
             current_dialog["dlg"].open = False
@@ -236,30 +377,32 @@ def main(page: ft.Page):
     #   PRODUCT DETAIL DIALOG
     # =========================
     def open_product_detail(code: str, name: str):
-        descr = ""
         try:
-            for p in (db.list_products() or []):
-                if str(p.get("code")) == code:
-                    descr = str(p.get("description") or p.get("descripcion") or "")
-                    break
+            det = db.get_product_detail(code, movements=10) or {}
         except Exception:
-            descr = ""
-
-        totals, per_wh, wh_names = hp.build_stock_indexes(db)
-        total = int(totals.get(code, 0))
+            det = {}
+        descr = det.get("description") or ""
+        total = int(det.get("total") or 0)
         rows = []
-        for wid, cmap in per_wh.items():
-            qty = int(cmap.get(code, 0))
-            if qty > 0:
-                rows.append(
-                    ft.Row(
-                        alignment=ft.MainAxisAlignment.SPACE_BETWEEN,
-                        controls=[ft.Text(wh_names.get(wid, "Almacén"), size=12),
-                                  ft.Text(str(qty), size=12, weight=ft.FontWeight.W_600)]
-                    )
+        for w in det.get("warehouses", []):
+            extra = " • ".join(x for x in (
+                f"Umbral {w['threshold']}" if w["threshold"] else "",
+                f"Ubicación {w['location']}" if w["location"] else "",
+                f"Clase {w['abc']}{w['xyz'] or ''}" if w["abc"] else "",
+            ) if x)
+            rows.append(
+                ft.Row(
+                    alignment=ft.MainAxisAlignment.SPACE_BETWEEN,
+                    controls=[ft.Text(w["warehouse"] + (f"  ({extra})" if extra else ""), size=12),
+                              ft.Text(str(w["qty"]), size=12, weight=ft.FontWeight.W_600,
+                                      color=ft.Colors.RED_600 if w["is_low"] else None)]
                 )
+            )
         if not rows:
             rows = [ft.Text("No se encuentra en ningún almacén.", size=12, italic=True, color=ft.Colors.GREY_700)]
+        moves = [ft.Text(f'{m["ts"]}  {m["kind"]}  {m["qty"]}  {m["warehouse"]}' + (f'  {m["note"]}' if m["note"] else ""),
+                         size=11, color=ft.Colors.GREY_700)
+                 for m in det.get("movements", [])] or [ft.Text("Sin movimientos.", size=11, italic=True, color=ft.Colors.GREY_700)]
 
         dlg = ft.AlertDialog(
             modal=True,
@@ -270,11 +413,15 @@ def main(page: ft.Page):
                 controls=[
                     ft.Text(f"Nombre: {name}", size=12),
                     ft.Text(f"Descripción: {descr or '—'}", size=12),
+                    ft.Text(f"Alias: {', '.join(det.get('aliases') or []) or '—'}", size=12),
                     ft.Divider(),
                     ft.Text(f"Total existencias: {total}", size=12, weight=ft.FontWeight.W_600,
                             color=ft.Colors.RED_600 if total == 0 else None),
                     ft.Text("Almacenes:", size=12, color=ft.Colors.GREY_700),
                     ft.Column(rows, spacing=6),
+                    ft.Divider(),
+                    ft.Text("Últimos movimientos:", size=12, color=ft.Colors.GREY_700),
+                    ft.Column(moves, spacing=2),
                 ],
             ),
             actions=[ft.TextButton("Cerrar", on_click=lambda e: (setattr(dlg, "open", False), page.update(), close_dialog()))],
@@ -344,37 +491,9 @@ def main(page: ft.Page):
 
     def render_products_list(warehouse_id: int | None = None):
         ui_state["current_view"] = "products"
-        totals, per_wh, _ = hp.build_stock_indexes(db)
-
-        items, warn = hp.fetch_products_for_warehouse(db, warehouse_id)
-        if not items and last_import_rows:
-            items = last_import_rows
-
-        norm_items = []
-        for it in items:
-            code = str(it.get("code") or it.get("codigo") or it.get("Código") or "")
-            name = str(it.get("name") or it.get("nombre") or it.get("Nombre") or "")
-            total_q = int(totals.get(code, 0))
-            wh_q = None
-            if warehouse_id is not None:
-                wh_q = int(per_wh.get(int(warehouse_id), {}).get(code, 0))
-            norm_items.append({"code": code, "name": name, "total": total_q, "wh_qty": wh_q})
-
-        if warehouse_id is None:
-            for c, t in totals.items():
-                if not any(x["code"] == c for x in norm_items):
-                    pname = c
-                    try:
-                        for p in (db.list_products() or []):
-                            if str(p.get("code")) == c:
-                                pname = str(p.get("name") or p.get("nombre") or c)
-                                break
-                    except Exception:
-                        pass
-                    norm_items.append({"code": c, "name": pname, "total": int(t or 0), "wh_qty": None})
-
-        norm_items.sort(key=lambda x: x["code"])
-        pagination_state["items"] = norm_items
+        pagination_state["warehouse_id"] = warehouse_id
+        # Vista sobre el catálogo compartido: los dicts se arman solo para la página visible
+        pagination_state["items"] = catalog.get_catalog().view(warehouse_id)
         pagination_state["page"] = 0
 
         wh_title = ""
@@ -475,18 +594,15 @@ def main(page: ft.Page):
 
             header_row = cmp.header_row(header_text, top_actions)  # <<--- usar componente
 
-            extra = []
-            if warn:
-                extra.append(ft.Text(warn, size=11, color=ft.Colors.ORANGE_700))
-
             content_column.controls[:] = [
-                ft.Container(padding=ft.padding.only(8, 0, 8, 8), content=ft.Column(controls=[header_row] + extra, spacing=6)),
+                ft.Container(padding=ft.padding.only(8, 0, 8, 8), content=header_row),
                 ft.Container(padding=ft.padding.only(8, 0, 8, 4), content=page_label),
                 ft.Container(expand=True, padding=ft.padding.all(8), content=ft.ListView(expand=True, controls=[table])),
                 ft.Container(padding=ft.padding.all(8), content=pager),
             ]
             page.update()
 
+        pagination_state["render"] = render_controls
         render_controls()
 
     def _ensure_reports_dir() -> str:
@@ -666,6 +782,9 @@ def main(page: ft.Page):
     #   VISTA: BUSCAR
     # =========================
     search_tf_ref = ft.Ref[ft.TextField]()
+    SEARCH_DEBOUNCE_S = 0.25
+    search_engine = catalog.IncrementalSearch()
+    search_job = {"seq": 0, "timer": None}  # seq: última consulta pedida (las anteriores se descartan)
     search_results_col = ft.Column(spacing=2, tight=True, height=420, scroll=ft.ScrollMode.AUTO)
     search_recent_row = ft.Row(spacing=6, wrap=True)
 
@@ -702,18 +821,52 @@ def main(page: ft.Page):
         search_refresh_results()
         page.update()
 
-    def search_refresh_results():
-        catalog = hp.search_collect_catalog(db, search_state["warehouse_id"])
-        filtered = hp.search_filter_and_score(
-            catalog,
-            query=search_state["query"],
+    def search_run():
+        ids = None
+        if search_state["abc"]:
+            ids = db.fetch_class_product_ids(search_state["abc"], None, search_state["warehouse_id"])
+        return search_engine.run(
+            search_state["query"],
             include_descr=search_state["include_descr"],
             in_stock_only=search_state["in_stock_only"],
             low_only=search_state["low_stock_only"],
             threshold=search_state["low_stock_threshold"],
             warehouse_id=search_state["warehouse_id"],
+            limit=200,
+            product_ids=ids,
         )
-        search_state["results"] = filtered[:200]
+
+    def search_schedule(delay: float = SEARCH_DEBOUNCE_S):
+        """Debounce del teclado: busca fuera del hilo de UI cuando se deja de escribir."""
+        if search_job["timer"] is not None:
+            search_job["timer"].cancel()
+        search_job["seq"] += 1
+        seq = search_job["seq"]
+
+        def work():
+            if seq != search_job["seq"]:
+                return
+            try:
+                results = search_run()
+            except Exception:
+                return
+            if seq != search_job["seq"] or ui_state.get("current_view") != "search":
+                return  # llegó otra consulta mientras buscábamos
+            search_show_results(results)
+
+        t = threading.Timer(delay, work)
+        t.daemon = True
+        search_job["timer"] = t
+        t.start()
+
+    def search_refresh_results():
+        if search_job["timer"] is not None:
+            search_job["timer"].cancel()
+        search_job["seq"] += 1  # invalida búsquedas en vuelo
+        search_show_results(search_run())
+
+    def search_show_results(results):
+        search_state["results"] = results
 
         rows = []
         wid = search_state["warehouse_id"]
@@ -764,56 +917,59 @@ def main(page: ft.Page):
         # ---- Datos para KPIs ----
         today = datetime.datetime.now().strftime("%Y-%m-%d")
         try:
-            totals, per_wh, wh_names = hp.build_stock_indexes(db)
+            cat = catalog.get_catalog()
+            wh_stock = cat.total_by_warehouse()
+            n_products = len(cat)
         except Exception:
-            totals, per_wh, wh_names = ({}, {}, {})
+            wh_stock, n_products = {}, 0
         try:
             warehouses = db.list_warehouses() or []
         except Exception:
             warehouses = []
-        try:
-            products = db.list_products() or []
-        except Exception:
-            products = []
+        wh_names = {int(w["id"]): w["name"] for w in warehouses}
 
-        total_stock = 0
-        try:
-            total_stock = sum(int(v or 0) for v in (totals or {}).values())
-        except Exception:
-            total_stock = 0
+        total_stock = sum(wh_stock.values())
 
         # Movimientos de hoy
         in_qty = out_qty = 0
         try:
-            rows = db.list_movements(warehouse_id=None, code_or_alias=None, days=1, limit=100000) or []
-            in_qty = sum(int(r.get("qty") or 0) for r in rows if r.get("kind") in ("IN", "ADJ+") and str(r.get("ts","")).startswith(today))
-            out_qty = sum(int(r.get("qty") or 0) for r in rows if r.get("kind") in ("OUT", "ADJ-") and str(r.get("ts","")).startswith(today))
+            # tuplas (id, ts, qty, kind, ...): sin un dict por movimiento
+            rows = db.fetch_movement_rows(warehouse_id=None, code_or_alias=None, days=1, limit=100000) or []
+            in_qty = sum(int(r[2] or 0) for r in rows if r[3] in ("IN", "ADJ+") and str(r[1] or "").startswith(today))
+            out_qty = sum(int(r[2] or 0) for r in rows if r[3] in ("OUT", "ADJ-") and str(r[1] or "").startswith(today))
         except Exception:
             pass
 
         # Bajo stock total (todos los almacenes)
         low_total = 0
         try:
-            for w in warehouses:
-                try:
-                    low_total += len(db.list_low_stock(w["id"], limit=999999) or [])
-                except Exception:
-                    pass
+            low_total = db.count_low_stock()
+        except Exception:
+            pass
+
+        # Riesgo de agotamiento (cobertura < 7 días, desde la caché de demanda)
+        stockout_risk = 0
+        try:
+            stockout_risk = db.count_stockout_risk(7)
         except Exception:
             pass
+        refresh_forecast_bg()
 
-        # Sin rotación últimos 30 días (aprox)
+        # Sin rotación últimos 30 días (índice last_move_ts, sin leer el kardex)
         cold = 0
         try:
-            last30 = db.list_movements(warehouse_id=None, code_or_alias=None, days=30, limit=200000) or []
-            moved = {str(r.get("code")) for r in last30}
-            all_codes = {str(p.get("code")) for p in products}
-            cold = len(all_codes - moved)
+            cold = db.count_cold_products(30)
         except Exception:
             pass
 
         # ---- UI helpers ----
-        def kpi_card(title: str, value: str, icon, bg):
+        dashboard_refs["kpi"].clear()
+        dashboard_refs["bars"].clear()
+
+        def kpi_card(title: str, value: str, icon, bg, key: str | None = None):
+            value_text = ft.Text(value, size=38, weight=ft.FontWeight.W_700)
+            if key:
+                dashboard_refs["kpi"][key] = value_text
             return ft.Card(
                 elevation=2,
                 content=ft.Container(
@@ -828,7 +984,7 @@ def main(page: ft.Page):
                                 spacing=2,
                                 controls=[
                                     ft.Text(title, size=12, color=ft.Colors.GREY_700),
-                                    ft.Text(value, size=38, weight=ft.FontWeight.W_700),
+                                    value_text,
                                 ],
                             ),
                             ft.Container(
@@ -846,8 +1002,8 @@ def main(page: ft.Page):
         bars = []
         wh_totals = []
         try:
-            for wid, cmap in (per_wh or {}).items():
-                wh_totals.append((wid, sum(int(v or 0) for v in cmap.values())))
+            for wid in wh_names:
+                wh_totals.append((wid, int(wh_stock.get(wid, 0))))
             wh_totals.sort(key=lambda t: t[1], reverse=True)
         except Exception:
             wh_totals = []
@@ -856,6 +1012,9 @@ def main(page: ft.Page):
         for wid, val in wh_totals:
             name = wh_names.get(wid, f"Almacén {wid}")
             ratio = max(0.0, min(1.0, (val / total_for_ratio)))
+            val_text = ft.Text(str(val), size=12)
+            bar = ft.ProgressBar(value=ratio, height=16)
+            dashboard_refs["bars"][wid] = (val_text, bar)
             bars.append(
                 ft.Container(
                     padding=8,
@@ -864,10 +1023,10 @@ def main(page: ft.Page):
                             alignment=ft.MainAxisAlignment.SPACE_BETWEEN,
                             controls=[
                                 ft.Text(name, size=12, weight=ft.FontWeight.W_600),
-                                ft.Text(str(val), size=12),
+                                val_text,
                             ],
                         ),
-                        ft.ProgressBar(value=ratio, height=16),
+                        bar,
                     ]),
                 )
             )
@@ -887,11 +1046,13 @@ def main(page: ft.Page):
             columns=12,
             controls=[
                 ft.Column(col={"xs":12, "sm":6, "md":3}, controls=[kpi_card("Almacenes", str(len(warehouses)), ft.Icons.WAREHOUSE, ft.Colors.BLUE_50)]),
-                ft.Column(col={"xs":12, "sm":6, "md":3}, controls=[kpi_card("Productos", str(len(products)), ft.Icons.INVENTORY_2_OUTLINED, ft.Colors.GREEN_50)]),
-                ft.Column(col={"xs":12, "sm":6, "md":3}, controls=[kpi_card("Stock total", str(total_stock), ft.Icons.STACKED_BAR_CHART, ft.Colors.AMBER_50)]),
-                ft.Column(col={"xs":12, "sm":6, "md":3}, controls=[kpi_card("Stock bajo (total)", str(low_total), ft.Icons.WARNING_AMBER, ft.Colors.RED_50)]),
-                ft.Column(col={"xs":12, "sm":6, "md":3}, controls=[kpi_card("Entradas hoy", str(in_qty), ft.Icons.LOGIN, ft.Colors.CYAN_50)]),
-                ft.Column(col={"xs":12, "sm":6, "md":3}, controls=[kpi_card("Salidas hoy", str(out_qty), ft.Icons.LOGOUT, ft.Colors.PINK_50)]),
+                ft.Column(col={"xs":12, "sm":6, "md":3}, controls=[kpi_card("Productos", str(n_products), ft.Icons.INVENTORY_2_OUTLINED, ft.Colors.GREEN_50)]),
+                ft.Column(col={"xs":12, "sm":6, "md":3}, controls=[kpi_card("Stock total", str(total_stock), ft.Icons.STACKED_BAR_CHART, ft.Colors.AMBER_50, "total_stock")]),
+                ft.Column(col={"xs":12, "sm":6, "md":3}, controls=[kpi_card("Stock bajo (total)", str(low_total), ft.Icons.WARNING_AMBER, ft.Colors.RED_50, "low_total")]),
+                ft.Column(col={"xs":12, "sm":6, "md":3}, controls=[kpi_card("Entradas hoy", str(in_qty), ft.Icons.LOGIN, ft.Colors.CYAN_50, "in_today")]),
+                ft.Column(col={"xs":12, "sm":6, "md":3}, controls=[kpi_card("Salidas hoy", str(out_qty), ft.Icons.LOGOUT, ft.Colors.PINK_50, "out_today")]),
+                ft.Column(col={"xs":12, "sm":6, "md":3}, controls=[kpi_card("Agotamiento < 7 días", str(stockout_risk), ft.Icons.TIMER_OUTLINED, ft.Colors.ORANGE_50, "stockout_risk")]),
+                ft.Column(col={"xs":12, "sm":6, "md":3}, controls=[kpi_card("Sin rotación 30 días", str(cold), ft.Icons.AC_UNIT, ft.Colors.BLUE_GREY_50, "cold")]),
                 ft.Column(col={"xs":12, "sm":12, "md":12}, controls=[
                     ft.Container(
                         padding=12,
@@ -1219,11 +1380,11 @@ def main(page: ft.Page):
             if not code: return
             try:
                 wid = int(wh_dd.value)
-                prods = {p["code"]: p for p in db.list_products_by_warehouse(wid)}
+                prods = {r[1]: (r[2], r[4]) for r in db.fetch_products_by_warehouse_rows(wid)}
                 if code not in prods:
                     notify("warning","Código no pertenece al almacén seleccionado."); return
-                sysq = load_sys_qty(code)
-                lines[code] = {"name": prods[code]["name"], "sys": sysq, "target": sysq}
+                sysq = int(prods[code][1] or 0)
+                lines[code] = {"name": prods[code][0], "sys": sysq, "target": sysq}
                 rebuild()
             except Exception as ex:
                 notify("error", f"No se pudo agregar: {ex}")
@@ -1343,11 +1504,14 @@ def main(page: ft.Page):
                 "include_descr": False,
                 "low_stock_only": False,
                 "low_stock_threshold": 5,
+                "abc": None,
                 "results": [],
             })
             ui_state["current_view"] = "search"
 
         def _search_open_first():
+            if search_job["timer"] is not None and search_job["timer"].is_alive():
+                search_refresh_results()  # Enter antes de que venza el debounce
             if not search_state["results"]:
                 return
             q = search_state["query"]
@@ -1368,6 +1532,12 @@ def main(page: ft.Page):
         low_tf = ft.TextField(width=260, label="Umbral", value=str(search_state["low_stock_threshold"]),
                               keyboard_type=ft.KeyboardType.NUMBER,
                               on_change=lambda e: (_set_search_threshold(e.control.value), search_refresh_results()))
+        abc_dd = ft.Dropdown(
+            width=140, label="Clase ABC", value=search_state["abc"] or "all",
+            options=[ft.dropdown.Option("all", text="Todas")] + [ft.dropdown.Option(k, text=k) for k in "ABC"],
+            on_change=lambda e: (search_state.__setitem__("abc", None if e.control.value == "all" else e.control.value),
+                                 search_refresh_results())
+        )
         include_cb = ft.Checkbox(label="Incluir descripción", value=search_state["include_descr"],
                                  on_change=lambda e: (_set_search_flag("include_descr", e.control.value), search_refresh_results()))
 
@@ -1379,7 +1549,7 @@ def main(page: ft.Page):
             border=ft.InputBorder.NONE,
             text_size=20,
             content_padding=ft.padding.symmetric(14, 20),
-            on_change=lambda e: (search_state.__setitem__("query", e.control.value or ""), search_refresh_results()),
+            on_change=lambda e: (search_state.__setitem__("query", e.control.value or ""), search_schedule()),
             on_submit=lambda e: _search_open_first(),
         )
 
@@ -1417,7 +1587,7 @@ def main(page: ft.Page):
 
         filtros_row = ft.Row(
             wrap=True, spacing=10,
-            controls=[wh_dd, instock_cb, low_cb, low_tf, include_cb, ft.Container(),
+            controls=[wh_dd, instock_cb, low_cb, low_tf, abc_dd, include_cb, ft.Container(),
                       ft.TextButton("Limpiar", icon=ft.Icons.CLEAR_ALL, on_click=lambda e: (_search_reset(), render_search_page()))]
         )
 
@@ -1468,8 +1638,7 @@ def main(page: ft.Page):
 
         current_stock = {}
         try:
-            for p in db.list_products_by_warehouse(warehouse_id):
-                current_stock[str(p["code"])] = int(p.get("qty") or 0)
+            current_stock = db.get_stock_map(warehouse_id)
         except Exception:
             current_stock = {}
 
@@ -1532,7 +1701,9 @@ def main(page: ft.Page):
             if err:
                 msg += f", {err} con error"
             notify("success", msg)
-            render_products_list(warehouse_id)
+            # Si ya se ve ese almacén, los eventos de cambio lo parchan; si no, se navega a él
+            if not (ui_state.get("current_view") == "products" and pagination_state.get("warehouse_id") == warehouse_id):
+                render_products_list(warehouse_id)
 
         threading.Thread(target=worker, daemon=True).start()
 
@@ -1555,6 +1726,7 @@ def main(page: ft.Page):
 
     # ---- ENTRADA ----
     def _entry_refresh_warehouse_options():
+        lazy("entry")
         ws = db.list_warehouses()
         entry_wh_dd.options = [ft.dropdown.Option(str(w["id"]), text=w["name"]) for w in ws]
         if ws:
@@ -1622,13 +1794,12 @@ def main(page: ft.Page):
             focus_entry_field()
             return
         try:
-            prods = db.list_products_by_warehouse(wid)
-            mp = {p["code"]: p for p in prods}
+            mp = {r[1]: r[2] for r in db.fetch_products_by_warehouse_rows(wid)}
             if code not in mp:
                 notify("warning", "El código no pertenece a este almacén.")
                 focus_entry_field()
                 return
-            name = mp[code]["name"]
+            name = mp[code]
         except Exception as ex:
             notify("error", f"No se pudo validar producto: {ex}")
             focus_entry_field()
@@ -1659,17 +1830,17 @@ def main(page: ft.Page):
 
     def open_entry_dialog():
         if not db.list_warehouses():
-            open_dialog(alert_no_wh)
+            open_dialog(lazy("no_wh"))
             return
         _entry_refresh_warehouse_options()
         entry_state["lines"].clear()
         entry_render_lines()
-        dlg_entry.open = True
+        page.open(dlg_entry)
         focus_entry_field()
 
     def open_entry_for(warehouse_id: int):
         if not db.list_warehouses():
-            open_dialog(alert_no_wh)
+            open_dialog(lazy("no_wh"))
             return
         _entry_refresh_warehouse_options()
         opts = {opt.key for opt in (entry_wh_dd.options or [])}
@@ -1685,6 +1856,7 @@ def main(page: ft.Page):
 
     # ---- SALIDA ----
     def _exit_refresh_warehouse_options():
+        lazy("exit")
         ws = db.list_warehouses()
         exit_wh_dd.options = [ft.dropdown.Option(str(w["id"]), text=w["name"]) for w in ws]
         if ws:
@@ -1761,7 +1933,7 @@ def main(page: ft.Page):
                 )
             )
         exit_over_list_col.controls = rows
-        open_dialog(dlg_exit_over)
+        open_dialog(lazy("exit_over"))
 
     def perform_exit(wid: int | None):
         if not wid:
@@ -1773,12 +1945,13 @@ def main(page: ft.Page):
             focus_exit_field()
             return
 
-        total_items = 0
-        for code, data in exit_state["lines"].items():
-            qty = int(data["qty"] or 0)
-            if qty > 0:
-                db.decrement_stock(code, wid, qty, note="Salida manual")
-                total_items += qty
+        # Un solo envío al hilo escritor (todo o nada, sin "database is locked")
+        try:
+            total_items = writer.post_lines("OUT", wid, {c: d["qty"] for c, d in exit_state["lines"].items()},
+                                            note="Salida manual", user_id=current_user.get("id")).result()
+        except Exception as ex:
+            notify("error", f"No se pudo registrar la salida: {ex}")
+            return
 
         try:
             dlg_exit.open = False
@@ -1787,10 +1960,6 @@ def main(page: ft.Page):
         page.update()
         close_dialog()
 
-        if ui_state.get("last_warehouse_id") == wid:
-            render_products_list(wid)
-            page.update()
-
         notify("success", f"Salida registrada: {len(exit_state['lines'])} productos, {total_items} unidades.")
         exit_state["lines"].clear()
 
@@ -1809,13 +1978,12 @@ def main(page: ft.Page):
             return
 
         try:
-            prods = db.list_products_by_warehouse(wid)
-            mp = {p["code"]: p for p in prods}
+            mp = {r[1]: r[2] for r in db.fetch_products_by_warehouse_rows(wid)}
             if code not in mp:
                 notify("warning", "El código no pertenece a este almacén.")
                 focus_exit_field()
                 return
-            name = mp[code]["name"]
+            name = mp[code]
         except Exception as ex:
             notify("error", f"No se pudo validar producto: {ex}")
             focus_exit_field()
@@ -1859,7 +2027,7 @@ def main(page: ft.Page):
 
     def open_exit_dialog():
         if not db.list_warehouses():
-            open_dialog(alert_no_wh)
+            open_dialog(lazy("no_wh"))
             return
         _exit_refresh_warehouse_options()
         exit_state["lines"].clear()
@@ -1869,7 +2037,7 @@ def main(page: ft.Page):
 
     def open_exit_for(warehouse_id: int):
         if not db.list_warehouses():
-            open_dialog(alert_no_wh)
+            open_dialog(lazy("no_wh"))
             return
         _exit_refresh_warehouse_options()
         opts = {opt.key for opt in (exit_wh_dd.options or [])}
@@ -1886,14 +2054,8 @@ def main(page: ft.Page):
 
     # ======= REPORTE (encabezado del documento) =======
     report_context = {"mode": None, "warehouse_id": None, "lines": None}  # mode: 'IN'|'OUT'
-    report_reference_tf   = ft.TextField(label="Referencia / Folio", width=260)
-    report_counterparty_tf= ft.TextField(label="Persona / Cliente / Proveedor", width=260)
-    report_note_tf        = ft.TextField(label="Nota (opcional)", width=520)
-    # --- Catálogo de Clientes / Proveedores en el diálogo de reporte ---
-    report_party_dd = ft.Dropdown(label="Selecciona del catálogo", options=[], width=260)
-    btn_party_add = ft.IconButton(icon=ft.Icons.ADD, tooltip="Agregar rápidamente al catálogo",
-                                  style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=5)))
-    
+    report_reference_tf = report_counterparty_tf = report_note_tf = report_party_dd = dlg_report = None
+
     def _refresh_party_options_for_mode(mode: str):
         # IN -> proveedores ; OUT -> clientes
         opts = []
@@ -1913,8 +2075,6 @@ def main(page: ft.Page):
             report_counterparty_tf.value = v
         page.update()
     
-    report_party_dd.on_change = _on_party_dd_change
-    
     def _quick_add_party(e):
         name = (report_counterparty_tf.value or "").strip()
         if not name:
@@ -1937,9 +2097,8 @@ def main(page: ft.Page):
         except Exception as ex:
             notify("error", f"No se pudo guardar en catálogo: {ex}")
     
-    btn_party_add.on_click = _quick_add_party
-
     def _open_report_dialog(mode: str, warehouse_id: int, lines_dict: dict):
+        lazy("report")
         report_context.update({"mode": mode, "warehouse_id": warehouse_id, "lines": lines_dict})
         report_reference_tf.value = ""
         report_counterparty_tf.value = ""
@@ -1978,16 +2137,9 @@ def main(page: ft.Page):
 
         # aplicar movimientos ligados al doc_id
         try:
-            if mode == "IN":
-                for code, data in lines.items():
-                    qty = int(data.get("qty") or 0)
-                    if qty > 0:
-                        db.increment_stock(code, wid, qty, note="Entrada manual", doc_id=doc_id)
-            else:  # OUT
-                for code, data in lines.items():
-                    qty = int(data.get("qty") or 0)
-                    if qty > 0:
-                        db.decrement_stock(code, wid, qty, note="Salida manual", doc_id=doc_id)
+            writer.post_lines(mode, wid, {c: d.get("qty") for c, d in lines.items()},
+                              note=("Entrada manual" if mode == "IN" else "Salida manual"),
+                              doc_id=doc_id, user_id=current_user.get("id")).result()
         except Exception as ex:
             notify("error", f"Error al registrar líneas: {ex}")
             return
@@ -1999,9 +2151,7 @@ def main(page: ft.Page):
         except:
             pass
 
-        # refrescar si procede
-        if ui_state.get("last_warehouse_id") == wid:
-            render_products_list(wid)
+        refresh_forecast_bg()
 
         # Exportar CSV del reporte
         try:
@@ -2017,36 +2167,48 @@ def main(page: ft.Page):
         else:
             exit_state["lines"].clear()
 
-    dlg_report = ft.AlertDialog(
-        modal=True,
-        title=ft.Text("Generar reporte de movimiento"),
-        content=ft.Column(
-            spacing=10, width=580, height=220, scroll=ft.ScrollMode.AUTO,
-            controls=[
-    ft.Row(spacing=10, controls=[
-        report_reference_tf,
-    ]),
-                ft.Row(spacing=8, controls=[report_party_dd, report_counterparty_tf, btn_party_add]),
-                report_note_tf,
-                ft.Text("Se registrará un comprobante y cada línea quedará ligada a él.", size=11, color=ft.Colors.GREY_700),
-            ]
-        ),
-        actions=[
-            ft.TextButton("Cancelar", on_click=lambda e: (setattr(dlg_report,"open",False), page.update(), close_dialog())),
-            ft.FilledButton("Generar y registrar", icon=ft.Icons.DESCRIPTION, on_click=_do_report_and_apply,
-                            style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=5))),
-        ],
-        actions_alignment=ft.MainAxisAlignment.END,
-    )
+    def _build_report_dialog():
+        nonlocal report_reference_tf, report_counterparty_tf, report_note_tf, report_party_dd, dlg_report
+        report_reference_tf   = ft.TextField(label="Referencia / Folio", width=260)
+        report_counterparty_tf= ft.TextField(label="Persona / Cliente / Proveedor", width=260)
+        report_note_tf        = ft.TextField(label="Nota (opcional)", width=520)
+        # --- Catálogo de Clientes / Proveedores en el diálogo de reporte ---
+        report_party_dd = ft.Dropdown(label="Selecciona del catálogo", options=[], width=260,
+                                      on_change=_on_party_dd_change)
+        btn_party_add = ft.IconButton(icon=ft.Icons.ADD, tooltip="Agregar rápidamente al catálogo",
+                                      on_click=_quick_add_party,
+                                      style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=5)))
+        dlg_report = ft.AlertDialog(
+            modal=True,
+            title=ft.Text("Generar reporte de movimiento"),
+            content=ft.Column(
+                spacing=10, width=580, height=220, scroll=ft.ScrollMode.AUTO,
+                controls=[
+                    ft.Row(spacing=10, controls=[
+                        report_reference_tf,
+                    ]),
+                    ft.Row(spacing=8, controls=[report_party_dd, report_counterparty_tf, btn_party_add]),
+                    report_note_tf,
+                    ft.Text("Se registrará un comprobante y cada línea quedará ligada a él.", size=11, color=ft.Colors.GREY_700),
+                ]
+            ),
+            actions=[
+                ft.TextButton("Cancelar", on_click=lambda e: (setattr(dlg_report,"open",False), page.update(), close_dialog())),
+                ft.FilledButton("Generar y registrar", icon=ft.Icons.DESCRIPTION, on_click=_do_report_and_apply,
+                                style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=5))),
+            ],
+            actions_alignment=ft.MainAxisAlignment.END,
+        )
+        return dlg_report
+
+    lazy_factories["report"] = _build_report_dialog
 
 
 
     # =============== TRANSFERENCIA DE STOCK ===============
-    transfer_src_dd = ft.Dropdown(label="Desde (origen)", width=360)
-    transfer_dst_dd = ft.Dropdown(label="Hacia (destino)", width=360)
-    transfer_code_tf = ft.TextField(label="Código / Alias (escáner)", width=240, autofocus=True)
-    transfer_qty_tf  = ft.TextField(label="Cantidad", width=100, keyboard_type=ft.KeyboardType.NUMBER, value="1")
-    transfer_note_tf = ft.TextField(label="Nota (opcional)", width=520)
+    transfer_state = {"lines": {}}  # code -> {"name":..., "qty":...}
+    transfer_src_dd = transfer_dst_dd = transfer_code_tf = transfer_qty_tf = None
+    transfer_note_tf = transfer_lines_col = dlg_transfer = None
 
     def _refresh_transfer_dd():
         ws = db.list_warehouses()
@@ -2063,16 +2225,60 @@ def main(page: ft.Page):
         # refleja los valores en UI
         page.update()
 
-
-    def transfer_do(e=None):
-        code = (transfer_code_tf.value or "").strip()
-        if not code:
-            notify("warning","Captura un código/alias."); return
+    def _transfer_qty() -> int:
         try:
             qty = int(transfer_qty_tf.value or "1")
-            if qty <= 0: qty = 1
+            return qty if qty > 0 else 1
         except:
-            qty = 1
+            return 1
+
+    def transfer_render_lines():
+        rows = []
+        for code, data in transfer_state["lines"].items():
+            rows.append(ft.Row(alignment=ft.MainAxisAlignment.SPACE_BETWEEN, controls=[
+                ft.Text(f"{code} – {data['name']}", size=12),
+                ft.Row(spacing=4, controls=[
+                    ft.Text(str(data["qty"]), size=12, weight=ft.FontWeight.W_600),
+                    ft.IconButton(ft.Icons.CLOSE, icon_size=16, width=28, height=28, tooltip="Quitar",
+                                  on_click=lambda e, _c=code: (transfer_state["lines"].pop(_c, None), transfer_render_lines())),
+                ]),
+            ]))
+        if not rows:
+            rows = [ft.Text("Escanea códigos para armar la lista a transferir.", size=11, color=ft.Colors.GREY_600)]
+        transfer_lines_col.controls[:] = rows
+        page.update()
+
+    def transfer_add_code(raw_code: str):
+        code = (raw_code or "").strip()
+        transfer_code_tf.value = ""
+        if not code:
+            page.update(); return
+        try:
+            code = db.resolve_to_canonical_code(code)
+        except Exception:
+            notify("warning", f"El código '{code}' no es válido.")
+            page.update(); return
+        line = transfer_state["lines"].setdefault(code, {"name": "", "qty": 0})
+        if not line["name"]:
+            try:
+                p = db._get_product_by_code(code)
+                line["name"] = p["name"] if p else ""
+            except Exception:
+                pass
+        line["qty"] += _transfer_qty()
+        transfer_qty_tf.value = "1"
+        transfer_render_lines()
+        try: transfer_code_tf.focus()
+        except: pass
+
+    def transfer_do(e=None):
+        # Lo que quede en el campo (sin Enter) también se transfiere
+        pending = (transfer_code_tf.value or "").strip()
+        if pending:
+            transfer_add_code(pending)
+        lines = {c: d["qty"] for c, d in transfer_state["lines"].items() if d["qty"] > 0}
+        if not lines:
+            notify("warning","Captura un código/alias."); return
         try:
             src = int(transfer_src_dd.value) if transfer_src_dd.value else None
             dst = int(transfer_dst_dd.value) if transfer_dst_dd.value else None
@@ -2085,47 +2291,63 @@ def main(page: ft.Page):
             notify("warning","Origen y destino no pueden ser iguales."); return
 
         try:
-            db.transfer_stock(code, src, dst, qty, note=(transfer_note_tf.value or "Transferencia"))
+            doc_id = db.post_transfer_order(src, dst, lines, note=(transfer_note_tf.value or "Transferencia"),
+                                            user_id=current_user.get("id"))
         except Exception as ex:
-            print(ex)
             notify("error", f"No se pudo transferir: {ex}")
             return
 
+        total = sum(lines.values())
+        transfer_state["lines"].clear()
         close_dialog()
         page.update()
 
-        # Si estás viendo el almacén origen o destino, refresca
-        lwid = ui_state.get("last_warehouse_id")
-        if lwid in (src, dst):
-            render_products_list(lwid)
-        notify("success", f"Transferencia realizada ({qty} uds).")
+        notify("success", f"Transferencia realizada: Doc #{doc_id}, {len(lines)} producto(s), {total} uds.")
+
+    def _build_transfer_dialog():
+        nonlocal transfer_src_dd, transfer_dst_dd, transfer_code_tf, transfer_qty_tf
+        nonlocal transfer_note_tf, transfer_lines_col, dlg_transfer
+        transfer_src_dd = ft.Dropdown(label="Desde (origen)", width=360)
+        transfer_dst_dd = ft.Dropdown(label="Hacia (destino)", width=360)
+        transfer_code_tf = ft.TextField(label="Código / Alias (escáner)", width=240, autofocus=True,
+                                        on_submit=lambda e: transfer_add_code(e.control.value))
+        transfer_qty_tf  = ft.TextField(label="Cantidad", width=100, keyboard_type=ft.KeyboardType.NUMBER, value="1")
+        transfer_note_tf = ft.TextField(label="Nota (opcional)", width=520)
+        transfer_lines_col = ft.Column(spacing=6, tight=True, scroll=ft.ScrollMode.ADAPTIVE)
+        dlg_transfer = ft.AlertDialog(
+            modal=True, title=ft.Text("Transferir stock"),
+            content=ft.Column(
+                spacing=10, width=420, height=420, scroll=ft.ScrollMode.AUTO,
+                controls=[
+                    transfer_src_dd, transfer_dst_dd,
+                    ft.Row(spacing=10, controls=[transfer_code_tf, transfer_qty_tf]),
+                    ft.Text("Productos a transferir:", size=12, color=ft.Colors.GREY_700),
+                    transfer_lines_col,
+                    transfer_note_tf,
+                ]
+            ),
+            actions=[
+                ft.TextButton("Cancelar", on_click=lambda e: (setattr(dlg_transfer,"open",False), page.update(), close_dialog())),
+                ft.FilledButton("Transferir", icon=ft.Icons.SEND, on_click=transfer_do,
+                                style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=5))),
+            ],
+            actions_alignment=ft.MainAxisAlignment.END,
+            shape=ft.RoundedRectangleBorder(radius=5),
+        )
+        return dlg_transfer
 
-    dlg_transfer = ft.AlertDialog(
-        modal=True, title=ft.Text("Transferir stock"),
-        content=ft.Column(
-            spacing=10, width=350, height=320, scroll=ft.ScrollMode.AUTO,
-            controls=[
-                transfer_src_dd, transfer_dst_dd,
-                ft.Row(spacing=10, controls=[transfer_code_tf, transfer_qty_tf]),
-                transfer_note_tf,
-            ]
-        ),
-        actions=[
-            ft.TextButton("Cancelar", on_click=lambda e: (setattr(dlg_transfer,"open",False), page.update(), close_dialog())),
-            ft.FilledButton("Transferir", icon=ft.Icons.SEND, on_click=transfer_do,
-                            style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=5))),
-        ],
-        actions_alignment=ft.MainAxisAlignment.END,
-        shape=ft.RoundedRectangleBorder(radius=5),
-    )
+    lazy_factories["transfer"] = _build_transfer_dialog
 
     def open_transfer_dialog():
         if not db.list_warehouses():
-            open_dialog(alert_no_wh); return
+            open_dialog(lazy("no_wh")); return
+        lazy("transfer")
         _refresh_transfer_dd()
         transfer_code_tf.value = ""
         transfer_qty_tf.value = "1"
         transfer_note_tf.value = ""
+        transfer_state["lines"].clear()
+        transfer_render_lines()
         open_dialog(dlg_transfer)
         try: transfer_code_tf.focus()
         except: pass
@@ -2296,6 +2518,8 @@ def main(page: ft.Page):
             page.update(); return
 
         wh_dd = ft.Dropdown(label="Almacén", width=280, options=wh_opts, value=wh_opts[0].key)
+        abc_dd = ft.Dropdown(label="Clase ABC", width=140, value="all",
+                             options=[ft.dropdown.Option("all", text="Todas")] + [ft.dropdown.Option(k, text=k) for k in "ABC"])
         list_col = ft.Column(spacing=4, height=460, scroll=ft.ScrollMode.AUTO)
 
         def load():
@@ -2307,10 +2531,14 @@ def main(page: ft.Page):
                 list_col.controls[:] = [cmp.empty_state(ft.Icons.WARNING, "Selecciona un almacén.")]
                 page.update(); return
             try:
-                rows = db.list_low_stock(wid, limit=800)
+                rows = db.list_low_stock(wid, limit=800, abc=None if abc_dd.value == "all" else abc_dd.value)
             except Exception as ex:
                 notify("error", f"No se pudo listar stock bajo: {ex}")
                 rows = []
+            try:
+                cover = db.list_demand_cover(wid)
+            except Exception:
+                cover = {}
 
             items = []
             for r in rows:
@@ -2329,7 +2557,9 @@ def main(page: ft.Page):
                                     spacing=2,
                                     controls=[
                                         ft.Text(f'{code} – {r["name"]}', size=13, weight=ft.FontWeight.W_600),
-                                        ft.Text(f'Umbral: {r["threshold"]}', size=11, color=ft.Colors.GREY_700),
+                                        ft.Text(f'Umbral: {r["threshold"]} • Cobertura: {fmt_cover((cover.get((code, wid)) or {}).get("days_of_cover"))}'
+                                                f' • Clase: {(r.get("abc") or "—") + (r.get("xyz") or "")}',
+                                                size=11, color=ft.Colors.GREY_700),
                                     ],
                                 ),
                                 ft.Row(
@@ -2403,7 +2633,171 @@ def main(page: ft.Page):
                 ft.TextButton("Ver almacenes", icon=ft.Icons.WAREHOUSE, on_click=lambda e: render_warehouses()),
             ],
         )
-        filt = ft.Row(wrap=True, spacing=10, controls=[wh_dd, ft.FilledTonalButton("Aplicar", icon=ft.Icons.FILTER_ALT, on_click=lambda e: load(), height=50, style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=5)))])
+        filt = ft.Row(wrap=True, spacing=10, controls=[wh_dd, abc_dd, ft.FilledTonalButton("Aplicar", icon=ft.Icons.FILTER_ALT, on_click=lambda e: load(), height=50, style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=5)))])
+
+        content_column.controls[:] = [
+            ft.Container(padding=ft.padding.only(8,0,8,8), content=header),
+            ft.Container(padding=ft.padding.only(8,0), content=filt),
+            ft.Container(expand=True, padding=ft.padding.all(8), content=list_col),
+        ]
+        page.update()
+        load()
+
+    # =============== REPORTES: SIN ROTACIÓN ===============
+    def render_dead_stock_page():
+        ui_state["current_view"] = "dead"
+
+        wh_opts = [ft.dropdown.Option("", text="Todos")]
+        try:
+            for w in db.list_warehouses():
+                wh_opts.append(ft.dropdown.Option(str(w["id"]), text=w["name"]))
+        except:
+            pass
+        if len(wh_opts) == 1:
+            content_column.controls[:] = [cmp.empty_state(ft.Icons.WAREHOUSE, "Crea al menos un almacén para usar esta vista.")]
+            page.update(); return
+
+        wh_dd = ft.Dropdown(label="Almacén", width=280, options=wh_opts, value=wh_opts[1].key)
+        days_tf = ft.TextField(label="Días sin movimiento", width=180, value="30", keyboard_type=ft.KeyboardType.NUMBER)
+        summary = ft.Text("", size=12, color=ft.Colors.GREY_700)
+        list_col = ft.Column(spacing=4, height=460, scroll=ft.ScrollMode.AUTO)
+
+        def load():
+            wid = int(wh_dd.value) if (wh_dd.value or "").isdigit() else None
+            try:
+                days = max(1, int(days_tf.value or "30"))
+            except:
+                days = 30
+            try:
+                rows = db.list_no_movement(days, wid, limit=800)
+                total = db.count_cold_products(days, wid) if wid else len(rows)
+            except Exception as ex:
+                notify("error", f"No se pudo listar: {ex}")
+                rows, total = [], 0
+            summary.value = f"{total} producto(s) sin movimiento en {days} días" + (" (mostrando 800)" if total > len(rows) else "")
+
+            items = []
+            for r in rows:
+                last = (r.get("last_move_ts") or "")[:10] or "nunca"
+                items.append(
+                    ft.Container(
+                        padding=ft.padding.symmetric(8,10),
+                        border_radius=5,
+                        bgcolor=ft.Colors.GREY_50,
+                        content=ft.Row(
+                            alignment=ft.MainAxisAlignment.SPACE_BETWEEN,
+                            controls=[
+                                ft.Column(
+                                    spacing=2,
+                                    controls=[
+                                        ft.Text(f'{r["code"]} – {r["name"]}', size=13, weight=ft.FontWeight.W_600),
+                                        ft.Text(f'Último movimiento: {last} • Entrada: {(r.get("last_in_ts") or "—")[:10]} • '
+                                                f'Salida: {(r.get("last_out_ts") or "—")[:10]}', size=11, color=ft.Colors.GREY_700),
+                                    ],
+                                ),
+                                cmp.quantity_chip(int(r.get("qty") or 0)),
+                            ],
+                        ),
+                    )
+                )
+            if not items:
+                items = [cmp.empty_state(ft.Icons.VERIFIED, "Todos los productos tuvieron movimiento en el periodo.")]
+            list_col.controls[:] = items
+            page.update()
+
+        header = cmp.header_row(
+            "Sin rotación",
+            [ft.TextButton("Refrescar", icon=ft.Icons.REFRESH, on_click=lambda e: load())],
+        )
+        filt = ft.Row(wrap=True, spacing=10, controls=[wh_dd, days_tf, ft.FilledTonalButton("Aplicar", icon=ft.Icons.FILTER_ALT, on_click=lambda e: load(), height=50, style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=5)))])
+
+        content_column.controls[:] = [
+            ft.Container(padding=ft.padding.only(8,0,8,8), content=header),
+            ft.Container(padding=ft.padding.only(8,0), content=filt),
+            ft.Container(padding=ft.padding.only(8,4), content=summary),
+            ft.Container(expand=True, padding=ft.padding.all(8), content=list_col),
+        ]
+        page.update()
+        load()
+
+    # =============== REPORTES: SUGERENCIA DE COMPRA ===============
+    def render_purchase_suggestions_page():
+        ui_state["current_view"] = "purchase"
+        import replenishment as rpl  # pandas/numpy: se cargan solo al abrir esta vista
+
+        wh_opts = []
+        try:
+            for w in db.list_warehouses():
+                wh_opts.append(ft.dropdown.Option(str(w["id"]), text=w["name"]))
+        except:
+            pass
+        if not wh_opts:
+            content_column.controls[:] = [cmp.empty_state(ft.Icons.WAREHOUSE, "Crea al menos un almacén para usar esta vista.")]
+            page.update(); return
+
+        wh_dd = ft.Dropdown(label="Almacén", width=280, options=wh_opts, value=wh_opts[0].key)
+        days_tf = ft.TextField(label="Demanda (últimos N días)", width=200, value="30",
+                               keyboard_type=ft.KeyboardType.NUMBER, on_submit=lambda e: load())
+        list_col = ft.Column(spacing=4, height=460, scroll=ft.ScrollMode.AUTO)
+
+        def load():
+            try:
+                wid = int(wh_dd.value)
+            except:
+                wid = None
+            try:
+                days = max(1, int(days_tf.value or "30"))
+            except:
+                days = 30
+            try:
+                rows = rpl.list_suggestions(wid, demand_days=days, limit=800)
+            except Exception as ex:
+                notify("error", f"No se pudieron calcular sugerencias: {ex}")
+                rows = []
+            try:
+                cover = db.list_demand_cover(wid)
+            except Exception:
+                cover = {}
+
+            items = []
+            for r in rows:
+                items.append(
+                    ft.Container(
+                        padding=ft.padding.symmetric(8,10),
+                        border_radius=5,
+                        bgcolor=ft.Colors.GREY_50,
+                        content=ft.Row(
+                            alignment=ft.MainAxisAlignment.SPACE_BETWEEN,
+                            controls=[
+                                ft.Column(
+                                    spacing=2,
+                                    controls=[
+                                        ft.Text(f'{r["code"]} – {r["name"]}', size=13, weight=ft.FontWeight.W_600),
+                                        ft.Text(f'Existencia: {r["qty"]} • Reorden: {r["reorder_level"]} • Máx: {r["max_qty"] or "—"} '
+                                                f'• Múltiplo: {r["multiple"]} • LT: {r["lead_time_days"]}d '
+                                                f'• Demanda/día: {r["daily_demand"]} '
+                                                f'• Cobertura: {fmt_cover((cover.get((r["code"], wid)) or {}).get("days_of_cover"))}',
+                                                size=11, color=ft.Colors.GREY_700),
+                                    ],
+                                ),
+                                ft.Text(f'Pedir {r["order_qty"]}', size=14, weight=ft.FontWeight.BOLD),
+                            ],
+                        ),
+                    )
+                )
+            if not items:
+                items = [cmp.empty_state(ft.Icons.VERIFIED, "No hay productos que requieran pedido con las reglas actuales.")]
+            list_col.controls[:] = items
+            page.update()
+
+        header = cmp.header_row(
+            "Sugerencia de compra",
+            [
+                ft.TextButton("Refrescar", icon=ft.Icons.REFRESH, on_click=lambda e: load()),
+                ft.TextButton("Reglas", icon=ft.Icons.TUNE, on_click=lambda e: render_replenishment_rules_page()),
+            ],
+        )
+        filt = ft.Row(wrap=True, spacing=10, controls=[wh_dd, days_tf, ft.FilledTonalButton("Aplicar", icon=ft.Icons.FILTER_ALT, on_click=lambda e: load(), height=50, style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=5)))])
 
         content_column.controls[:] = [
             ft.Container(padding=ft.padding.only(8,0,8,8), content=header),
@@ -2422,8 +2816,9 @@ def main(page: ft.Page):
     def render_import_products():
         warehouses = db.list_warehouses()
         if not warehouses:
-            open_dialog(alert_no_wh)
+            open_dialog(lazy("no_wh"))
             return
+        lazy("file_picker")
 
         hint = ft.Column(
             spacing=10,
@@ -2452,6 +2847,7 @@ def main(page: ft.Page):
     #   ALMACÉN CRUD
     # =========================
     def open_create_dialog():
+        lazy("create_wh")
         name_tf.value = ""
         descr_tf.value = ""
         dlg_create.open = True
@@ -2477,12 +2873,65 @@ def main(page: ft.Page):
     def confirm_delete(w):
         warehouse_to_delete["id"] = w["id"]
         warehouse_to_delete["name"] = w["name"]
-        open_dialog(dlg_delete)
+        open_dialog(lazy("delete_wh"))
+
+    # Borrado por pasos en segundo plano (db.run_delete_warehouse): el almacén queda oculto
+    # desde que se confirma; la barra muestra el avance y al reabrir la app se reanuda lo pendiente.
+    delete_jobs = {}
+    delete_bar = ft.ProgressBar(value=0, expand=True)
+    delete_lbl = ft.Text("", size=12)
+    delete_banner = ft.Container(visible=False, padding=ft.padding.symmetric(horizontal=16, vertical=6),
+                                 content=ft.Row([delete_lbl, delete_bar], spacing=12))
+
+    def _refresh_delete_banner():
+        if not delete_jobs:
+            delete_banner.visible = False
+            return
+        done = sum(j["done"] for j in delete_jobs.values())
+        total = sum(j["total"] for j in delete_jobs.values())
+        names = ", ".join(f"'{j['name']}'" for j in delete_jobs.values())
+        delete_bar.value = done / total if total else None
+        delete_lbl.value = f"Eliminando {names}: {done} / {total}"
+        delete_banner.visible = True
+
+    def start_warehouse_delete(wid: int, name: str):
+        if wid in delete_jobs:
+            return
+        delete_jobs[wid] = {"name": name, "done": 0, "total": 0}
+
+        def _progress(done, total):
+            job = delete_jobs[wid]
+            step = max(1, total // 100)  # ~1 % por repintado
+            if done == total or done // step != job["done"] // step:
+                job["done"], job["total"] = done, total
+                _refresh_delete_banner()
+                page.update()
+            else:
+                job["done"], job["total"] = done, total
+
+        def _run():
+            try:
+                db.run_delete_warehouse(wid, progress=_progress)
+                notify("success", f"Almacén '{name}' eliminado.")
+            except Exception as ex:
+                notify("error", f"Error al eliminar '{name}': {ex}")
+            finally:
+                delete_jobs.pop(wid, None)
+                _refresh_delete_banner()
+                try:
+                    if ui_state.get("current_view") == "warehouses":
+                        render_warehouses()
+                    page.update()
+                except Exception:
+                    pass
+
+        _refresh_delete_banner()
+        threading.Thread(target=_run, name=f"almacen-delete-{wid}", daemon=True).start()
 
     def do_delete_warehouse():
         try:
-            db.delete_warehouse_cascade(warehouse_to_delete["id"])
-            notify("success", f"Almacén '{warehouse_to_delete['name']}' eliminado.")
+            db.begin_delete_warehouse(warehouse_to_delete["id"])
+            start_warehouse_delete(warehouse_to_delete["id"], warehouse_to_delete["name"])
         except Exception as ex:
             notify("error", f"Error: {ex}")
         finally:
@@ -2534,73 +2983,95 @@ def main(page: ft.Page):
 
     page.on_keyboard_event = on_key
 
-        # =============== REPORTES: SUGERENCIA DE COMPRA ===============
-    
     # =========================
     #   UI (COMPONENTES)
     # =========================
-    file_picker = ft.FilePicker(on_result=lambda e: (
-        ui_state.__setitem__("pending_file", e.files[0]) if e.files else None,
-        refresh_pick_wh_dialog_and_open() if e.files else None
-    ))
-    page.overlay.append(file_picker)
+    file_picker = None
+
+    def _build_file_picker():
+        nonlocal file_picker
+        file_picker = ft.FilePicker(on_result=lambda e: (
+            ui_state.__setitem__("pending_file", e.files[0]) if e.files else None,
+            refresh_pick_wh_dialog_and_open() if e.files else None
+        ))
+        page.overlay.append(file_picker)
+        page.update()
+        return file_picker
+
+    lazy_factories["file_picker"] = _build_file_picker
 
     # ---- Diálogos comunes ----
-    alert_no_wh = ft.AlertDialog(
-        modal=True,
-        title=ft.Text("No hay almacenes"),
-        content=ft.Text("Debes crear al menos un almacén antes de continuar."),
-        actions=[ft.FilledButton("Crear un almacén", on_click=lambda e: (close_dialog(), open_create_dialog()),
-                                 style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=5)))],
-        actions_alignment=ft.MainAxisAlignment.END,
-    )
+    alert_no_wh = None
+
+    def _build_alert_no_wh():
+        nonlocal alert_no_wh
+        alert_no_wh = ft.AlertDialog(
+            modal=True,
+            title=ft.Text("No hay almacenes"),
+            content=ft.Text("Debes crear al menos un almacén antes de continuar."),
+            actions=[ft.FilledButton("Crear un almacén", on_click=lambda e: (close_dialog(), open_create_dialog()),
+                                     style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=5)))],
+            actions_alignment=ft.MainAxisAlignment.END,
+        )
+        return alert_no_wh
+
+    lazy_factories["no_wh"] = _build_alert_no_wh
 
     # Crear almacén
-    name_tf = ft.TextField(label="Nombre del almacén", autofocus=True, width=400)
-    descr_tf = ft.TextField(label="Descripción (opcional)", width=400, height=100)
-    color_dd = ft.Dropdown(label="Color de tarjeta", width=400, value="slate",
-                           options=[ft.dropdown.Option(k, text=k.capitalize()) for k, _ in COLOR_CHOICES])
-
-    dlg_create = ft.AlertDialog(
-        modal=True,
-        title=ft.Text("Crear un almacén"),
-        shape=ft.RoundedRectangleBorder(radius=5),
-        content=ft.Column([name_tf, color_dd], tight=True, spacing=10, width=400),
-        actions=[
-            ft.TextButton("Cancelar", on_click=lambda e: (setattr(dlg_create, "open", False), page.update(), close_dialog()),
-                          style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=5))),
-            ft.FilledButton("Guardar", on_click=lambda e: save_warehouse(),
-                            style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=5))),
-        ],
-        actions_alignment=ft.MainAxisAlignment.END,
-    )
+    name_tf = descr_tf = color_dd = dlg_create = None
 
-    dlg_delete = ft.AlertDialog(
-        modal=True,
-        title=ft.Text("Eliminar almacén"),
-        content=ft.Text("Esta acción eliminará el almacén y sus datos relacionados (vínculos/stock). ¿Deseas continuar?"),
-        actions=[
-            ft.TextButton("Cancelar", on_click=lambda e: (setattr(dlg_delete, "open", False), page.update(), close_dialog())),
-            ft.FilledButton("Eliminar", on_click=lambda e: do_delete_warehouse(),
-                            style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=5))),
-        ],
-        actions_alignment=ft.MainAxisAlignment.END,
-    )
+    def _build_create_dialog():
+        nonlocal name_tf, descr_tf, color_dd, dlg_create
+        name_tf = ft.TextField(label="Nombre del almacén", autofocus=True, width=400)
+        descr_tf = ft.TextField(label="Descripción (opcional)", width=400, height=100)
+        color_dd = ft.Dropdown(label="Color de tarjeta", width=400, value="slate",
+                               options=[ft.dropdown.Option(k, text=k.capitalize()) for k, _ in COLOR_CHOICES])
+
+        dlg_create = ft.AlertDialog(
+            modal=True,
+            title=ft.Text("Crear un almacén"),
+            shape=ft.RoundedRectangleBorder(radius=5),
+            content=ft.Column([name_tf, color_dd], tight=True, spacing=10, width=400),
+            actions=[
+                ft.TextButton("Cancelar", on_click=lambda e: (setattr(dlg_create, "open", False), page.update(), close_dialog()),
+                              style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=5))),
+                ft.FilledButton("Guardar", on_click=lambda e: save_warehouse(),
+                                style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=5))),
+            ],
+            actions_alignment=ft.MainAxisAlignment.END,
+        )
+        return dlg_create
+
+    lazy_factories["create_wh"] = _build_create_dialog
+
+    dlg_delete = None
+
+    def _build_delete_dialog():
+        nonlocal dlg_delete
+        dlg_delete = ft.AlertDialog(
+            modal=True,
+            title=ft.Text("Eliminar almacén"),
+            content=ft.Text("Esta acción eliminará el almacén y sus datos relacionados (vínculos, stock, movimientos y documentos). "
+                            "El borrado sigue en segundo plano. ¿Deseas continuar?"),
+            actions=[
+                ft.TextButton("Cancelar", on_click=lambda e: (setattr(dlg_delete, "open", False), page.update(), close_dialog())),
+                ft.FilledButton("Eliminar", on_click=lambda e: do_delete_warehouse(),
+                                style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=5))),
+            ],
+            actions_alignment=ft.MainAxisAlignment.END,
+        )
+        return dlg_delete
+
+    lazy_factories["delete_wh"] = _build_delete_dialog
 
     # Importación: elegir almacén
-    wh_dd = ft.Dropdown(label="Selecciona un almacén", width=360,
-                        on_change=lambda e: ui_state.__setitem__("selected_wh_id", int(e.control.value) if e.control.value else None))
-    replace_stock_cb = ft.Checkbox(
-        label="Reemplazar existencias en el almacén (no sumar)",
-        value=False,
-        on_change=lambda e: ui_state.__setitem__("replace_stock", bool(e.control.value)),
-    )
 
     def refresh_pick_wh_dialog_and_open():
         warehouses = db.list_warehouses()
         if not warehouses:
-            open_dialog(alert_no_wh)
+            open_dialog(lazy("no_wh"))
             return
+        lazy("pick_wh")
         wh_options = [ft.dropdown.Option(str(w["id"]), text=w["name"]) for w in warehouses]
         wh_dd.options = wh_options
         wh_dd.value = wh_options[0].key if wh_options else None
@@ -2624,8 +3095,50 @@ def main(page: ft.Page):
         except Exception as ex:
             notify("error", f"Error al leer archivo: {ex}")
             return
-        import_rows_with_progress(rows, ui_state["selected_wh_id"], replace_mode=bool(ui_state.get("replace_stock", False)))
         ui_state["pending_file"] = None
+        open_import_preview(rows, ui_state["selected_wh_id"], bool(ui_state.get("replace_stock", False)))
+
+    def open_import_preview(rows: list[dict], warehouse_id: int, replace_mode: bool):
+        """Dry run (import_preview.py) antes de tocar la base; se importa solo al confirmar."""
+        try:
+            import import_preview as ipv
+            res = ipv.preview(rows, warehouse_id, replace_mode)
+        except Exception as ex:
+            # Sin vista previa no hay confirmación: no se importa
+            notify("error", f"No se pudo preparar la vista previa; no se importó nada: {ex}")
+            return
+        lines = [ft.Text(t, size=13) for t in ipv.summary_lines(res)]
+        samples = res["samples"]
+        if samples["alias_codes"]:
+            lines.append(ft.Text("Alias: " + ", ".join(samples["alias_codes"][:10]), size=12, color=ft.Colors.ORANGE_800))
+        if samples["decrease"]:
+            lines.append(ft.Text("Bajan: " + ", ".join(f"{c} {a}→{b}" for c, a, b in samples["decrease"][:10]),
+                                 size=12, color=ft.Colors.GREY_700))
+        if samples["conflicts"]:
+            lines.append(ft.Text("Repetidos en conflicto: " + ", ".join(f"{c} (x{n})" for c, n in samples["conflicts"][:10]),
+                                 size=12, color=ft.Colors.GREY_700))
+
+        def _confirm(e):
+            dlg.open = False
+            page.update()
+            close_dialog()
+            import_rows_with_progress(rows, warehouse_id, replace_mode=replace_mode)
+
+        def _cancel(e):
+            dlg.open = False
+            page.update()
+            close_dialog()
+
+        dlg = ft.AlertDialog(
+            modal=True,
+            title=ft.Text("Vista previa de la importación"),
+            content=ft.Column(lines, spacing=6, width=460, tight=True, scroll=ft.ScrollMode.AUTO),
+            shape=ft.RoundedRectangleBorder(radius=5),
+            actions=[ft.TextButton("Cancelar", on_click=_cancel),
+                     ft.FilledButton("Importar", on_click=_confirm, style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=5)))],
+            actions_alignment=ft.MainAxisAlignment.END,
+        )
+        open_dialog(dlg)
 
     def on_pick_wh_cancel(e):
         dlg_pick_wh.open = False
@@ -2634,85 +3147,121 @@ def main(page: ft.Page):
         ui_state["pending_file"] = None
         ui_state["selected_wh_id"] = None
 
-    dlg_pick_wh = ft.AlertDialog(
-        modal=True,
-        title=ft.Text("¿A qué almacén se agregarán estos productos?"),
-        content=ft.Column([wh_dd, replace_stock_cb], spacing=10, width=380, tight=True),
-        actions=[ft.TextButton("Cancelar", on_click=on_pick_wh_cancel),
-                 ft.FilledButton("Confirmar", on_click=on_pick_wh_confirm, style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=5)))],
-        actions_alignment=ft.MainAxisAlignment.END,
-    )
+    wh_dd = replace_stock_cb = dlg_pick_wh = None
+
+    def _build_pick_wh_dialog():
+        nonlocal wh_dd, replace_stock_cb, dlg_pick_wh
+        wh_dd = ft.Dropdown(label="Selecciona un almacén", width=360,
+                            on_change=lambda e: ui_state.__setitem__("selected_wh_id", int(e.control.value) if e.control.value else None))
+        replace_stock_cb = ft.Checkbox(
+            label="Reemplazar existencias en el almacén (no sumar)",
+            value=False,
+            on_change=lambda e: ui_state.__setitem__("replace_stock", bool(e.control.value)),
+        )
+
+        dlg_pick_wh = ft.AlertDialog(
+            modal=True,
+            title=ft.Text("¿A qué almacén se agregarán estos productos?"),
+            content=ft.Column([wh_dd, replace_stock_cb], spacing=10, width=380, tight=True),
+            actions=[ft.TextButton("Cancelar", on_click=on_pick_wh_cancel),
+                     ft.FilledButton("Confirmar", on_click=on_pick_wh_confirm, style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=5)))],
+            actions_alignment=ft.MainAxisAlignment.END,
+        )
+        return dlg_pick_wh
+
+    lazy_factories["pick_wh"] = _build_pick_wh_dialog
 
     # Entrada
-    entry_wh_dd = ft.Dropdown(label="Almacén", width=360, on_change=entry_on_wh_change)
-    entry_code_tf = ft.TextField(
-        label="Código / Escáner", autofocus=True, width=360,
-        on_submit=lambda e: entry_add_code(e.control.value),
-    )
-    entry_lines_col = ft.Column(spacing=8, width=520, tight=True, scroll=ft.ScrollMode.ADAPTIVE)
+    entry_wh_dd = entry_code_tf = entry_lines_col = dlg_entry = None
+
+    def _build_entry_dialog():
+        nonlocal entry_wh_dd, entry_code_tf, entry_lines_col, dlg_entry
+        entry_wh_dd = ft.Dropdown(label="Almacén", width=360, on_change=entry_on_wh_change)
+        entry_code_tf = ft.TextField(
+            label="Código / Escáner", autofocus=True, width=360,
+            on_submit=lambda e: entry_add_code(e.control.value),
+        )
+        entry_lines_col = ft.Column(spacing=8, width=520, tight=True, scroll=ft.ScrollMode.ADAPTIVE)
 
-    dlg_entry = ft.AlertDialog(
-        modal=True,
-        title=ft.Text("Entrada de productos"),
-        content=ft.Column(
-            width=560, spacing=12,
-            controls=[entry_wh_dd, entry_code_tf, ft.Divider(), ft.Text("Productos en esta entrada:", size=12, color=ft.Colors.GREY_700), entry_lines_col],
-            height=400, scroll=ft.ScrollMode.AUTO
-        ),
-        shape=ft.RoundedRectangleBorder(radius=5),
-        actions=[
-            ft.TextButton("Cancelar", on_click=lambda e: (setattr(dlg_entry, "open", False), page.update(), close_dialog())),
-            ft.FilledButton("Confirmar", on_click=entry_confirm, style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=5))),
-        ],
-        actions_alignment=ft.MainAxisAlignment.END,
-    )
+        dlg_entry = ft.AlertDialog(
+            modal=True,
+            title=ft.Text("Entrada de productos"),
+            content=ft.Column(
+                width=560, spacing=12,
+                controls=[entry_wh_dd, entry_code_tf, ft.Divider(), ft.Text("Productos en esta entrada:", size=12, color=ft.Colors.GREY_700), entry_lines_col],
+                height=400, scroll=ft.ScrollMode.AUTO
+            ),
+            shape=ft.RoundedRectangleBorder(radius=5),
+            actions=[
+                ft.TextButton("Cancelar", on_click=lambda e: (setattr(dlg_entry, "open", False), page.update(), close_dialog())),
+                ft.FilledButton("Confirmar", on_click=entry_confirm, style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=5))),
+            ],
+            actions_alignment=ft.MainAxisAlignment.END,
+        )
+        return dlg_entry
+
+    lazy_factories["entry"] = _build_entry_dialog
 
     # Salida
-    exit_wh_dd = ft.Dropdown(label="Almacén", width=360, on_change=exit_on_wh_change)
-    exit_code_tf = ft.TextField(
-        label="Código / Escáner", autofocus=True, width=360,
-        on_submit=lambda e: exit_add_code(e.control.value),
-        keyboard_type=ft.KeyboardType.TEXT,
-    )
-    exit_lines_col = ft.Column(spacing=8, width=520, tight=True, scroll=ft.ScrollMode.ADAPTIVE)
+    exit_wh_dd = exit_code_tf = exit_lines_col = dlg_exit = None
+
+    def _build_exit_dialog():
+        nonlocal exit_wh_dd, exit_code_tf, exit_lines_col, dlg_exit
+        exit_wh_dd = ft.Dropdown(label="Almacén", width=360, on_change=exit_on_wh_change)
+        exit_code_tf = ft.TextField(
+            label="Código / Escáner", autofocus=True, width=360,
+            on_submit=lambda e: exit_add_code(e.control.value),
+            keyboard_type=ft.KeyboardType.TEXT,
+        )
+        exit_lines_col = ft.Column(spacing=8, width=520, tight=True, scroll=ft.ScrollMode.ADAPTIVE)
 
-    dlg_exit = ft.AlertDialog(
-        modal=True,
-        title=ft.Text("Salida de productos"),
-        content=ft.Column(
-            width=560, spacing=12,
-            controls=[exit_wh_dd, exit_code_tf, ft.Divider(), ft.Text("Productos en esta salida:", size=12, color=ft.Colors.GREY_700), exit_lines_col],
-            height=400, scroll=ft.ScrollMode.AUTO
-        ),
-        shape=ft.RoundedRectangleBorder(radius=5),
-        actions=[
-            ft.TextButton("Vaciar", on_click=exit_clear),
-            ft.TextButton("Cancelar", on_click=lambda e: (setattr(dlg_exit, "open", False), page.update(), close_dialog())),
-            ft.FilledButton("Confirmar", on_click=exit_confirm, style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=5))),
-        ],
-        actions_alignment=ft.MainAxisAlignment.END,
-    )
+        dlg_exit = ft.AlertDialog(
+            modal=True,
+            title=ft.Text("Salida de productos"),
+            content=ft.Column(
+                width=560, spacing=12,
+                controls=[exit_wh_dd, exit_code_tf, ft.Divider(), ft.Text("Productos en esta salida:", size=12, color=ft.Colors.GREY_700), exit_lines_col],
+                height=400, scroll=ft.ScrollMode.AUTO
+            ),
+            shape=ft.RoundedRectangleBorder(radius=5),
+            actions=[
+                ft.TextButton("Vaciar", on_click=exit_clear),
+                ft.TextButton("Cancelar", on_click=lambda e: (setattr(dlg_exit, "open", False), page.update(), close_dialog())),
+                ft.FilledButton("Confirmar", on_click=exit_confirm, style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=5))),
+            ],
+            actions_alignment=ft.MainAxisAlignment.END,
+        )
+        return dlg_exit
 
-    dlg_exit_over = ft.AlertDialog(
-        modal=True,
-        title=ft.Text("Cantidad solicitada supera la existencia"),
-        content=ft.Column(
-            controls=[
-                ft.Text("Se encontraron productos con cantidad solicitada mayor que la existencia. ¿Deseas extraer la cantidad máxima disponible?", size=12),
-                ft.Divider(),
-                exit_over_list_col,
+    lazy_factories["exit"] = _build_exit_dialog
+
+    dlg_exit_over = None
+
+    def _build_exit_over_dialog():
+        nonlocal dlg_exit_over
+        dlg_exit_over = ft.AlertDialog(
+            modal=True,
+            title=ft.Text("Cantidad solicitada supera la existencia"),
+            content=ft.Column(
+                controls=[
+                    ft.Text("Se encontraron productos con cantidad solicitada mayor que la existencia. ¿Deseas extraer la cantidad máxima disponible?", size=12),
+                    ft.Divider(),
+                    exit_over_list_col,
+                ],
+                spacing=8, width=560, height=320, scroll=ft.ScrollMode.AUTO,
+            ),
+            actions=[
+                ft.TextButton("Cancelar", on_click=lambda e: (setattr(dlg_exit_over, "open", False), page.update(), close_dialog()),
+                              style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=5))),
+                ft.FilledButton("Usar máximos y continuar", on_click=apply_exit_caps_and_perform,
+                                style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=5))),
             ],
-            spacing=8, width=560, height=320, scroll=ft.ScrollMode.AUTO,
-        ),
-        actions=[
-            ft.TextButton("Cancelar", on_click=lambda e: (setattr(dlg_exit_over, "open", False), page.update(), close_dialog()),
-                          style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=5))),
-            ft.FilledButton("Usar máximos y continuar", on_click=apply_exit_caps_and_perform,
-                            style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=5))),
-        ],
-        actions_alignment=ft.MainAxisAlignment.END,
-        shape=ft.RoundedRectangleBorder(radius=5),
-    )
+            actions_alignment=ft.MainAxisAlignment.END,
+            shape=ft.RoundedRectangleBorder(radius=5),
+        )
+        return dlg_exit_over
+
+    lazy_factories["exit_over"] = _build_exit_over_dialog
 
     # Área de contenido
     content_area = ft.Container(
@@ -2774,6 +3323,8 @@ def main(page: ft.Page):
             controls=[
                 cmp.menu_item("Movimientos", ft.Icons.LIST, lambda e: render_movements_page()),
                 cmp.menu_item("Stock bajo", ft.Icons.WARNING, lambda e: render_low_stock_page()),
+                cmp.menu_item("Sugerencia de compra", ft.Icons.SHOPPING_CART, lambda e: render_purchase_suggestions_page()),
+                cmp.menu_item("Sin rotación", ft.Icons.AC_UNIT, lambda e: render_dead_stock_page()),
             ],
         ),
         ft.SubmenuButton(
@@ -2825,12 +3376,14 @@ def main(page: ft.Page):
     )
 
     # Raíz de la UI
+    _profile("construcción de UI", t_ui)
+    t_login = time.perf_counter()
     page.add(
     ft.SafeArea(
         content=ft.Column(
             controls=[
                top_bar,
-               dlg_entry,
+                delete_banner,
                 content_area,
                 logo
                 
@@ -2841,11 +3394,15 @@ def main(page: ft.Page):
     )
 )
     refresh_appbar()
+    for w in db.pending_warehouse_deletes():  # borrados que quedaron a medias
+        start_warehouse_delete(w["id"], w["name"])
     open_login_dialog()
-
-
-    render_dashboard_page()
+    _profile("primer cuadro + login", t_login)
+    _profile("total hasta login", _T_START)
+    # El dashboard se construye al iniciar sesión (do_login), no detrás del login
 
 
 if __name__ == "__main__":
+    if "--profile-startup" in sys.argv:
+        PROFILE_STARTUP = True
     ft.app(target=main)
\ No newline at end of file
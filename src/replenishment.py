@@ -0,0 +1,109 @@
+# replenishment.py
+# Motor de reabastecimiento vectorizado: stock + reglas (product_rules) + demanda reciente
+
+import numpy as np
+import pandas as pd
+
+import database as db
+
+
+def load_inputs(warehouse_id: int | None = None, demand_days: int = 30) -> pd.DataFrame:
+    """
+    Carga en un DataFrame todos los pares producto/almacén con stock, umbral, regla
+    y demanda diaria promedio (salidas OUT de los últimos `demand_days` días).
+    """
+    df = pd.DataFrame.from_records(
+        db.fetch_replenishment_inputs(warehouse_id),
+        columns=list(db.REPLENISHMENT_COLUMNS),
+    )
+    dem = pd.DataFrame.from_records(
+        db.fetch_out_demand(demand_days, warehouse_id),
+        columns=["product_id", "warehouse_id", "qty_out"],
+    )
+    if df.empty:
+        df["has_rule"] = pd.Series(dtype=bool)
+        df["daily_demand"] = pd.Series(dtype=float)
+        return df
+
+    df["has_rule"] = df["multiple"].notna().to_numpy()
+    if not dem.empty:
+        df = df.merge(dem, on=["product_id", "warehouse_id"], how="left")
+    else:
+        df["qty_out"] = 0
+    days = max(1, int(demand_days or 1))
+    df["daily_demand"] = df["qty_out"].fillna(0).to_numpy(dtype=np.float64) / days
+    return df.drop(columns=["qty_out"])
+
+
+def compute_orders(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Calcula en una sola pasada vectorizada la cantidad sugerida por par.
+
+    - Sin regla se usa el umbral (product_threshold) como punto de reorden.
+    - Stock proyectado = qty - demanda durante el lead time.
+    - Se pide cuando el proyectado <= max(reorder_point, min_qty) y se repone hasta
+      max_qty (o hasta el punto de reorden si no hay máximo).
+    - La cantidad se redondea hacia arriba al múltiplo y no deja el stock proyectado por
+      encima de max_qty; si el hueco hasta max_qty es menor que un múltiplo, se pide un
+      múltiplo (el par está bajo su punto de reorden: pedir 0 lo dejaría sin pedido).
+    """
+    out = df.copy()
+    if out.empty:
+        for col in ("lead_time_demand", "projected", "reorder_level", "order_qty"):
+            out[col] = pd.Series(dtype=np.int64)
+        return out
+
+    qty = out["qty"].to_numpy(dtype=np.float64)
+    thr = out["threshold"].to_numpy(dtype=np.float64)
+    has_rule = out["has_rule"].to_numpy(dtype=bool)
+    mn = out["min_qty"].fillna(0).to_numpy(dtype=np.float64)
+    mx = out["max_qty"].fillna(0).to_numpy(dtype=np.float64)
+    rp = out["reorder_point"].fillna(0).to_numpy(dtype=np.float64)
+    mul = np.maximum(out["multiple"].fillna(1).to_numpy(dtype=np.float64), 1.0)
+    lt = np.maximum(out["lead_time_days"].fillna(0).to_numpy(dtype=np.float64), 0.0)
+    demand = out["daily_demand"].to_numpy(dtype=np.float64)
+
+    lt_demand = np.ceil(demand * lt)
+    projected = np.maximum(qty - lt_demand, 0.0)
+    reorder_level = np.where(has_rule, np.maximum(rp, mn), thr)
+    target = np.where(mx > 0, np.maximum(mx, reorder_level), reorder_level)
+
+    need = (reorder_level > 0) & (projected <= reorder_level)
+    raw = np.maximum(target - projected, 0.0)
+    order = np.ceil(raw / mul) * mul
+    cap = np.where(mx > 0, np.floor(np.maximum(mx - projected, 0.0) / mul) * mul, np.inf)
+    order = np.where(need, np.minimum(order, cap), 0.0)
+    order = np.where(need & (order == 0) & (raw > 0), mul, order)
+
+    out["lead_time_demand"] = lt_demand.astype(np.int64)
+    out["projected"] = projected.astype(np.int64)
+    out["reorder_level"] = reorder_level.astype(np.int64)
+    out["order_qty"] = order.astype(np.int64)
+    return out
+
+
+def suggest(warehouse_id: int | None = None, demand_days: int = 30, limit: int | None = 1000) -> pd.DataFrame:
+    """DataFrame con los pares que requieren pedido, ordenado por cantidad sugerida."""
+    res = compute_orders(load_inputs(warehouse_id, demand_days))
+    res = res[res["order_qty"] > 0].sort_values(["order_qty", "code"], ascending=[False, True])
+    return res.head(limit) if limit else res
+
+
+def list_suggestions(warehouse_id: int | None = None, demand_days: int = 30, limit: int | None = 1000) -> list[dict]:
+    """
+    Igual que suggest() pero como lista de dicts (compatible con db.list_purchase_suggestions:
+    code, name, qty, threshold, deficit) más los campos de la regla y la sugerencia.
+    """
+    res = suggest(warehouse_id, demand_days, limit)
+    if res.empty:
+        return []
+    res = res.assign(
+        deficit=res["order_qty"],
+        max_qty=res["max_qty"].fillna(0).astype(np.int64),
+        multiple=res["multiple"].fillna(1).astype(np.int64),
+        lead_time_days=res["lead_time_days"].fillna(0).astype(np.int64),
+        daily_demand=res["daily_demand"].round(2),
+    )
+    cols = ["code", "name", "warehouse_id", "qty", "threshold", "deficit", "order_qty",
+            "reorder_level", "max_qty", "multiple", "lead_time_days", "lead_time_demand", "daily_demand"]
+    return res[cols].to_dict("records")
@@ -0,0 +1,396 @@
+# sync.py
+# Sincronización por deltas entre sitios (cada uno con su almacen.db). Cada sitio exporta lo
+# que cambió desde el cursor que el otro confirmó: catálogo (sync_log), documentos y kardex
+# (por id), en un lote JSON columnar comprimido. Aplicar un lote es idempotente.
+#
+# Cursor = {"log": seq, "doc": id, "ledger": id}. Solo viajan documentos y movimientos
+# originados en el sitio que exporta (lo recibido de otros no se reenvía): topología en malla,
+# cada par de sitios se sincroniza directamente.
+#
+#   python cli.py sync export --peer SITIO --out lote.sync   (luego: sync ack SITIO '<cursor>')
+#   python cli.py sync apply lote.sync                       (imprime el cursor a confirmar)
+#   python cli.py sync serve --port 8766  /  sync pull HOST:8766
+
+import gzip
+import json
+import socket
+import socketserver
+import struct
+import threading
+import uuid
+
+import database as db
+import events
+
+FORMAT_VERSION = 2   # 2: cambios de código y bajas de productos
+BATCH_ROWS = 50000   # movimientos máximos por lote (el resto va en el siguiente)
+STREAMS = ("log", "doc", "ledger")
+
+PRODUCT_COLS = ["code", "name", "description", "category", "unit", "unit_factor"]
+ALIAS_COLS = ["alt_code", "code"]   # code None = alias borrado
+RENAME_COLS = ["code", "new_code"]  # en orden: se aplican antes que los productos
+DOC_COLS = ["id", "ts", "doc_type", "warehouse", "counterparty", "reference", "note", "total_lines",
+            "total_qty", "series", "folio", "status", "dst_warehouse"]
+LEDGER_COLS = ["id", "ts", "code", "warehouse", "qty", "kind", "note", "ref_id", "doc_id"]
+
+
+def site_id() -> str:
+    """Identificador de este sitio (se genera la primera vez y queda en app_state)."""
+    sid = db._get_state("site_id")
+    if not sid:
+        sid = uuid.uuid4().hex[:12]
+        with db._cur() as c:
+            db._set_state_c(c, "site_id", sid)
+    return sid
+
+
+def _cursor(d: dict | None) -> dict:
+    d = d or {}
+    return {k: int(d.get(k) or 0) for k in STREAMS}
+
+
+def peer_state(site: str) -> dict:
+    """{"sent": cursor confirmado por el sitio, "recv": cursor recibido de él}."""
+    with db._cur() as c:
+        r = c.execute("SELECT * FROM sync_peers WHERE site = ?", (site,)).fetchone()
+    if not r:
+        return {"sent": _cursor(None), "recv": _cursor(None)}
+    return {"sent": {k: r[f"sent_{k}"] for k in STREAMS}, "recv": {k: r[f"recv_{k}"] for k in STREAMS}}
+
+
+def list_peers() -> list[dict]:
+    """Sitios conocidos con sus cursores (para `cli.py sync status`)."""
+    with db._cur() as c:
+        return [{"site": r["site"], "sent": {k: r[f"sent_{k}"] for k in STREAMS},
+                 "recv": {k: r[f"recv_{k}"] for k in STREAMS}, "updated_at": r["updated_at"]}
+                for r in c.execute("SELECT * FROM sync_peers ORDER BY site")]
+
+
+def _save_peer_c(c, site: str, side: str, cursor: dict):
+    c.execute("INSERT OR IGNORE INTO sync_peers(site) VALUES (?)", (site,))
+    c.execute(f"""
+        UPDATE sync_peers SET {side}_log = MAX({side}_log, ?), {side}_doc = MAX({side}_doc, ?),
+               {side}_ledger = MAX({side}_ledger, ?), updated_at = datetime('now')
+        WHERE site = ?""", (cursor["log"], cursor["doc"], cursor["ledger"], site))
+
+
+def ack(site: str, cursor: dict):
+    """El sitio `site` confirmó haber aplicado hasta `cursor`: lo siguiente se exporta desde ahí."""
+    with db._cur() as c:
+        _save_peer_c(c, site, "sent", _cursor(cursor))
+        # El log de catálogo confirmado por todos los sitios conocidos ya no hace falta
+        low = c.execute("SELECT MIN(sent_log) FROM sync_peers").fetchone()[0] or 0
+        c.execute("DELETE FROM sync_log WHERE seq <= ?", (low,))
+
+
+# ---------- exportar ----------
+def export_changes(since: dict | None = None, limit: int = BATCH_ROWS) -> dict:
+    """
+    Lote con los cambios locales posteriores a `since`, leído en una sola transacción de lectura
+    (conexión propia: no detiene a la UI). Con since["log"] == 0 va el catálogo completo.
+    """
+    since = _cursor(since)
+    conn = db.open_connection()
+    conn.row_factory = None
+    try:
+        c = conn.cursor()
+        c.execute("BEGIN")
+        # sqlite_sequence: sigue valiendo aunque el log ya confirmado se haya podado
+        max_log = (c.execute("SELECT seq FROM sqlite_sequence WHERE name = 'sync_log'").fetchone() or (0,))[0]
+        max_doc = c.execute("SELECT IFNULL(MAX(id), 0) FROM movement_docs").fetchone()[0]
+        wh = dict(c.execute("SELECT id, name FROM warehouses").fetchall())
+
+        prod_sql = f"SELECT {', '.join(PRODUCT_COLS)} FROM products"
+        renames, deleted = [], []
+        if since["log"] == 0:
+            products = c.execute(prod_sql).fetchall()
+            aliases = c.execute("""SELECT pc.alt_code, p.code FROM product_codes pc
+                                   JOIN products p ON p.id = pc.product_id""").fetchall()
+        else:
+            changed = c.execute("SELECT DISTINCT entity, key FROM sync_log WHERE seq > ? AND seq <= ?",
+                                (since["log"], max_log)).fetchall()
+            codes = [k for e, k in changed if e == "product"]
+            alts = [k for e, k in changed if e == "alias"]
+            renames = c.execute("""SELECT key, new_key FROM sync_log
+                                   WHERE entity = 'rename' AND seq > ? AND seq <= ? ORDER BY seq""",
+                                (since["log"], max_log)).fetchall()
+            # Baja: solo si el código no volvió a crearse después
+            for k in sorted({k for e, k in changed if e == "product_del"}):
+                if not c.execute("SELECT 1 FROM products WHERE code = ?", (k,)).fetchone():
+                    deleted.append(k)
+            products, aliases = [], []
+            for i in range(0, len(codes), 500):
+                chunk = codes[i:i + 500]
+                products += c.execute(prod_sql + f" WHERE code IN ({','.join('?' * len(chunk))})", chunk).fetchall()
+            for i in range(0, len(alts), 500):
+                chunk = alts[i:i + 500]
+                found = dict(c.execute(f"""SELECT pc.alt_code, p.code FROM product_codes pc
+                                           JOIN products p ON p.id = pc.product_id
+                                           WHERE pc.alt_code IN ({','.join('?' * len(chunk))})""", chunk).fetchall())
+                aliases += [(a, found.get(a)) for a in chunk]
+
+        local = "NOT IN (SELECT local_id FROM sync_origin WHERE entity = ?)"
+        docs = c.execute(f"""
+            SELECT id, ts, doc_type, warehouse_id, counterparty, reference, note, total_lines, total_qty,
+                   series, folio, status, dst_warehouse_id
+            FROM movement_docs WHERE id > ? AND id <= ? AND id {local} ORDER BY id
+        """, (since["doc"], max_doc, "doc")).fetchall()
+        docs = [(*d[:3], wh.get(d[3]), *d[4:12], wh.get(d[12])) for d in docs]
+        ledger = c.execute(f"""
+            SELECT m.id, m.ts, p.code, m.warehouse_id, m.qty, k.kind, IFNULL(n.note, ''), m.ref_id, m.doc_id
+            FROM stock_ledger m
+            JOIN products p ON p.id = m.product_id
+            JOIN movement_kinds k ON k.id = m.kind
+            LEFT JOIN ledger_notes n ON n.id = m.note_id
+            WHERE m.id > ? AND m.id {local} AND (m.doc_id IS NULL OR m.doc_id <= ?)
+            ORDER BY m.id LIMIT ?
+        """, (since["ledger"], "ledger", max_doc, int(limit))).fetchall()
+        max_ledger = ledger[-1][0] if ledger else since["ledger"]
+        if len(ledger) < limit:
+            max_ledger = max(max_ledger, c.execute("SELECT IFNULL(MAX(id), 0) FROM stock_ledger").fetchone()[0])
+        ledger = [(*m[:3], wh.get(m[3]), *m[4:]) for m in ledger]
+        c.execute("COMMIT")
+    finally:
+        conn.close()
+    return {
+        "v": FORMAT_VERSION, "site": site_id(), "since": since,
+        "until": {"log": max(max_log, since["log"]), "doc": max(max_doc, since["doc"]), "ledger": max_ledger},
+        "renames": {"cols": RENAME_COLS, "rows": renames},
+        "deleted": {"cols": ["code"], "rows": [[k] for k in deleted]},
+        "products": {"cols": PRODUCT_COLS, "rows": products},
+        "aliases": {"cols": ALIAS_COLS, "rows": aliases},
+        "docs": {"cols": DOC_COLS, "rows": docs},
+        "ledger": {"cols": LEDGER_COLS, "rows": ledger},
+    }
+
+
+def dumps(batch: dict) -> bytes:
+    return gzip.compress(json.dumps(batch, separators=(",", ":"), ensure_ascii=False).encode("utf-8"))
+
+
+def loads(data: bytes) -> dict:
+    try:
+        batch = json.loads(gzip.decompress(data).decode("utf-8"))
+    except (OSError, ValueError) as ex:
+        raise ValueError(f"Lote de sincronización inválido: {ex}")
+    if batch.get("v") != FORMAT_VERSION:
+        raise ValueError(f"Versión de lote no soportada: {batch.get('v')}")
+    return batch
+
+
+def export_batch(path: str, peer: str, limit: int = BATCH_ROWS) -> dict:
+    """Escribe el lote para `peer` desde su último ack. Devuelve el lote (sin filas) como resumen."""
+    batch = export_changes(peer_state(peer)["sent"], limit)
+    with open(path, "wb") as f:
+        f.write(dumps(batch))
+    return summary(batch)
+
+
+def summary(batch: dict) -> dict:
+    return {"site": batch["site"], "since": batch["since"], "until": batch["until"],
+            **{k: len(batch[k]["rows"]) for k in ("renames", "deleted", "products", "aliases", "docs", "ledger")}}
+
+
+# ---------- aplicar ----------
+def _warehouse_id_c(c, name: str | None, cache: dict) -> int | None:
+    if not name:
+        return None
+    if name not in cache:
+        c.execute("INSERT OR IGNORE INTO warehouses(name) VALUES (?)", (name,))
+        cache[name] = c.execute("SELECT id FROM warehouses WHERE name = ?", (name,)).fetchone()[0]
+    return cache[name]
+
+
+def _origin_map_c(c, site: str, entity: str, remote_ids) -> dict:
+    """{remote_id: local_id} de lo ya recibido de `site` (solo los ids pedidos)."""
+    out, ids = {}, list(remote_ids)
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        out.update(c.execute(f"""
+            SELECT remote_id, local_id FROM sync_origin WHERE site = ? AND entity = ?
+            AND remote_id IN ({','.join('?' * len(chunk))})""", [site, entity, *chunk]).fetchall())
+    return out
+
+
+def apply_changes(batch: dict) -> dict:
+    """
+    Aplica un lote en una sola transacción (todo o nada). Lo ya aplicado se omite, así que
+    repetir un lote o recibir lotes traslapados no duplica nada. Devuelve el cursor a confirmar.
+    """
+    site = batch["site"]
+    if site == site_id():
+        raise ValueError("El lote es de este mismo sitio")
+    recv = peer_state(site)["recv"]
+    since = _cursor(batch["since"])
+    gap = [k for k in STREAMS if since[k] > recv[k]]
+    if gap:
+        raise ValueError(f"Falta un lote anterior de '{site}' ({', '.join(gap)}): "
+                         f"recibido hasta {recv}, el lote empieza en {since}")
+
+    touched: dict[int, set] = {}
+    prods = [dict(zip(batch["products"]["cols"], r)) for r in batch["products"]["rows"]]
+    renamed = deleted = 0
+    with db._tx() as c:
+        whs: dict = {}
+        # Cambios de código en el orden del remitente (si el código nuevo ya existe aquí, se deja)
+        for old, new in batch["renames"]["rows"]:
+            renamed += c.execute("""
+                UPDATE products SET code = ? WHERE code = ?
+                AND NOT EXISTS (SELECT 1 FROM products WHERE code = ?)""", (new, old, new)).rowcount
+        # Bajas: un producto con kardex aquí no se borra (el borrado en cascada se llevaría su historia)
+        for (code,) in batch["deleted"]["rows"]:
+            deleted += c.execute("""
+                DELETE FROM products WHERE code = ?
+                AND NOT EXISTS (SELECT 1 FROM stock_ledger WHERE product_id = products.id)""", (code,)).rowcount
+        # Catálogo: último valor gana; sin cambios reales no se reescribe (ni se vuelve a registrar)
+        c.executemany("""
+            INSERT INTO products(code, name, description, category, unit, unit_factor)
+            VALUES (:code, :name, :description, :category, :unit, :unit_factor)
+            ON CONFLICT(code) DO UPDATE SET name = excluded.name, description = excluded.description,
+                category = excluded.category, unit = excluded.unit, unit_factor = excluded.unit_factor
+            WHERE name IS NOT excluded.name OR description IS NOT excluded.description
+               OR category IS NOT excluded.category OR unit IS NOT excluded.unit
+               OR unit_factor IS NOT excluded.unit_factor
+        """, prods)
+        for alt, code in batch["aliases"]["rows"]:
+            if code is None:
+                c.execute("DELETE FROM product_codes WHERE alt_code = ?", (alt,))
+                continue
+            pid = db._product_id_c(c, code)
+            if pid is not None:
+                c.execute("""
+                    INSERT INTO product_codes(product_id, alt_code) VALUES (?, ?)
+                    ON CONFLICT(alt_code) DO UPDATE SET product_id = excluded.product_id
+                    WHERE product_id <> excluded.product_id""", (pid, alt))
+
+        ledger_cols = batch["ledger"]["cols"]
+        wanted = sorted({r[0] for r in batch["docs"]["rows"]}
+                        | {r[ledger_cols.index("doc_id")] for r in batch["ledger"]["rows"]} - {None})
+        doc_map = _origin_map_c(c, site, "doc", wanted)
+        n_docs = 0
+        for r in batch["docs"]["rows"]:
+            d = dict(zip(batch["docs"]["cols"], r))
+            if d["id"] in doc_map:
+                continue
+            c.execute("""
+                INSERT INTO movement_docs(ts, doc_type, warehouse_id, counterparty, reference, note, total_lines,
+                                          total_qty, series, folio, status, dst_warehouse_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (d["ts"], d["doc_type"], _warehouse_id_c(c, d["warehouse"], whs), d["counterparty"],
+                  d["reference"], d["note"], d["total_lines"], d["total_qty"],
+                  f"{site}:{d['series'] or 'GEN'}", d["folio"], d["status"] or "posted",
+                  _warehouse_id_c(c, d["dst_warehouse"], whs)))
+            doc_map[d["id"]] = c.lastrowid
+            c.execute("INSERT INTO sync_origin(site, entity, remote_id, local_id) VALUES (?, 'doc', ?, ?)",
+                      (site, d["id"], c.lastrowid))
+            n_docs += 1
+
+        rows = [dict(zip(ledger_cols, r)) for r in batch["ledger"]["rows"]]
+        done = _origin_map_c(c, site, "ledger", [m["id"] for m in rows])
+        rows = [m for m in rows if m["id"] not in done]
+        pids = db._resolve_codes_c(c, {m["code"] for m in rows})
+        missing = sorted({m["code"] for m in rows} - set(pids))
+        if missing:
+            raise ValueError(f"Producto(s) no existen: {', '.join(missing[:10])}")
+        notes = db._note_ids_c(c, (m["note"] for m in rows))
+        delta: dict[tuple, int] = {}
+        for m in rows:
+            key = (pids[m["code"]], _warehouse_id_c(c, m["warehouse"], whs))
+            sign = 1 if m["kind"] in ("IN", "XFER-IN", "ADJ+") else -1 if m["kind"] in ("OUT", "XFER-OUT", "ADJ-") else 1
+            delta[key] = delta.get(key, 0) + sign * m["qty"]
+        # Existencias por el neto de cada par (el orden interno del lote no produce negativos intermedios)
+        c.executemany("INSERT OR IGNORE INTO product_warehouse(product_id, warehouse_id) VALUES (?, ?)", list(delta))
+        # (el trigger BEFORE INSERT de no negativos ve la fila de VALUES antes del conflicto:
+        # se crea en 0 y se suma con UPDATE)
+        c.executemany("INSERT OR IGNORE INTO product_stock(product_id, warehouse_id, qty) VALUES (?, ?, 0)",
+                      list(delta))
+        c.executemany("UPDATE product_stock SET qty = qty + ? WHERE product_id = ? AND warehouse_id = ?",
+                      [(q, p, w) for (p, w), q in delta.items() if q])
+        # ref_id apunta a ids del ledger remitente: se traduce con lo recibido antes o en este lote
+        local_ids = _origin_map_c(c, site, "ledger", {m["ref_id"] for m in rows} - {None})
+        for m in rows:
+            pid, wid = pids[m["code"]], whs[m["warehouse"]]
+            kind = db._kind_code(m["kind"])
+            c.execute("""
+                INSERT INTO stock_ledger(ts, product_id, warehouse_id, qty, kind, note_id, ref_id, doc_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (m["ts"], pid, wid, m["qty"], kind, notes.get(m["note"] or ""), local_ids.get(m["ref_id"]),
+                  doc_map.get(m["doc_id"])))
+            local_ids[m["id"]] = c.lastrowid
+            c.execute("INSERT INTO sync_origin(site, entity, remote_id, local_id) VALUES (?, 'ledger', ?, ?)",
+                      (site, m["id"], c.lastrowid))
+            touched.setdefault(wid, set()).add(m["code"])
+
+        until = _cursor(batch["until"])
+        _save_peer_c(c, site, "recv", until)
+        for wid, codes in touched.items():
+            events.emit(events.stock_changed(wid, codes))
+        for p in prods[:events.MAX_CODES]:
+            events.emit(events.ProductUpserted(p["code"]))
+        if renamed or deleted:  # también invalidan el catálogo (se reconstruye al leer)
+            gone = [new for _, new in batch["renames"]["rows"]] + [code for (code,) in batch["deleted"]["rows"]]
+            for code in gone[:events.MAX_CODES]:
+                events.emit(events.ProductUpserted(code))
+    return {"site": site, "ack": until, "renamed": renamed, "deleted": deleted, "products": len(prods),
+            "docs": n_docs, "ledger": len(rows)}
+
+
+def apply_batch(path: str) -> dict:
+    with open(path, "rb") as f:
+        return apply_changes(loads(f.read()))
+
+
+# ---------- socket local ----------
+# Protocolo (líneas JSON + lote con prefijo de longitud):
+#   servidor -> {"site"}; cliente -> {"site", "since"}; servidor -> lote; cliente -> {"ack"}
+def _send_blob(sock, data: bytes):
+    sock.sendall(struct.pack(">Q", len(data)) + data)
+
+
+def _recv_exact(f, n: int) -> bytes:
+    data = f.read(n)
+    if len(data) != n:
+        raise ValueError("Conexión cerrada a mitad del lote")
+    return data
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.wfile.write((json.dumps({"site": site_id()}) + "\n").encode())
+        req = json.loads(self.rfile.readline() or b"{}")
+        peer = req.get("site")
+        if not peer:
+            return
+        _send_blob(self.request, dumps(export_changes(req.get("since"))))
+        line = self.rfile.readline()
+        if line:
+            ack(peer, json.loads(line).get("ack"))
+
+
+class SyncServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def serve(host: str = "127.0.0.1", port: int = 8766) -> SyncServer:
+    """Servidor de deltas en un hilo; cada cliente que se conecta jala lo nuevo de este sitio."""
+    srv = SyncServer((host, port), _Handler)
+    threading.Thread(target=srv.serve_forever, name="almacen-sync", daemon=True).start()
+    return srv
+
+
+def pull(host: str, port: int = 8766, timeout: float = 30.0) -> dict:
+    """Jala y aplica los cambios del sitio remoto desde lo último recibido; confirma al terminar."""
+    with socket.create_connection((host, port), timeout=timeout) as sock:
+        f = sock.makefile("rb")
+        remote = json.loads(f.readline() or b"{}").get("site")
+        if not remote:
+            raise ValueError("El servidor no respondió el saludo de sincronización")
+        req = {"site": site_id(), "since": peer_state(remote)["recv"]}
+        sock.sendall((json.dumps(req) + "\n").encode())
+        size = struct.unpack(">Q", _recv_exact(f, 8))[0]
+        data = _recv_exact(f, size)
+        res = apply_changes(loads(data))
+        sock.sendall((json.dumps({"ack": res["ack"]}) + "\n").encode())
+    res["bytes"] = len(data)
+    return res
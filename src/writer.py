@@ -0,0 +1,248 @@
+# writer.py
+# Escritor único: un hilo dueño de la conexión de escritura recibe mutaciones por una cola,
+# las agrupa en una sola transacción (group commit) y devuelve Futures a quien las pidió.
+#
+# Pasan por aquí la API de escáneres (api.py) y las entradas/salidas por escáner de la UI.
+# El resto de las escrituras de la UI (importaciones, transferencias, ajustes, catálogo, conteos)
+# siguen en la conexión compartida db._conn: SQLite las serializa con BEGIN IMMEDIATE y
+# busy_timeout, pero no se agrupan en el commit del escritor.
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import database as db
+import events
+
+BATCH_MAX_OPS = 100     # operaciones por commit
+BATCH_WINDOW_S = 0.005  # espera máxima para juntar más operaciones tras la primera
+
+_STOP = object()
+
+
+class WriteQueue:
+    """
+    Cola de escritura con un solo hilo y una sola conexión.
+    Cada operación es fn(cursor, *args) y corre dentro de un SAVEPOINT propio:
+    si falla, solo ella se revierte y su Future recibe la excepción; el resto del lote
+    se confirma con un único COMMIT. Los Futures se resuelven después del COMMIT.
+    """
+
+    def __init__(self, db_path: str | None = None, max_ops: int = BATCH_MAX_OPS, window: float = BATCH_WINDOW_S):
+        self.db_path = db_path
+        self.max_ops = max(1, int(max_ops))
+        self.window = max(0.0, float(window))
+        self._q = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._dead: BaseException | None = None   # no se pudo abrir la conexión: submit falla
+        self.stats = {"ops": 0, "commits": 0, "errors": 0}
+
+    def start(self):
+        with self._lock:
+            self._start_locked()
+        return self
+
+    def _start_locked(self):
+        # Cola propia por hilo: lo que un hilo detenido deja sin hacer no se mezcla con el siguiente
+        if self._dead is None and (self._thread is None or not self._thread.is_alive()):
+            self._q = queue.Queue()
+            self._thread = threading.Thread(target=self._run, args=(self._q,), name="almacen-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float | None = 5.0):
+        """Procesa lo pendiente y detiene el hilo."""
+        with self._lock:
+            t, q = self._thread, self._q
+            self._thread = None
+            if t is not None and t.is_alive():
+                q.put(_STOP)  # bajo el candado: nada de submit() queda detrás del paro
+        if t is not None:
+            t.join(timeout)
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        fut = Future()
+        with self._lock:
+            self._start_locked()
+            if self._dead is not None:
+                raise RuntimeError(f"Escritor no disponible: {self._dead}") from self._dead
+            self._q.put((fn, args, kwargs, fut))
+        return fut
+
+    def call(self, fn, *args, **kwargs):
+        """Igual que submit() pero espera el resultado (o relanza el error)."""
+        return self.submit(fn, *args, **kwargs).result()
+
+    # ---------- hilo escritor ----------
+    def _next_batch(self, q, first) -> tuple[list, bool]:
+        batch, stop = [first], False
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_ops:
+            wait = deadline - time.monotonic()
+            try:
+                item = q.get(timeout=wait) if wait > 0 else q.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                stop = True
+                break
+            batch.append(item)
+        return batch, stop
+
+    def _fail_pending(self, q, ex: BaseException):
+        while True:
+            try:
+                item = q.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                item[3].set_exception(ex)
+
+    def _run(self, q):
+        try:
+            conn = db.open_connection(self.db_path)
+            conn.isolation_level = None  # transacciones manuales
+            c = conn.cursor()
+        except Exception as ex:
+            # Sin conexión no hay escritor: lo encolado falla con el error y submit ya no encola
+            with self._lock:
+                self._dead = ex
+            self._fail_pending(q, ex)
+            return
+        try:
+            stop = False
+            while not stop:
+                first = q.get()
+                if first is _STOP:
+                    break
+                batch, stop = self._next_batch(q, first)
+                self._run_batch(c, batch)
+        finally:
+            # Lo que quedó en cola tras el paro no se ejecuta
+            self._fail_pending(q, RuntimeError("Escritor detenido"))
+            c.close()
+            conn.close()
+
+    def _run_batch(self, c, batch: list):
+        done = []
+        try:
+            c.execute("BEGIN IMMEDIATE")
+        except Exception as ex:
+            for _, _, _, fut in batch:
+                fut.set_exception(ex)
+            self.stats["errors"] += len(batch)
+            return
+        evs = []  # eventos de las operaciones confirmadas (se publican tras el COMMIT)
+        for fn, args, kwargs, fut in batch:
+            if not fut.set_running_or_notify_cancel():
+                continue
+            c.execute("SAVEPOINT op")
+            try:
+                with events.deferred() as op_evs:
+                    res = fn(c, *args, **kwargs)
+            except BaseException as ex:
+                c.execute("ROLLBACK TO op")
+                c.execute("RELEASE op")
+                fut.set_exception(ex)
+                self.stats["errors"] += 1
+                continue
+            c.execute("RELEASE op")
+            evs.extend(op_evs)
+            done.append((fut, res))
+        try:
+            c.execute("COMMIT")
+        except Exception as ex:
+            try: c.execute("ROLLBACK")
+            except Exception: pass
+            for fut, _ in done:
+                fut.set_exception(ex)
+            self.stats["errors"] += len(done)
+            return
+        self.stats["ops"] += len(done)
+        self.stats["commits"] += 1
+        for fut, res in done:
+            fut.set_result(res)
+        events.publish_all(evs)
+
+
+# ---------- instancia compartida + operaciones de escaneo ----------
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer() -> WriteQueue:
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = WriteQueue(db._db_path).start()
+        return _writer
+
+
+def shutdown():
+    global _writer
+    with _writer_lock:
+        w, _writer = _writer, None
+    if w is not None:
+        w.stop()
+
+
+def _scan_c(c, kind: str, code_or_alias: str, warehouse_id: int, qty: int, note: str = "",
+            doc_id: int | None = None, user_id: int | None = None):
+    if kind == "IN":
+        db._increment_stock_c(c, code_or_alias, warehouse_id, qty, note, doc_id)
+        db._audit_c(c, user_id, "INCREMENT_STOCK", "stock_movements", doc_id,
+                    f"{code_or_alias}|WH:{warehouse_id}|+{qty}|{note}")
+    else:
+        db._decrement_stock_c(c, code_or_alias, warehouse_id, qty, note, doc_id)
+        db._audit_c(c, user_id, "DECREMENT_STOCK", "stock_movements", doc_id,
+                    f"{code_or_alias}|WH:{warehouse_id}|-{qty}|{note}")
+
+
+def _post_lines_c(c, kind: str, warehouse_id: int, lines: dict, note: str = "",
+                  doc_id: int | None = None, user_id: int | None = None) -> int:
+    total = 0
+    for code, qty in lines.items():
+        qty = int(qty or 0)
+        if qty > 0:
+            _scan_c(c, kind, code, warehouse_id, qty, note, doc_id, user_id)
+            total += qty
+    return total
+
+
+def increment_stock(code_or_alias: str, warehouse_id: int, qty: int, note: str = "",
+                    doc_id: int | None = None, user_id: int | None = None) -> Future:
+    return get_writer().submit(_scan_c, "IN", code_or_alias, warehouse_id, qty, note, doc_id, user_id)
+
+
+def decrement_stock(code_or_alias: str, warehouse_id: int, qty: int, note: str = "",
+                    doc_id: int | None = None, user_id: int | None = None) -> Future:
+    return get_writer().submit(_scan_c, "OUT", code_or_alias, warehouse_id, qty, note, doc_id, user_id)
+
+
+def post_lines(kind: str, warehouse_id: int, lines: dict, note: str = "",
+               doc_id: int | None = None, user_id: int | None = None) -> Future:
+    """Todas las líneas {code: qty} en una sola operación (todo o nada). Devuelve el total de unidades."""
+    return get_writer().submit(_post_lines_c, kind, warehouse_id, lines, note, doc_id, user_id)
+
+
+def post_doc(doc_type: str, warehouse_id: int, lines, counterparty: str = "", reference: str = "",
+             note: str = "", series: str | None = None, user_id: int | None = None) -> Future:
+    """Documento IN/OUT completo (encabezado + líneas) como una operación; el Future da el doc_id."""
+    return get_writer().submit(db._post_movement_doc_c, doc_type, warehouse_id, lines, counterparty,
+                               reference, note, series, user_id)
+
+
+def post_transfer(src_warehouse_id: int, dst_warehouse_id: int, lines, note: str = "Transferencia",
+                  reference: str = "", counterparty: str = "", user_id: int | None = None) -> Future:
+    return get_writer().submit(db._post_transfer_order_c, src_warehouse_id, dst_warehouse_id, lines,
+                               note, reference, counterparty, None, user_id)
+
+
+def set_count_lines(session_id: int, counted) -> Future:
+    return get_writer().submit(db._set_count_lines_c, session_id, counted)
+
+
+def import_aliases(pairs) -> Future:
+    """Carga masiva de alias [(alt_code, código base)] como una sola operación del escritor."""
+    return get_writer().submit(db._import_aliases_c, list(pairs))
@@ -0,0 +1,31 @@
+# Carga masiva de alias: reporte por categoría y solo se insertan los alias sin problemas
+import database as db
+
+
+def test_import_aliases_report(tmp_path):
+    db.close_db()
+    db.init_db(str(tmp_path / "a.db"))
+    db.upsert_product("A", "Producto A", "", None)
+    db.upsert_product("B", "Producto B", "", None)
+    db.add_product_alias("A", "X1")
+    db.add_product_alias("A", "X2")
+
+    res = db.import_aliases([
+        ("N1", "A"),          # nuevo
+        ("N2", "X1"),         # base dada por alias: se resuelve a A
+        ("X1", "A"),          # ya existía
+        ("M1", "NOPE"),       # base inexistente
+        ("B", "A"),           # ya es código principal
+        ("X2", "B"),          # ya apunta a otro producto
+        ("D1", "A"), ("D1", "B"),   # el mismo archivo lo asigna a dos productos
+        ("", "A"), (" E ", " "),    # renglones vacíos: se omiten
+    ])
+    assert (res["rows"], res["added"], res["existing"]) == (8, 2, 1)
+    assert res["missing"] == ["NOPE"] and res["is_code"] == ["B"]
+    conflicts = {(a, cur, tuple(sorted(want.split(",")))) for a, cur, want in res["conflicts"]}
+    assert conflicts == {("D1", "*", ("A", "B")), ("X2", "A", ("B",))}
+
+    aliases = dict(db._conn.execute("""SELECT pc.alt_code, p.code FROM product_codes pc
+                                       JOIN products p ON p.id = pc.product_id"""))
+    assert aliases == {"X1": "A", "X2": "A", "N1": "A", "N2": "A"}
+    db.close_db()
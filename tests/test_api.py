@@ -0,0 +1,87 @@
+# API de escáneres contra una base temporal: cliente http.client en un puerto efímero
+import asyncio
+import http.client
+import json
+import threading
+
+import pytest
+
+import api
+import database as db
+import writer
+
+
+@pytest.fixture
+def server(tmp_path):
+    db.close_db()
+    writer.shutdown()
+    db.init_db(str(tmp_path / "api.db"))
+    db.add_warehouse("Centro")
+    db.add_warehouse("Norte")
+    ws = {w["name"]: w["id"] for w in db.list_warehouses()}
+    db.upsert_product("A", "Producto A", "", warehouse_id=ws["Centro"])
+    db.add_product_alias("A", "A-ALT")
+    db.post_movement_doc("IN", ws["Centro"], [("A", 5)])
+
+    scanner = api.ScannerAPI(db._db_path, workers=2)
+    started, state = threading.Event(), {}
+
+    def ready(srv):
+        state["port"] = srv.sockets[0].getsockname()[1]
+        state["loop"], state["task"] = asyncio.get_running_loop(), asyncio.current_task()
+        started.set()
+
+    def run():
+        try:
+            asyncio.run(scanner.serve("127.0.0.1", 0, ready=ready))
+        except asyncio.CancelledError:
+            pass
+
+    t = threading.Thread(target=run, daemon=True)
+    t.start()
+    assert started.wait(5)
+    try:
+        yield state["port"], ws
+    finally:
+        state["loop"].call_soon_threadsafe(state["task"].cancel)
+        t.join(5)
+        scanner.close()
+        writer.shutdown()
+        db.close_db()
+
+
+def _call(conn, method, path, payload=None):
+    body = json.dumps(payload) if payload is not None else None
+    conn.request(method, path, body=body, headers={"Content-Type": "application/json"})
+    r = conn.getresponse()
+    return r.status, json.loads(r.read()), r.getheader("Connection")
+
+
+def test_docs_errors_and_keep_alive(server):
+    port, ws = server
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    try:
+        status, data, keep = _call(conn, "POST", "/docs",
+                                   {"type": "OUT", "warehouse_id": ws["Centro"], "lines": {"A-ALT": 2}})
+        assert status == 200 and data["doc_id"] > 0 and keep == "keep-alive"
+        sock = conn.sock
+
+        # misma conexión TCP para todo lo que sigue
+        status, data, _ = _call(conn, "GET", f"/stock?code=A&warehouse_id={ws['Centro']}")
+        assert status == 200 and data["qty"] == 3
+        status, data, _ = _call(conn, "POST", "/docs", {"type": "OUT", "warehouse_id": ws["Centro"],
+                                                        "lines": {"A": 4}})
+        assert status == 400 and data["error"]
+        status, data, _ = _call(conn, "POST", "/docs", {"type": "IN", "warehouse_id": ws["Centro"],
+                                                        "lines": {"NOPE": 1}})
+        assert status == 400 and "NOPE" in data["error"]
+        assert conn.sock is sock
+
+        db.begin_delete_warehouse(ws["Norte"])
+        status, data, _ = _call(conn, "POST", "/docs", {"type": "IN", "warehouse_id": ws["Norte"],
+                                                        "lines": {"A": 1}})
+        assert status == 409
+        assert conn.sock is sock
+    finally:
+        conn.close()
+    assert db.get_stock_for_codes(["A"]) == {"A": {ws["Centro"]: 3}}
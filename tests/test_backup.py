@@ -0,0 +1,76 @@
+# Respaldos en línea: copia verificada (con y sin gzip), rotación y restauración segura
+import gzip
+import os
+import sqlite3
+
+import pytest
+
+import backup
+import database as db
+
+
+def _count(path, table="products"):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def live(tmp_path):
+    path = str(tmp_path / "live.db")
+    db.close_db()
+    db.init_db(path)
+    db.add_warehouse("Centro")
+    wid = db.list_warehouses()[0]["id"]
+    for i in range(50):
+        db.upsert_product(f"P{i:03d}", f"Producto {i}", "", warehouse_id=wid)
+    yield path
+    db.close_db()
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_backup_now_is_verified(live, tmp_path, compress):
+    dest = str(tmp_path / "bk")
+    out = backup.backup_now(dest, compress=compress, pages=4, sleep=0)
+    assert out.endswith(".db.gz" if compress else ".db") and backup.list_backups(dest) == [out]
+    assert not [n for n in os.listdir(dest) if n.endswith(".part")]
+    if compress:
+        plain = str(tmp_path / "plain.db")
+        with gzip.open(out, "rb") as g, open(plain, "wb") as f:
+            f.write(g.read())
+        out = plain
+    assert backup._integrity(out) == ["ok"]
+    assert _count(out) == 50
+
+
+def test_rotate_keeps_newest(tmp_path):
+    dest = tmp_path / "bk"
+    dest.mkdir()
+    names = [f"almacen-2026010{d}-000000.db" for d in range(1, 6)] + ["almacen-20260106-000000.db.gz"]
+    for n in names + ["otro.db"]:
+        (dest / n).write_bytes(b"x")
+    removed = backup.rotate(str(dest), keep=2)
+    assert sorted(os.path.basename(p) for p in removed) == names[:4]
+    assert sorted(os.listdir(dest)) == sorted(names[4:] + ["otro.db"])
+
+
+def test_restore_rejects_bad_files_and_keeps_safety_copy(live, tmp_path):
+    junk = tmp_path / "junk.db"
+    junk.write_bytes(os.urandom(8192))
+    with pytest.raises(ValueError, match="dañado"):
+        backup.restore(str(junk), live, str(tmp_path / "safe"))
+    other = str(tmp_path / "other.db")
+    sqlite3.connect(other).execute("CREATE TABLE t(x)").connection.close()
+    with pytest.raises(ValueError, match="no es un respaldo"):
+        backup.restore(other, live, str(tmp_path / "safe"))
+    assert not os.path.exists(tmp_path / "safe")   # nada se tocó
+
+    good = backup.backup_now(str(tmp_path / "bk"), compress=True, sleep=0)
+    wid = db.list_warehouses()[0]["id"]
+    db.upsert_product("NUEVO", "Después del respaldo", "", warehouse_id=wid)
+    db.close_db()
+    safety = backup.restore(good, live, str(tmp_path / "safe"))
+    assert _count(live) == 50
+    assert safety and os.path.dirname(safety) == str(tmp_path / "safe") and _count(safety) == 51
@@ -0,0 +1,37 @@
+# Catálogo compartido: las escrituras de otro proceso sobre la misma base también se ven
+import os
+import subprocess
+import sys
+
+import catalog
+import database as db
+
+SRC = os.path.join(os.path.dirname(__file__), "..", "src")
+
+
+def _other_process(path, code):
+    subprocess.run([sys.executable, "-c", f"import database as db; db.init_db({path!r}); {code}; db.close_db()"],
+                   cwd=SRC, check=True)
+
+
+def test_catalog_sees_writes_from_other_process(tmp_path):
+    path = str(tmp_path / "c.db")
+    db.close_db()
+    db.init_db(path)
+    db.add_warehouse("Centro")
+    wid = db.list_warehouses()[0]["id"]
+    db.upsert_product("A", "Producto A", "", warehouse_id=wid)
+    db.upsert_product("B", "Producto B", "", warehouse_id=wid)
+    catalog.invalidate()
+    assert catalog.get_catalog().stock_by_warehouse("A") == {wid: 0}
+
+    # solo existencias: parche por el kardex, sin reconstruir
+    cat = catalog.get_catalog()
+    _other_process(path, f"db.post_movement_doc('IN', {wid}, [('A', 7)])")
+    assert catalog.get_catalog() is cat
+    assert cat.stock_by_warehouse("A") == {wid: 7} and cat.stock_by_warehouse("B") == {wid: 0}
+
+    # producto nuevo: reconstrucción
+    _other_process(path, f"db.upsert_product('C', 'Producto C', '', {wid})")
+    assert catalog.get_catalog().view(wid).codes() == ["A", "B", "C"]
+    db.close_db()
@@ -0,0 +1,42 @@
+# Clasificación ABC/XYZ con datos fijos: cruce de cortes, grupos por almacén y pares sin salidas
+import datetime
+
+import numpy as np
+import pandas as pd
+
+import classify as cl
+
+AS_OF = "2026-10-19"
+
+
+def _day(weeks_ago: int) -> str:
+    return (datetime.date.fromisoformat(AS_OF) - datetime.timedelta(days=7 * weeks_ago + 1)).isoformat()
+
+
+def test_compute_classes():
+    pairs = np.array([(1, 1), (2, 1), (3, 1), (4, 1), (6, 1), (1, 2), (5, 2)])
+    weekly = {(1, 1): [20, 20, 15, 15],   # 70: A, parejo -> X
+              (2, 1): [15, 0, 0, 0],      # 15: cruza el 80 % -> A; una sola semana -> Z
+              (3, 1): [5, 5, 0, 0],       # 10: B (85 % -> 95 %); cv = 1.0 -> Y
+              (4, 1): [5, 0, 0, 0],       # 5: empieza en 95 % -> C
+              (5, 2): [3, 0, 0, 0]}       # único con salidas en el almacén 2 -> A
+    rows = [(p, w, _day(i), q) for (p, w), qs in weekly.items() for i, q in enumerate(qs) if q]
+    rows += [(4, 1, _day(6), 100),        # fuera de las 4 semanas
+             (9, 1, _day(0), 50)]         # par que no se clasifica
+    buckets = pd.DataFrame.from_records(rows, columns=["product_id", "warehouse_id", "day", "qty"])
+
+    res = cl.compute_classes(pairs, buckets, AS_OF, weeks=4)
+    got = {(p, w): (q, a, x) for p, w, q, a, x in res[["product_id", "warehouse_id", "out_qty", "abc", "xyz"]]
+           .itertuples(index=False)}
+    assert got == {(1, 1): (70, "A", "X"), (2, 1): (15, "A", "Z"), (3, 1): (10, "B", "Y"),
+                   (4, 1): (5, "C", "Z"), (6, 1): (0, "C", "Z"),
+                   (1, 2): (0, "C", "Z"), (5, 2): (3, "A", "Z")}
+    share = dict(zip(zip(res["product_id"], res["warehouse_id"]), res["cum_share"]))
+    assert share[(2, 1)] == 0.85 and share[(5, 2)] == 1.0
+    no_demand = res[res["out_qty"] == 0]
+    assert no_demand["cv"].isna().all()
+
+
+def test_empty_pairs():
+    res = cl.compute_classes(np.empty((0, 2)), pd.DataFrame(), AS_OF)
+    assert list(res.columns) == cl.COLUMNS and res.empty
@@ -0,0 +1,20 @@
+# cli.py: lectura de líneas 'código,cantidad'
+import io
+
+import pytest
+
+import cli
+
+
+def test_known_header_is_skipped():
+    assert cli._read_lines(io.StringIO("Código,Cantidad\nA1,3\nB2,4\n")) == [("A1", 3), ("B2", 4)]
+
+
+def test_no_header():
+    assert cli._read_lines(io.StringIO("A1,3\nB2,4\n")) == [("A1", 3), ("B2", 4)]
+
+
+@pytest.mark.parametrize("text", ["A1,x\nB2,4\n", "codigo,cantidad\nA1,x\n", "foo,bar\nA1,3\n"])
+def test_bad_quantity_is_an_error(text):
+    with pytest.raises(ValueError):
+        cli._read_lines(io.StringIO(text))
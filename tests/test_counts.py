@@ -0,0 +1,61 @@
+# Conteos cíclicos: foto por alcance, captura masiva estricta y conciliación todo o nada
+import pytest
+
+import database as db
+
+
+@pytest.fixture
+def wid(tmp_path):
+    db.close_db()
+    db.init_db(str(tmp_path / "k.db"))
+    db.add_warehouse("Centro")
+    wid = db.list_warehouses()[0]["id"]
+    for code, cat, qty in (("A", "FER", 5), ("B", "FER", 2), ("C", "PIN", 8)):
+        db.upsert_product(code, f"Producto {code}", "", warehouse_id=wid)
+        db.set_product_category_unit(code, cat, "pz", 1)
+        db.post_movement_doc("IN", wid, [(code, qty)])
+    db.add_location(wid, "R1")
+    loc = db.list_locations(wid)[0]["id"]
+    db.set_product_location(wid, "C", loc)
+    yield wid
+    db.close_db()
+
+
+def _lines(sid):
+    return {r["code"]: (r["sys_qty"], r["counted_qty"]) for r in db.list_count_lines(sid)}
+
+
+def test_scope_snapshot(wid):
+    assert _lines(db.create_count_session(wid, scope="all")) == {"A": (5, None), "B": (2, None), "C": (8, None)}
+    assert set(_lines(db.create_count_session(wid, scope={"category": "FER"}))) == {"A", "B"}
+    loc = db.list_locations(wid)[0]["id"]
+    assert set(_lines(db.create_count_session(wid, scope={"location_id": loc}))) == {"C"}
+    sid = db.create_count_session(wid, "solo nota")   # posicional: nota, sesión vacía
+    assert _lines(sid) == {}
+    with pytest.raises(ValueError):
+        db.create_count_session(wid, scope={"zona": 1})
+
+
+def test_count_lines_reject_unknown_codes(wid):
+    sid = db.create_count_session(wid, scope="all")
+    with pytest.raises(ValueError, match="NOPE"):
+        db.update_count_lines(sid, {"A": 1, "NOPE": 3})
+    assert _lines(sid)["A"] == (5, None)              # nada se aplicó
+    assert db.update_count_lines(sid, {" A ": 4, "B": 2}) == 2
+
+
+def test_reconcile_is_all_or_nothing(wid):
+    sid = db.create_count_session(wid, scope="all")
+    db.update_count_lines(sid, {"A": 7, "B": 0, "C": 8})
+    db.post_movement_doc("OUT", wid, [("B", 2)])      # B ya en 0: el conteo lo dejaría en -2
+    with pytest.raises(ValueError, match="negativa"):
+        db.reconcile_count_session(sid)
+    assert db.get_stock_for_codes(["A"]) == {"A": {wid: 5}}
+
+    db.update_count_lines(sid, {"B": 2})               # B sin diferencia
+    doc_id = db.reconcile_count_session(sid)
+    assert db.get_stock_for_codes(["A", "B", "C"]) == {"A": {wid: 7}, "B": {wid: 0}, "C": {wid: 8}}
+    assert [(ln["code"], ln["qty"]) for ln in db.list_doc_lines(doc_id)] == [("A", 2)]
+    assert db.verify_stock()["mismatch"] == 0
+    with pytest.raises(ValueError, match="cerrada"):
+        db.reconcile_count_session(sid)
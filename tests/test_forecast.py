@@ -0,0 +1,25 @@
+# Refrescos de demanda simultáneos: cada salida se suma una sola vez a demand_daily
+import threading
+
+import database as db
+import forecast as fc
+
+
+def test_concurrent_refresh_counts_once(tmp_path):
+    db.close_db()
+    db.init_db(str(tmp_path / "f.db"))
+    db.add_warehouse("Centro")
+    wid = db.list_warehouses()[0]["id"]
+    db.upsert_product("A", "Producto A", "", warehouse_id=wid)
+    db.post_movement_doc("IN", wid, [("A", 100)])
+    for _ in range(5):
+        db.post_movement_doc("OUT", wid, [("A", 2)])
+
+    threads = [threading.Thread(target=fc.refresh) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    fc.refresh()
+    assert db._conn.execute("SELECT SUM(qty) FROM demand_daily").fetchone()[0] == 10
+    db.close_db()
@@ -0,0 +1,22 @@
+# Índices de existencias desde las columnas planas de database.py
+import database as db
+import helpers as hp
+
+
+def test_stock_indexes_from_columns(tmp_path):
+    db.close_db()
+    db.init_db(str(tmp_path / "h.db"))
+    db.add_warehouse("Centro")
+    db.add_warehouse("Norte")
+    ws = {w["name"]: w["id"] for w in db.list_warehouses()}
+    db.upsert_product("A", "Producto A", "", warehouse_id=ws["Centro"])
+    db.upsert_product("B", "Producto B", "", warehouse_id=ws["Norte"])
+    db.post_movement_doc("IN", ws["Centro"], [("A", 4)])
+    db.post_movement_doc("IN", ws["Norte"], [("A", 1), ("B", 2)])
+
+    totals, per_wh, names = hp.build_stock_indexes(db)
+    assert totals == {"A": 5, "B": 2}
+    assert per_wh == {ws["Centro"]: {"A": 4}, ws["Norte"]: {"A": 1, "B": 2}}
+    assert names == {ws["Centro"]: "Centro", ws["Norte"]: "Norte"}
+    assert hp.get_stock_map(db, ws["Norte"]) == db.get_stock_map(ws["Norte"]) == {"A": 1, "B": 2}
+    db.close_db()
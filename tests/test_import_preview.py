@@ -0,0 +1,61 @@
+# Vista previa de importación: deltas en suma y reemplazo, alias, repetidos y vínculos
+import pandas as pd
+
+import database as db
+import import_preview as ipv
+
+PRODUCTS = pd.DataFrame.from_records([
+    (1, "A", "Producto A", True, 10),
+    (2, "B", "Producto B", True, 5),
+    (3, "C", "Producto C", False, 0),   # en catálogo, sin vínculo al almacén
+], columns=["id", "code", "name", "linked", "qty"])
+ALIASES = pd.DataFrame.from_records([("A-ALT", 1)], columns=["alt_code", "product_id"])
+
+
+def _rows(*rows):
+    return pd.DataFrame.from_records(rows, columns=["code", "name", "qty"])
+
+
+def test_sum_and_replace_deltas():
+    rows = _rows(("A", "", 3), ("A", "", 2), ("B", "", 1))
+    s = ipv.diff_frames(rows, PRODUCTS, ALIASES)
+    assert (s["increase"], s["increase_qty"], s["decrease"]) == (2, 6, 0)
+    assert s["duplicated"] == 1 and s["conflicts"] == 1   # A con cantidades distintas
+
+    r = ipv.diff_frames(rows, PRODUCTS, ALIASES, replace=True)
+    # A: el último renglón gana (2) -> baja 8; B: 5 -> 1 baja 4
+    assert (r["increase"], r["decrease"], r["decrease_qty"]) == (0, 2, 12)
+    assert sorted(r["samples"]["decrease"]) == [["A", 10, 2], ["B", 5, 1]]
+
+
+def test_alias_codes_are_reported_as_new():
+    s = ipv.diff_frames(_rows(("A-ALT", "", 1), ("Z", "Nuevo", 1), ("Z", "Nuevo", 1)), PRODUCTS, ALIASES)
+    assert s["new"] == 2 and s["alias_codes"] == 1
+    assert s["samples"]["alias_codes"] == ["A-ALT"] and sorted(s["samples"]["new"]) == ["A-ALT", "Z"]
+    assert s["duplicated"] == 1 and s["conflicts"] == 0     # Z repetido con los mismos datos
+
+
+def test_unlinked_renamed_and_skipped():
+    s = ipv.diff_frames(_rows(("C", "Otro nombre", 0), (" ", "", 4), ("B", "Producto B", 0)), PRODUCTS, ALIASES)
+    assert s["link"] == 1 and s["skipped"] == 1 and s["rows"] == 2
+    assert s["renamed"] == 1 and s["samples"]["renamed"] == [["C", "Producto C", "Otro nombre"]]
+    assert s["unchanged"] == 2 and s["new"] == 0
+
+
+def test_preview_matches_import(tmp_path):
+    db.close_db()
+    db.init_db(str(tmp_path / "i.db"))
+    db.add_warehouse("Centro")
+    db.add_warehouse("Norte")
+    ws = {w["name"]: w["id"] for w in db.list_warehouses()}
+    db.upsert_product("A", "Producto A", "", warehouse_id=ws["Centro"])
+    db.upsert_product("C", "Producto C", "", warehouse_id=ws["Norte"])
+    rows = [{"code": "A", "name": "", "description": "", "qty": 2},
+            {"code": "C", "name": "", "description": "", "qty": 1},
+            {"code": "N", "name": "Nuevo", "description": "", "qty": 3}]
+    res = ipv.preview(rows, ws["Centro"])
+    out = db.import_products(rows, ws["Centro"])
+    assert (res["new"], res["link"], res["increase_qty"]) == (out["created"], 1, 6)
+    assert db.get_stock_for_codes(["A", "C", "N"]) == {"A": {ws["Centro"]: 2}, "C": {ws["Centro"]: 1, ws["Norte"]: 0},
+                                                       "N": {ws["Centro"]: 3}}
+    db.close_db()
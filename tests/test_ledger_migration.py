@@ -0,0 +1,67 @@
+# Migración del kardex de texto (stock_movements) a stock_ledger: mismas filas por la vista de compatibilidad
+import sqlite3
+
+import database as db
+
+LEGACY_DDL = """
+CREATE TABLE stock_movements(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts DATETIME DEFAULT CURRENT_TIMESTAMP,
+    product_id   INTEGER NOT NULL,
+    warehouse_id INTEGER NOT NULL,
+    qty INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    note TEXT DEFAULT '',
+    ref_id INTEGER,
+    doc_id INTEGER,
+    FOREIGN KEY(product_id)   REFERENCES products(id)   ON DELETE CASCADE,
+    FOREIGN KEY(warehouse_id) REFERENCES warehouses(id) ON DELETE CASCADE,
+    FOREIGN KEY(doc_id)       REFERENCES movement_docs(id) ON DELETE SET NULL
+)"""
+
+
+def _movements():
+    return [tuple(r) for r in db._conn.execute("SELECT * FROM stock_movements ORDER BY id")]
+
+
+def test_legacy_movements_survive_migration(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    db.close_db()
+    db.init_db(path)
+    db.add_warehouse("Centro")
+    db.add_warehouse("Norte")
+    src, dst = (w["id"] for w in db.list_warehouses())
+    for code in ("A", "B"):
+        db.upsert_product(code, f"Producto {code}", "", warehouse_id=src)
+    db.post_movement_doc("IN", src, [("A", 10), ("B", 4)], note="Compra")
+    db.post_movement_doc("OUT", src, [("A", 3)])
+    db.post_transfer_order(src, dst, [("A", 2), ("B", 1)])
+    pid_a = db._conn.execute("SELECT id FROM products WHERE code = 'A'").fetchone()[0]
+    # INSERT por la vista (trigger): fecha explícita y nota repetida
+    db._conn.execute("INSERT INTO stock_movements(ts, product_id, warehouse_id, qty, kind, note) "
+                     "VALUES ('2024-02-29 23:59:59', ?, ?, 1, 'ADJ', 'Compra')", (pid_a, src))
+    db._conn.commit()
+    rows = _movements()
+    db.close_db()
+
+    # Base anterior al kardex compacto: stock_movements como tabla de texto, stock_ledger vacío
+    conn = sqlite3.connect(path)
+    conn.execute("DROP VIEW stock_movements")
+    conn.execute("DELETE FROM stock_ledger")
+    conn.execute(LEGACY_DDL)
+    conn.executemany("INSERT INTO stock_movements VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    orphan = (rows[-1][0] + 1, "2023-01-01 00:00:00", 9999, src, 7, "IN", "", None, None)
+    conn.execute("INSERT INTO stock_movements VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", orphan)
+    conn.commit()
+    conn.close()
+
+    db.init_db(path)
+    try:
+        kind = db._conn.execute("SELECT type FROM sqlite_master WHERE name = 'stock_movements'").fetchone()[0]
+        assert kind == "view"
+        assert _movements() == rows + [orphan]     # huérfanos incluidos, tal cual
+        # el kardex continúa después del último id migrado
+        db.post_movement_doc("IN", src, [("B", 1)])
+        assert _movements()[-1][0] > orphan[0]
+    finally:
+        db.close_db()
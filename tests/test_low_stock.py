@@ -0,0 +1,68 @@
+# Bandera is_low por triggers: cambios de umbral, IN/OUT que cruzan el umbral y relleno al migrar
+import sqlite3
+
+import pytest
+
+import database as db
+
+
+def _flags(wid):
+    return dict(db._conn.execute("""SELECT p.code, pw.is_low FROM product_warehouse pw
+                                    JOIN products p ON p.id = pw.product_id WHERE pw.warehouse_id = ?""", (wid,)))
+
+
+@pytest.fixture
+def wid(tmp_path):
+    db.close_db()
+    db.init_db(str(tmp_path / "l.db"))
+    db.add_warehouse("Centro")
+    wid = db.list_warehouses()[0]["id"]
+    for code, qty in (("A", 5), ("B", 0), ("C", 20)):
+        db.upsert_product(code, f"Producto {code}", "", warehouse_id=wid)
+        if qty:
+            db.post_movement_doc("IN", wid, [(code, qty)])
+    yield wid
+    db.close_db()
+
+
+def test_threshold_changes(wid):
+    assert _flags(wid) == {"A": 0, "B": 1, "C": 0}       # sin umbral: solo qty = 0
+    db.set_threshold("A", wid, 5)                         # qty <= umbral
+    db.set_threshold("C", wid, 19)
+    assert _flags(wid) == {"A": 1, "B": 1, "C": 0}
+    db.set_threshold("A", wid, 4)
+    db.set_threshold("C", wid, 20)
+    assert _flags(wid) == {"A": 0, "B": 1, "C": 1}
+    db.set_threshold("C", wid, 0)                         # 0 = sin umbral
+    assert _flags(wid) == {"A": 0, "B": 1, "C": 0}
+    assert db.count_low_stock(wid) == 1 == len(db.list_low_stock(wid))
+
+
+def test_movements_cross_threshold(wid):
+    db.set_threshold("C", wid, 10)
+    db.post_movement_doc("OUT", wid, [("C", 10)])         # 20 -> 10: llega al umbral
+    assert _flags(wid)["C"] == 1
+    db.post_movement_doc("IN", wid, [("C", 1), ("B", 3)]) # 11 sale; B deja de estar en 0
+    assert _flags(wid) == {"A": 0, "B": 0, "C": 0}
+    db.post_movement_doc("OUT", wid, [("A", 5)])          # sin umbral: baja al llegar a 0
+    assert _flags(wid) == {"A": 1, "B": 0, "C": 0}
+    assert db.count_low_stock() == 1
+
+
+def test_backfill_on_migration(wid):
+    db.set_threshold("C", wid, 25)
+    path = db._conn.execute("PRAGMA database_list").fetchone()[2]
+    db.close_db()
+    # Base anterior a la bandera: sin columna, índice ni triggers
+    conn = sqlite3.connect(path)
+    for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'trg_low_%'").fetchall():
+        conn.execute(f"DROP TRIGGER {name}")
+    conn.execute("DROP INDEX idx_pw_low")
+    conn.execute("ALTER TABLE product_warehouse DROP COLUMN is_low")
+    conn.commit()
+    conn.close()
+
+    db.init_db(path)
+    assert _flags(wid) == {"A": 0, "B": 1, "C": 1}
+    db.post_movement_doc("OUT", wid, [("A", 5)])          # los triggers vuelven a quedar activos
+    assert _flags(wid)["A"] == 1
@@ -0,0 +1,26 @@
+# Regresión de planes: tools/query_plans.py debe terminar sin hallazgos
+import os
+import subprocess
+import sys
+
+TOOLS = os.path.join(os.path.dirname(__file__), "..", "tools")
+sys.path.insert(0, TOOLS)
+
+import query_plans  # noqa: E402
+
+
+def test_problems_flags_scans_and_temp_btrees():
+    sql = "SELECT p.code FROM products p JOIN warehouses w ON w.id = 1 ORDER BY p.name"
+    found, used = query_plans.problems(["SCAN p", "SCAN w", "USE TEMP B-TREE FOR ORDER BY"], sql)
+    assert found == ["SCAN p", "USE TEMP B-TREE FOR ORDER BY"] and used == set()
+    found, used = query_plans.problems(["SCAN p"], sql, allowed=("SCAN p",))
+    assert found == [] and used == {"SCAN p"}
+    assert query_plans.problems(["USE TEMP B-TREE FOR ORDER BY"], "SELECT name FROM warehouses ORDER BY name")[0] == []
+
+
+def test_all_database_queries_pass():
+    # Proceso aparte: la herramienta envuelve las funciones de database.py mientras revisa
+    res = subprocess.run([sys.executable, os.path.join(TOOLS, "query_plans.py")],
+                         capture_output=True, text=True, timeout=600)
+    assert res.returncode == 0, res.stdout + res.stderr
+    assert "Planes OK" in res.stdout
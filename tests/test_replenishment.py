@@ -0,0 +1,26 @@
+# Sugerencias de pedido: múltiplos y tope max_qty
+import pandas as pd
+
+import replenishment as rp
+
+
+def _frame(**cols):
+    base = {"qty": 0, "threshold": 0, "has_rule": True, "min_qty": 0, "max_qty": 0, "reorder_point": 0,
+            "multiple": 1, "lead_time_days": 0, "daily_demand": 0.0}
+    base.update(cols)
+    return pd.DataFrame({k: [v] for k, v in base.items()})
+
+
+def test_rounds_up_to_multiple_under_max():
+    res = rp.compute_orders(_frame(qty=2, max_qty=100, reorder_point=10, multiple=6))
+    assert res["order_qty"].iloc[0] == 96
+
+
+def test_headroom_below_multiple_still_orders_one():
+    res = rp.compute_orders(_frame(qty=8, max_qty=10, reorder_point=9, multiple=6))
+    assert res["order_qty"].iloc[0] == 6
+
+
+def test_above_reorder_point_orders_nothing():
+    res = rp.compute_orders(_frame(qty=30, max_qty=40, reorder_point=10, multiple=12))
+    assert res["order_qty"].iloc[0] == 0
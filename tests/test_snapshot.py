@@ -0,0 +1,51 @@
+# Snapshot de la base en RAM: con escrituras continuas la copia termina (tope de reinicios)
+import sqlite3
+import threading
+
+import backup
+import database as db
+
+
+def test_snapshot_finishes_under_continuous_writes(tmp_path, monkeypatch):
+    snap = str(tmp_path / "snap.db")
+    db.close_db()
+    db.init_db(snap, backend="memory")
+    db.add_warehouse("Centro")
+    wid = db.list_warehouses()[0]["id"]
+    db.import_products([{"code": f"P{i:05d}", "name": "x" * 40, "description": "", "qty": 1}
+                        for i in range(5000)], wid)
+    monkeypatch.setattr(db, "SNAPSHOT_PAGES", 1)
+    restarts = []
+    copy = backup._copy
+    monkeypatch.setattr(backup, "_copy", lambda *a, **k: restarts.append(copy(*a, **k)))
+
+    stop = threading.Event()
+
+    def writes():
+        conn = db.open_connection()
+        try:
+            while not stop.is_set():
+                conn.execute("INSERT INTO stock_ledger(product_id, warehouse_id, qty, kind) VALUES (1, ?, 0, 1)",
+                             (wid,))
+                conn.commit()
+        finally:
+            conn.close()
+
+    t = threading.Thread(target=writes, daemon=True)
+    t.start()
+    try:
+        done = []
+        s = threading.Thread(target=lambda: done.append(db.save_snapshot(force=True)), daemon=True)
+        s.start()
+        s.join(30)
+        assert done == [True]
+    finally:
+        stop.set()
+        t.join()
+    assert restarts and restarts[0] <= backup.BACKUP_MAX_RESTARTS
+    conn = sqlite3.connect(snap)
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM products").fetchone()[0] == 5000
+    finally:
+        conn.close()
+    db.close_db()
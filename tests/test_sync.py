@@ -0,0 +1,142 @@
+# Sincronización entre dos sitios (dos archivos .db abiertos por turnos en el mismo proceso)
+import pytest
+
+import database as db
+import sync
+
+
+def _use(path):
+    db.close_db()
+    db.init_db(str(path))
+
+
+def _wh(name):
+    return next(w["id"] for w in db.list_warehouses() if w["name"] == name)
+
+
+def _stock():
+    return {(r[0], r[1]): r[2] for r in db._conn.execute("""
+        SELECT p.code, w.name, s.qty FROM product_stock s
+        JOIN products p ON p.id = s.product_id JOIN warehouses w ON w.id = s.warehouse_id""")}
+
+
+def _send(src, dst):
+    _use(dst)
+    peer = sync.site_id()
+    _use(src)
+    batch = sync.export_changes(sync.peer_state(peer)["sent"])
+    _use(dst)
+    res = sync.apply_changes(sync.loads(sync.dumps(batch)))
+    _use(src)
+    sync.ack(peer, res["ack"])
+    return res
+
+
+def test_out_and_transfer_sync(tmp_path):
+    a, b = tmp_path / "a.db", tmp_path / "b.db"
+    _use(b)
+    _use(a)
+    db.add_warehouse("Centro")
+    db.add_warehouse("Norte")
+    db.upsert_product("A", "Producto A", "", warehouse_id=_wh("Centro"))
+    db.post_movement_doc("IN", _wh("Centro"), [("A", 10)])
+    _send(a, b)
+
+    # Día de ventas: el neto del lote es de salida
+    _use(a)
+    db.post_movement_doc("OUT", _wh("Centro"), [("A", 1)])
+    db.post_transfer_order(_wh("Centro"), _wh("Norte"), [("A", 4)])
+    expected = _stock()
+    res = _send(a, b)
+    assert res["ledger"] == 3
+
+    _use(b)
+    assert _stock() == expected
+    # XFER-IN ligado a su XFER-OUT local, no al id del remitente
+    rows = db._conn.execute("""
+        SELECT i.ref_id, o.id FROM stock_ledger i
+        JOIN stock_ledger o ON o.doc_id = i.doc_id AND o.kind = ?
+        WHERE i.kind = ?""", (db.MOVEMENT_KINDS["XFER-OUT"], db.MOVEMENT_KINDS["XFER-IN"])).fetchall()
+    assert rows and all(ref == out_id for ref, out_id in rows)
+    db.close_db()
+
+
+def _export(src, dst):
+    _use(dst)
+    peer = sync.site_id()
+    _use(src)
+    return peer, sync.loads(sync.dumps(sync.export_changes(sync.peer_state(peer)["sent"])))
+
+
+def _seed(tmp_path):
+    a, b = tmp_path / "a.db", tmp_path / "b.db"
+    _use(b)
+    _use(a)
+    db.add_warehouse("Centro")
+    db.upsert_product("A", "Producto A", "", warehouse_id=_wh("Centro"))
+    db.upsert_product("B", "Producto B", "", warehouse_id=_wh("Centro"))
+    db.add_product_alias("A", "A-ALT")
+    db.post_movement_doc("IN", _wh("Centro"), [("A", 10)])
+    _send(a, b)
+    return a, b
+
+
+def test_reapplying_a_batch_changes_nothing(tmp_path):
+    a, b = _seed(tmp_path)
+    _use(a)
+    db.post_movement_doc("OUT", _wh("Centro"), [("A", 3)])
+    _, batch = _export(a, b)
+    _use(b)
+    first = sync.apply_changes(batch)
+    again = sync.apply_changes(batch)
+    assert (first["docs"], first["ledger"]) == (1, 1) and (again["docs"], again["ledger"]) == (0, 0)
+    assert _stock()[("A", "Centro")] == 7
+    assert db._conn.execute("SELECT COUNT(*) FROM stock_ledger").fetchone()[0] == 2
+    db.close_db()
+
+
+def test_skipped_batch_is_a_gap(tmp_path):
+    a, b = _seed(tmp_path)
+    _use(a)
+    db.post_movement_doc("OUT", _wh("Centro"), [("A", 1)])
+    peer, first = _export(a, b)
+    sync.ack(peer, first["until"])          # el origen cree que ya se aplicó
+    db.post_movement_doc("OUT", _wh("Centro"), [("A", 1)])
+    _, second = _export(a, b)
+    _use(b)
+    with pytest.raises(ValueError, match="Falta un lote anterior"):
+        sync.apply_changes(second)
+    assert _stock()[("A", "Centro")] == 10
+    sync.apply_changes(first)
+    sync.apply_changes(second)
+    assert _stock()[("A", "Centro")] == 8
+    db.close_db()
+
+
+def test_catalog_only_delta_after_ack(tmp_path):
+    a, b = _seed(tmp_path)
+    _use(a)
+    db.upsert_product("B", "Producto B (nuevo nombre)", None, None)
+    _, batch = _export(a, b)
+    s = sync.summary(batch)
+    assert (s["products"], s["aliases"], s["docs"], s["ledger"]) == (1, 0, 0, 0)
+    assert batch["products"]["rows"][0][:2] == ["B", "Producto B (nuevo nombre)"]
+    db.close_db()
+
+
+def test_alias_delete_rename_and_product_delete(tmp_path):
+    a, b = _seed(tmp_path)
+    _use(a)
+    db._conn.execute("DELETE FROM product_codes WHERE alt_code = 'A-ALT'")
+    db._conn.execute("UPDATE products SET code = 'A2' WHERE code = 'A'")
+    db._conn.execute("DELETE FROM products WHERE code = 'B'")   # sin kardex: se puede borrar
+    db._conn.commit()
+    res = _send(a, b)
+    assert (res["renamed"], res["deleted"]) == (1, 1)
+
+    _use(b)
+    codes = [r[0] for r in db._conn.execute("SELECT code FROM products ORDER BY code")]
+    assert codes == ["A2"]
+    assert db._conn.execute("SELECT COUNT(*) FROM product_codes").fetchone()[0] == 0
+    assert _stock() == {("A2", "Centro"): 10}       # la historia sigue en el mismo producto
+    db.close_db()
@@ -0,0 +1,56 @@
+# Orden de transferencia de varias líneas: todo o nada, XFER-IN ligado a su XFER-OUT y un solo documento
+import pytest
+
+import database as db
+
+
+@pytest.fixture
+def whs(tmp_path):
+    db.close_db()
+    db.init_db(str(tmp_path / "t.db"))
+    db.add_warehouse("Origen")
+    db.add_warehouse("Destino")
+    ids = {w["name"]: w["id"] for w in db.list_warehouses()}
+    src, dst = ids["Origen"], ids["Destino"]
+    for code, qty in (("A", 10), ("B", 3), ("C", 5)):
+        db.upsert_product(code, f"Producto {code}", "", warehouse_id=src)
+        db.post_movement_doc("IN", src, [(code, qty)])
+    db.add_product_alias("A", "A-ALT")
+    yield src, dst
+    db.close_db()
+
+
+def test_short_line_rejects_whole_order(whs):
+    src, dst = whs
+    before = db.get_stock_for_codes(["A", "B", "C"])
+    docs = db._conn.execute("SELECT COUNT(*) FROM movement_docs").fetchone()[0]
+    with pytest.raises(ValueError, match="'B': req 4 > disp 3"):
+        db.post_transfer_order(src, dst, [("A", 2), ("B", 4), ("C", 1)])
+    assert db.get_stock_for_codes(["A", "B", "C"]) == before
+    assert db._conn.execute("SELECT COUNT(*) FROM movement_docs").fetchone()[0] == docs
+    assert db._conn.execute("SELECT COUNT(*) FROM stock_ledger WHERE kind IN (?, ?)",
+                            (db.MOVEMENT_KINDS["XFER-OUT"], db.MOVEMENT_KINDS["XFER-IN"])).fetchone()[0] == 0
+
+
+def test_order_links_legs_and_document(whs):
+    src, dst = whs
+    # A llega por código y por alias: una sola línea de 6
+    doc_id = db.post_transfer_order(src, dst, [("A", 4), ("A-ALT", 2), ("B", 3)], reference="R-1")
+    stock = db.get_stock_for_codes(["A", "B"])
+    assert stock["A"][src] == 4 and stock["A"][dst] == 6
+    assert stock["B"][src] == 0 and stock["B"][dst] == 3
+
+    doc = db._conn.execute("""SELECT doc_type, warehouse_id, dst_warehouse_id, total_lines, total_qty
+                              FROM movement_docs WHERE id = ?""", (doc_id,)).fetchone()
+    assert tuple(doc) == ("XFER", src, dst, 2, 9)
+    legs = db._conn.execute("""SELECT id, product_id, warehouse_id, qty, kind, ref_id FROM stock_ledger
+                               WHERE doc_id = ? ORDER BY id""", (doc_id,)).fetchall()
+    out = {r[1]: r for r in legs if r[4] == db.MOVEMENT_KINDS["XFER-OUT"]}
+    inn = {r[1]: r for r in legs if r[4] == db.MOVEMENT_KINDS["XFER-IN"]}
+    assert len(legs) == 4 and set(out) == set(inn)
+    for pid, o in out.items():
+        i = inn[pid]
+        assert (o[2], i[2], o[3]) == (src, dst, i[3])
+        assert i[5] == o[0] and o[5] is None
+    assert sorted((ln["code"], ln["qty"]) for ln in db.list_doc_lines(doc_id)) == [("A", 6), ("A", 6), ("B", 3), ("B", 3)]
+    assert db.verify_stock()["mismatch"] == 0
@@ -0,0 +1,43 @@
+# Almacén marcado para borrado: fuera de los KPI globales y sin escrituras nuevas
+import sqlite3
+
+import pytest
+
+import catalog
+import database as db
+
+
+def test_deleting_warehouse_rejects_writes_and_leaves_kpis(tmp_path):
+    db.close_db()
+    db.init_db(str(tmp_path / "w.db"))
+    db.add_warehouse("Centro")
+    db.add_warehouse("Norte")
+    ws = {w["name"]: w["id"] for w in db.list_warehouses()}
+    db.upsert_product("A", "Producto A", "", warehouse_id=ws["Centro"])
+    db.set_threshold("A", ws["Centro"], 5)
+    db.post_movement_doc("IN", ws["Centro"], [("A", 3)])
+    db.post_movement_doc("IN", ws["Norte"], [("A", 7)])
+    db.set_threshold("A", ws["Norte"], 50)
+    assert db.get_stock_kpis(db.sql_today())["total_stock"] == 10
+    assert db.count_low_stock() == 2
+
+    db.begin_delete_warehouse(ws["Norte"])
+    k = db.get_stock_kpis(db.sql_today())
+    assert k["total_stock"] == 3 and ws["Norte"] not in k["per_wh"]
+    assert k["low_total"] == db.count_low_stock() == 1
+    detail = db.get_product_detail("A")
+    assert [w["warehouse_id"] for w in detail["warehouses"]] == [ws["Centro"]] and detail["total"] == 3
+    assert db.get_stock_for_codes(["A"]) == {"A": {ws["Centro"]: 3}}
+    assert catalog.get_catalog().stock_by_warehouse("A") == {ws["Centro"]: 3}
+
+    with pytest.raises(sqlite3.IntegrityError):
+        db.increment_stock("A", ws["Norte"], 1)
+    with pytest.raises(sqlite3.IntegrityError):
+        db.post_movement_doc("OUT", ws["Norte"], [("A", 1)])
+    with pytest.raises(sqlite3.IntegrityError):
+        db.post_transfer_order(ws["Centro"], ws["Norte"], [("A", 1)])
+    db.post_movement_doc("OUT", ws["Centro"], [("A", 1)])   # el resto sigue igual
+
+    assert db.run_delete_warehouse(ws["Norte"], pause=0)
+    assert db.verify_stock()["mismatch"] == 0
+    db.close_db()
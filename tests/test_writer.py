@@ -0,0 +1,88 @@
+# Escritor único: group commit con SAVEPOINT por operación y sin Futures colgados
+import threading
+
+import pytest
+
+import database as db
+import writer
+
+
+def test_open_failure_fails_futures_and_submit(tmp_path, monkeypatch):
+    release = threading.Event()
+
+    def boom(path=None):
+        release.wait(5)   # el hilo no falla hasta que ya hay algo encolado
+        raise OSError("sin disco")
+
+    monkeypatch.setattr(db, "open_connection", boom)
+    w = writer.WriteQueue(str(tmp_path / "x.db"))
+    fut = w.submit(lambda c: 1)
+    release.set()
+    with pytest.raises(OSError):
+        fut.result(timeout=5)
+    w._thread.join(5)
+    with pytest.raises(RuntimeError, match="Escritor no disponible"):
+        w.submit(lambda c: 1)
+
+
+def _put(c, key):
+    c.execute("INSERT INTO app_state(key, value) VALUES (?, 'x')", (key,))
+    return key
+
+
+def _put_then_fail(c, key):
+    _put(c, key)
+    raise ValueError("falla a mitad")
+
+
+def test_group_commit_rolls_back_only_the_failing_op(tmp_path):
+    path = str(tmp_path / "w.db")
+    db.close_db()
+    db.init_db(path)
+    running, gate = threading.Event(), threading.Event()
+    w = writer.WriteQueue(path, max_ops=10, window=0.5).start()
+    try:
+        # el primer lote ocupa al hilo; lo que llegue mientras tanto se confirma junto en el siguiente
+        w.submit(lambda c: (running.set(), gate.wait(5)))
+        assert running.wait(5)
+        futs = {}
+
+        def caller(key, fn):
+            futs[key] = w.submit(fn, key)
+
+        threads = [threading.Thread(target=caller, args=(k, _put_then_fail if k == "k2" else _put))
+                   for k in ("k1", "k2", "k3", "k4")]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        gate.set()
+        assert {k: f.exception(timeout=5) is None for k, f in futs.items()} == \
+            {"k1": True, "k2": False, "k3": True, "k4": True}
+        assert isinstance(futs["k2"].exception(), ValueError)
+        assert [futs[k].result() for k in ("k1", "k3", "k4")] == ["k1", "k3", "k4"]
+        assert w.stats["commits"] == 2 and w.stats["ops"] == 4 and w.stats["errors"] == 1
+        keys = {r[0] for r in db._conn.execute("SELECT key FROM app_state WHERE key LIKE 'k%'")}
+        assert keys == {"k1", "k3", "k4"}
+    finally:
+        w.stop()
+        db.close_db()
+
+
+def test_submit_after_stop_runs_on_a_new_thread(tmp_path):
+    db.close_db()
+    db.init_db(str(tmp_path / "s.db"))
+    w = writer.WriteQueue(str(tmp_path / "s.db")).start()
+    try:
+        assert w.submit(lambda c: c.execute("SELECT 1").fetchone()[0]).result(timeout=5) == 1
+        stopper = threading.Thread(target=w.stop)
+        futs = []
+        stopper.start()
+        for _ in range(20):
+            futs.append(w.submit(lambda c: 2))
+        stopper.join()
+        # cada Future se resuelve: en el hilo que se detuvo o en uno nuevo, nunca queda colgado
+        assert [f.result(timeout=5) for f in futs] == [2] * 20
+    finally:
+        w.stop()
+        db.close_db()
@@ -0,0 +1,391 @@
+# query_plans.py
+# Regresión de planes de consulta: siembra una base temporal, llama a todas las funciones públicas
+# de database.py capturando cada sentencia (trace callback, con parámetros ya sustituidos, también
+# en las conexiones propias de los trabajos en segundo plano) y revisa su EXPLAIN QUERY PLAN.
+# Falla (código de salida 1) si:
+#   - aparece un SCAN de una tabla grande o un TEMP B-TREE que no esté permitido para esa ruta
+#     (permitido = línea exacta del plan, índice incluido);
+#   - una sentencia no se puede explicar (OperationalError);
+#   - una función pública de database.py no se ejerció y no está en SIN_REVISAR;
+#   - un permiso de una ruta ya no aparece en su plan (permiso obsoleto).
+# Herramienta de desarrollo: vive fuera de src/ para no ir en el build de la app.
+#
+#   python tools/query_plans.py [--products 20000] [--warehouses 4] [-v]
+
+import argparse
+import os
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import database as db  # noqa: E402
+
+# Tablas chicas por naturaleza: recorrerlas completas no es un problema
+SMALL_TABLES = {"warehouses", "users", "app_state", "suppliers", "customers", "warehouse_locations",
+                "count_sessions", "adjustments", "movement_kinds", "sync_peers",
+                "_tmp_pairs", "_tmp_codes", "_tmp_alias", "_count_deltas", "_ledger_qty"}
+
+# Funciones públicas que no se revisan (no leen tablas de datos o son de arranque/mantenimiento)
+SIN_REVISAR = {
+    "init_db": "arranque: esquema y migraciones",
+    "open_connection": "abre conexiones (se traza, no consulta)",
+    "is_memory_backend": "sin SQL",
+    "save_snapshot": "solo backend en memoria (API de backup)",
+    "close_db": "sin consultas",
+    "ensure_color_column": "migración de arranque",
+    "ensure_products_table": "migración de arranque",
+    "ensure_security_audit_schema": "migración de arranque",
+    "ensure_movement_doc_series_status": "migración de arranque",
+    "sql_today": "sin tablas",
+    "verify_stock": "revisión de integridad: recorre todo a propósito",
+}
+
+_SCAN = re.compile(r"^SCAN (\w+)")
+_FROM = re.compile(r"\b(?:FROM|JOIN|INTO|UPDATE)\s+(?:temp\.)?(\w+)(?:\s+(?:AS\s+)?(\w+))?", re.IGNORECASE)
+_KEYWORDS = {"ON", "WHERE", "JOIN", "LEFT", "INNER", "CROSS", "GROUP", "ORDER", "LIMIT", "USING", "NATURAL",
+             "SET", "VALUES", "SELECT", "DEFAULT", "AS", "OR"}
+_DML = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "REPLACE")
+_TEMP_DDL = re.compile(r"^\s*(CREATE\s+(TEMP|TEMPORARY)\s+TABLE|CREATE\s+INDEX\s+(IF\s+NOT\s+EXISTS\s+)?temp\."
+                       r"|DROP\s+TABLE\s+(IF\s+EXISTS\s+)?temp\.)", re.IGNORECASE)
+
+
+def _paths(ctx: dict) -> list[tuple]:
+    """
+    (nombre, llamada, permitido). `permitido` son líneas exactas del plan aceptadas a propósito
+    para esa ruta (p. ej. el recorrido completo de una lectura de catálogo). Primero lecturas,
+    después escrituras (cambian la base sembrada) y al final el borrado de un almacén.
+    """
+    wid, wid2, code, code2, alias, doc_id, session_id = (
+        ctx["wid"], ctx["wid2"], ctx["code"], ctx["code2"], ctx["alias"], ctx["doc_id"], ctx["session_id"])
+    today = db.sql_today()
+    by_pw = "USE TEMP B-TREE FOR ORDER BY"
+    return [
+        # ---------- lecturas ----------
+        ("resolve code", lambda: db._get_product_by_any_code(code), ()),
+        ("resolve alias", lambda: db._get_product_by_any_code(alias), ()),
+        ("canonical code", lambda: db.resolve_to_canonical_code(alias), ()),
+        ("warehouses", lambda: (db.list_warehouses(), db.pending_warehouse_deletes()), ()),
+        # catálogo completo a propósito (listas, catálogo compartido, vista previa de importación)
+        ("products (catálogo)", db.list_products, ("SCAN products USING INDEX idx_products_code",)),
+        ("catalog rows", db.fetch_catalog_rows, ("SCAN products USING INDEX idx_products_code",)),
+        ("import index", lambda: db.fetch_import_index(wid), ("SCAN p", "SCAN product_codes")),
+        # o recorre el catálogo por código o ordena lo vinculado: con pocos almacenes gana recorrer
+        ("products by wh", lambda: db.list_products_by_warehouse(wid), ("SCAN p USING INDEX idx_products_code",)),
+        ("lookup stock", lambda: db.get_stock_for_codes([code, alias]), ()),
+        ("stock kpis", lambda: db.get_stock_kpis(today), ()),
+        ("threshold", lambda: db.get_threshold(code, wid), ()),
+        ("count low", lambda: db.count_low_stock(wid), ()),
+        ("count low all", lambda: db.count_low_stock(), ()),
+        ("list low", lambda: db.list_low_stock(wid), (by_pw,)),
+        ("list low by class", lambda: db.list_low_stock(wid, abc="A"), (by_pw,)),
+        ("class ids", lambda: db.fetch_class_product_ids("A", None, wid), ()),
+        ("class map", lambda: (db.get_class_map(wid), db.get_class_as_of()), ()),
+        ("purchase suggestions", lambda: db.list_purchase_suggestions(wid), (by_pw,)),
+        ("no movement", lambda: db.list_no_movement(30, wid), (by_pw,)),
+        ("count cold", lambda: db.count_cold_products(30, wid), ()),
+        ("count cold all", lambda: db.count_cold_products(30),
+         ("SCAN products USING COVERING INDEX idx_products_wh", "USE TEMP B-TREE FOR count(DISTINCT)")),
+        # LIMIT sobre el orden del índice de fechas (recorrido al revés, se corta en `limit`)
+        ("movements", lambda: db.list_movements(limit=200), ("SCAN m USING INDEX idx_ledger_ts",)),
+        ("movements by wh", lambda: db.list_movements(warehouse_id=wid, limit=200), ()),
+        ("movements by wh+days", lambda: db.list_movements(warehouse_id=wid, days=7, limit=200), ()),
+        ("movements by days", lambda: db.list_movements(days=1, limit=100000), ()),
+        ("movements by code", lambda: db.list_movements(code_or_alias=code, limit=200), ()),
+        ("movements by code+wh", lambda: db.list_movements(wid, code, limit=200), ()),
+        ("ledger since", lambda: list(db.iter_ledger(since=today, warehouse_id=wid)), ()),
+        ("doc", lambda: db.get_movement_doc(doc_id), ()),
+        ("doc lines", lambda: db.list_doc_lines(doc_id), ()),
+        ("product detail", lambda: db.get_product_detail(alias), ()),
+        ("stock map", lambda: db.get_stock_map(wid), ()),
+        ("stock columns", lambda: db.fetch_stock_columns(wid), ()),
+        ("stock pairs (ids)", lambda: db.fetch_stock_pairs([1, 2, 3]), ()),
+        ("change marks", lambda: (db.fetch_change_marks(), db.fetch_ledger_product_ids(10, 20)), ()),
+        ("categories", db.list_categories, ("SCAN products", "USE TEMP B-TREE FOR DISTINCT")),
+        ("rule", lambda: db.get_replenishment_rule(code, wid), ()),
+        ("rules by wh", lambda: db.list_replenishment_rules(wid), (by_pw,)),
+        ("replenishment inputs", lambda: db.fetch_replenishment_inputs(wid), ()),
+        ("out demand", lambda: db.fetch_out_demand(30, wid), ("USE TEMP B-TREE FOR GROUP BY",)),
+        ("out demand all", lambda: db.fetch_out_demand(30), ("USE TEMP B-TREE FOR GROUP BY",)),
+        ("out buckets", lambda: db.fetch_out_buckets_after(0, today), ("USE TEMP B-TREE FOR GROUP BY",)),
+        ("demand state", db.get_demand_sync_state, ()),
+        ("demand buckets", lambda: db.fetch_demand_buckets(today), ()),
+        ("demand cover", lambda: db.list_demand_cover(wid), ()),
+        # recorre la caché de pronóstico (una fila por par con salidas)
+        ("stockout risk", lambda: db.count_stockout_risk(7), ("SCAN f",)),
+        ("product location", lambda: (db.get_product_location(wid, code), db.list_locations(wid)), ()),
+        ("partners", lambda: (db.list_suppliers(), db.list_customers()), ()),
+        ("linked", lambda: db.is_product_linked(code, wid), ()),
+        ("last warehouse", db.load_last_warehouse_id, ()),
+        ("users", lambda: (db.get_user_by_username("admin"), db.verify_user_password("admin", "x"),
+                           db.list_active_users()), ()),
+        # única sesión sembrada: la tabla entera es la sesión
+        ("count lines", lambda: db.list_count_lines(session_id), ("SCAN cl", by_pw)),
+        ("warehouse delete steps", lambda: [db._conn.execute(select + " LIMIT ?", (wid, 1)).fetchall()
+                                            for _, select in db._WAREHOUSE_DELETE_STEPS], ()),
+        ("audit by entity", lambda: db._conn.execute(
+            "SELECT * FROM audit_log WHERE entity = 'movement_docs' AND entity_id = ? ORDER BY id",
+            (doc_id,)).fetchall(), ()),
+        ("audit recent", lambda: db._conn.execute(
+            "SELECT * FROM audit_log WHERE ts >= datetime('now', '-1 days') ORDER BY ts DESC LIMIT 100"
+        ).fetchall(), ()),
+        # ---------- escrituras ----------
+        ("admin", db.ensure_default_admin, ()),
+        ("user", lambda: db.update_user_password(db.create_user("qp", "QP", "viewer", "x"), "y"), ()),
+        ("audit", lambda: db.log_audit(None, "QP", "products", 1, ""), ()),
+        ("warehouse", lambda: db.add_warehouse("QP"), ()),
+        ("product", lambda: (db.upsert_product("QP-1", "QP", "", wid), db.upsert_product(code, "Renombrado", "", wid2),
+                             db.link_product_to_warehouse(code2, wid2),
+                             db.set_product_category_unit(code, "CAT", "pz", 1)), ()),
+        # carga masiva por conjuntos: DISTINCT/agrupados sobre la tabla temporal y un cruce con alias
+        ("alias", lambda: (db.add_product_alias(code, "QP-ALT"),
+                           db.import_aliases([("QP-A1", code), ("QP-A2", alias), ("QP-A3", "NOPE")])),
+         ("USE TEMP B-TREE FOR DISTINCT", "USE TEMP B-TREE FOR ORDER BY", "USE TEMP B-TREE FOR count(DISTINCT)",
+          "USE TEMP B-TREE FOR group_concat(DISTINCT)", "SCAN pc", "SCAN p USING COVERING INDEX idx_products_code")),
+        ("stock", lambda: (db.increment_stock(code, wid, 5), db.decrement_stock(code, wid, 1),
+                           db.set_stock(alias, wid, 9)), ()),
+        ("threshold set", lambda: db.set_threshold(code, wid, 3), ()),
+        ("movement doc", lambda: db.post_movement_doc("IN", wid, [(code, 2), (alias, 1)]), ()),
+        ("doc header", lambda: db.create_movement_doc("OUT", wid), ()),
+        ("transfer", lambda: (db.post_transfer_order(wid, wid2, [(code, 1)]), db.transfer_stock(code, wid, wid2, 1)), ()),
+        ("import", lambda: db.import_products([{"code": code, "name": "x", "description": "", "qty": 1},
+                                               {"code": "QP-2", "name": "y", "description": "", "qty": 1}], wid), ()),
+        ("import replace", lambda: db.import_products([{"code": code, "name": "x", "description": "", "qty": 4}],
+                                                      wid, replace=True), ()),
+        ("rule set", lambda: db.set_replenishment_rule(code, wid, 1, 10, 2, 1, 3), ()),
+        ("demand", lambda: (db.integrate_out_buckets(today), db.save_demand_forecast([(1, wid, 0, 0, 0, 1)], today),
+                            db.save_product_classes([(1, wid, 0, 0.0, "A", None, "Z")], today)),
+         ("USE TEMP B-TREE FOR GROUP BY",)),
+        ("partners set", lambda: (db.add_supplier("QP"), db.add_customer("QP"), db.add_supplier_if_not_exists("QP2"),
+                                  db.add_customer_if_not_exists("QP2"), db.update_supplier(1, "QP"),
+                                  db.update_customer(1, "QP"), db.delete_supplier(1), db.delete_customer(1)), ()),
+        ("location", lambda: (db.add_location(wid, "QP-L"), db.set_product_location(wid, code, None)), ()),
+        ("last warehouse set", lambda: db.save_last_warehouse_id(wid), ()),
+        ("adjustment", lambda: db.create_adjustment(wid, "QP", None, None), ()),
+        # única sesión grande sembrada: el planificador prefiere recorrer count_lines
+        ("count session", lambda: _count_session(wid, code), ("SCAN cl",)),
+        ("warehouse delete", lambda: db.delete_warehouse_cascade(wid2), ()),
+    ]
+
+
+def _count_session(wid: int, code: str):
+    sid = db.create_count_session(wid)
+    db.add_count_line(sid, code, 1)
+    db.update_count_line(sid, code, 2)
+    db.update_count_lines(sid, {code: 3})
+    db.reconcile_count_to_adjustments(sid, wid)
+    sid = db.create_count_session(wid, scope="all")
+    db.close_count_session(sid)
+
+
+def seed(path: str, n_products: int = 20000, n_wh: int = 4, n_moves: int = 100000) -> dict:
+    """Base sembrada con volúmenes suficientes para que el planificador use estadísticas reales."""
+    rnd = random.Random(7)
+    db.init_db(path)
+    c = db._conn
+    c.executemany("INSERT INTO warehouses(name) VALUES (?)", [(f"Almacén {i}",) for i in range(n_wh)])
+    wids = [r[0] for r in c.execute("SELECT id FROM warehouses ORDER BY id")]
+    c.executemany("INSERT INTO products(code, name, description) VALUES (?, ?, ?)",
+                  [(f"P{i:07d}", f"Producto {i}", "") for i in range(n_products)])
+    pids = [r[0] for r in c.execute("SELECT id FROM products ORDER BY id")]
+    pairs = [(p, w) for p in pids for w in rnd.sample(wids, rnd.randint(1, min(2, n_wh)))]
+    c.executemany("INSERT INTO product_warehouse(product_id, warehouse_id) VALUES (?, ?)", pairs)
+    c.executemany("INSERT INTO product_stock(product_id, warehouse_id, qty) VALUES (?, ?, ?)",
+                  [(p, w, rnd.randint(0, 50)) for p, w in pairs])
+    c.executemany("INSERT INTO product_threshold(product_id, warehouse_id, threshold) VALUES (?, ?, 10)",
+                  pairs[::3])
+    c.executemany("INSERT INTO product_codes(product_id, alt_code) VALUES (?, ?)",
+                  [(p, f"ALT{p}") for p in pids[::5]])
+    c.executemany("""INSERT INTO product_rules(product_id, warehouse_id, min_qty, max_qty, reorder_point, multiple, lead_time_days)
+                     VALUES (?, ?, 5, 50, 10, 1, 3)""", pairs[::4])
+    c.executemany("INSERT INTO movement_docs(doc_type, warehouse_id, ts) VALUES (?, ?, datetime('now', ?))",
+                  [(rnd.choice(["IN", "OUT"]), rnd.choice(wids), f"-{rnd.randint(0, 90)} days")
+                   for _ in range(n_moves // 20)])
+    n_docs = c.execute("SELECT MAX(id) FROM movement_docs").fetchone()[0]
+    moves = []
+    for _ in range(n_moves):
+        p, w = rnd.choice(pairs)
+        moves.append((p, w, rnd.randint(1, 5), rnd.choice(["IN", "OUT", "OUT"]),
+                      f"-{rnd.randint(0, 90)} days", rnd.randint(1, n_docs)))
+    c.executemany("""INSERT INTO stock_movements(product_id, warehouse_id, qty, kind, ts, doc_id)
+                     VALUES (?, ?, ?, ?, datetime('now', ?), ?)""", moves)
+    c.executemany("INSERT INTO audit_log(action, entity, entity_id, details, ts) VALUES (?, ?, ?, '', datetime('now', ?))",
+                  [("CREATE_DOC", "movement_docs", rnd.randint(1, n_docs), f"-{rnd.randint(0, 90)} days")
+                   for _ in range(n_moves // 2)])
+    c.executemany("INSERT INTO demand_daily(product_id, warehouse_id, day, qty) VALUES (?, ?, date('now', ?), 1)",
+                  [(p, w, f"-{d} days") for p, w in pairs[::10] for d in range(0, 30, 3)])
+    c.executemany("INSERT INTO demand_forecast(product_id, warehouse_id, as_of, rate) VALUES (?, ?, date('now'), 1.5)",
+                  pairs[::10])
+    c.executemany("""INSERT INTO product_class(product_id, warehouse_id, as_of, out_qty, cum_share, abc, cv, xyz)
+                     VALUES (?, ?, date('now'), 0, 0, ?, NULL, 'Z')""", [(p, w, rnd.choice("ABC")) for p, w in pairs])
+    c.commit()
+    session_id = db.create_count_session(wids[0], scope="all")
+    c.execute("ANALYZE")
+    c.commit()
+    code, wid = c.execute("""SELECT p.code, pw.warehouse_id FROM product_warehouse pw
+                             JOIN products p ON p.id = pw.product_id ORDER BY pw.product_id LIMIT 1""").fetchone()
+    wid2 = next(w for w in reversed(wids) if w != wid) if n_wh > 1 else wid
+    code2 = c.execute("""SELECT p.code FROM products p WHERE p.id NOT IN
+                         (SELECT product_id FROM product_warehouse WHERE warehouse_id = ?) LIMIT 1""",
+                      (wid2,)).fetchone()[0]
+    return {"wid": wid, "wid2": wid2, "code": code, "code2": code2, "alias": "ALT1",
+            "doc_id": n_docs // 2, "session_id": session_id}
+
+
+def _aliases(sql: str) -> dict:
+    """{alias: tabla} de los FROM/JOIN de la consulta (EXPLAIN muestra solo el alias)."""
+    out = {}
+    for table, alias in _FROM.findall(sql):
+        out[table] = table
+        if alias and alias.upper() not in _KEYWORDS:
+            out[alias] = table
+    return out
+
+
+def problems(plan: list[str], sql: str = "", allowed=()) -> tuple[list[str], set]:
+    """
+    (hallazgos, permisos usados). Hallazgo: todo 'SCAN' (con o sin índice: recorre la tabla o el
+    índice completo) sobre una tabla grande y todo 'TEMP B-TREE' en una consulta que toca alguna,
+    salvo las líneas en `allowed`.
+    """
+    aliases = _aliases(sql)
+    only_small = set(aliases.values()) <= SMALL_TABLES
+    out, used = [], set()
+    for detail in plan:
+        m = _SCAN.match(detail)
+        if not m and "TEMP B-TREE" not in detail:
+            continue
+        if m and (m.group(1) == "CONSTANT" or aliases.get(m.group(1), m.group(1)) in SMALL_TABLES):
+            continue
+        if not m and only_small:   # ordenar filas de tablas chicas
+            continue
+        if detail in allowed:
+            used.add(detail)
+        else:
+            out.append(detail)
+    return out, used
+
+
+def explain(conn: sqlite3.Connection, sql: str) -> list[str]:
+    return [r[3] for r in conn.execute("EXPLAIN QUERY PLAN " + sql).fetchall()]
+
+
+def _statements(captured: list[str]):
+    """Sentencias de la llamada en orden: ("ddl", sql) para tablas temporales, ("dml", sql) para el resto."""
+    for sql in captured:
+        s = sql.lstrip()
+        if s.startswith("--"):   # sentencias de triggers
+            continue
+        if _TEMP_DDL.match(s):
+            yield "ddl", s
+        elif s.upper().startswith(_DML):
+            yield "dml", s
+
+
+def _trace_all(captured: list[str]):
+    """Traza _conn y las conexiones propias (trabajos en segundo plano, exportaciones)."""
+    original = db.open_connection
+
+    def open_connection(*a, **kw):
+        conn = original(*a, **kw)
+        conn.set_trace_callback(captured.append)
+        return conn
+
+    db.open_connection = open_connection
+    db._conn.set_trace_callback(captured.append)
+    return original
+
+
+def _record_calls(called: set) -> dict:
+    """Envuelve las funciones públicas de database.py para saber cuáles se ejercieron."""
+    originals = {}
+    for name, fn in list(vars(db).items()):
+        if name.startswith("_") or not callable(fn) or getattr(fn, "__module__", None) != db.__name__ \
+                or isinstance(fn, type):
+            continue
+
+        def wrapper(*a, _fn=fn, _name=name, **kw):
+            called.add(_name)
+            return _fn(*a, **kw)
+
+        originals[name] = fn
+        setattr(db, name, wrapper)
+    return originals
+
+
+def check(path: str, ctx: dict, verbose: bool = False) -> int:
+    conn = sqlite3.connect(path)
+    captured: list[str] = []
+    called: set = set()
+    failures = 0
+    originals = _record_calls(called)
+    paths = _paths(ctx)
+    open_connection = _trace_all(captured)
+    try:
+        for name, call, allowed in paths:
+            captured.clear()
+            call()
+            seen, used = set(), set()
+            for kind, sql in _statements(list(captured)):
+                try:
+                    if kind == "ddl":
+                        conn.execute(sql)   # la tabla temporal existe también en esta conexión
+                        continue
+                    if sql in seen:
+                        continue
+                    seen.add(sql)
+                    plan = explain(conn, sql)
+                except sqlite3.Error as ex:
+                    failures += 1
+                    print(f"FALLA  {name}: no se pudo explicar ({ex})\n       {' '.join(sql.split())[:200]}")
+                    continue
+                bad, ok = problems(plan, sql, allowed)
+                used |= ok
+                if bad:
+                    failures += 1
+                    print(f"FALLA  {name}: {' | '.join(bad)}\n       {' '.join(sql.split())[:200]}")
+                elif verbose:
+                    print(f"ok     {name}: {' | '.join(plan)}")
+            for stale in sorted(set(allowed) - used):
+                failures += 1
+                print(f"FALLA  {name}: permiso sin uso '{stale}'")
+    finally:
+        db._conn.set_trace_callback(None)
+        db.open_connection = open_connection
+        for fname, fn in originals.items():
+            setattr(db, fname, fn)
+        conn.close()
+    for fname in sorted(set(originals) - called - set(SIN_REVISAR)):
+        failures += 1
+        print(f"FALLA  {fname}: función pública sin ruta en query_plans.py")
+    return failures
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Revisa EXPLAIN QUERY PLAN de todas las consultas de database.py")
+    ap.add_argument("--products", type=int, default=20000)
+    ap.add_argument("--warehouses", type=int, default=4)
+    ap.add_argument("-v", "--verbose", action="store_true")
+    args = ap.parse_args(argv)
+
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    try:
+        ctx = seed(path, args.products, args.warehouses, n_moves=args.products * 5)
+        failures = check(path, ctx, args.verbose)
+    finally:
+        db.close_db()
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.remove(path + suffix)
+            except OSError:
+                pass
+    print("Planes OK" if not failures else f"{failures} problema(s) en planes de consulta")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())